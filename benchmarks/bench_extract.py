@@ -0,0 +1,80 @@
+"""Сравнение полного и быстрого извлечения полей объявления.
+
+Запуск:
+    python benchmarks/bench_extract.py [сохранённые_страницы.html ...] [-n 20]
+
+Без аргументов используется синтетическая страница, похожая по структуре
+и размеру на страницу объявления krisha.kz.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser_engine  # noqa: E402
+
+
+# Функция для построения синтетической страницы объявления
+def build_sample_page(photos=30, noise_blocks=400,
+                      base='https://alaps-photos-kr.kcdn.kz/webp/3f/3fa1b2c3-0000-4000-8000-000000000000/'):
+    other = 'https://alaps-photos-kr.kcdn.kz/webp/aa/aa00ff00-0000-4000-8000-000000000000/'
+    head = ''.join(f'<script>window.__data{i} = {{"key": "{"x" * 200}"}};</script>' for i in range(50))
+    menu = ''.join(f'<li class="menu__item"><a href="/section/{i}">Раздел {i}</a></li>' for i in range(200))
+    gallery = ''.join(f'<img src="{base}{i}-120x90.webp" alt="Фото {i}">' for i in range(1, photos + 1))
+    offer = (
+        '<div class="offer__header"><h1 class="offer__title">2-комнатная квартира, 54 м², 5/9 этаж</h1></div>'
+        f'<div class="offer__gallery"><img src="{base}1-750x470.webp">{gallery}</div>'
+        '<div class="offer__sidebar"><div class="offer__price">32 500 000 〒</div>'
+        '<div class="offer__advert-title">2-комнатная квартира · 54 м² · 5/9 этажОставить заметку</div>'
+        '<div class="offer__location"><span>Алматы, Бостандыкский р-н</span></div>'
+        '<div class="offer__info-item">Адрес Абая 150 — Розыбакиева</div></div>'
+    )
+    noise = ''.join(
+        f'<div class="similar__item"><a href="/a/show/{i}"><img data-src="{other}{i}-280x175.webp">'
+        f'<div class="similar__title">Квартира {i}</div><p>{"Описание " * 30}</p></a></div>'
+        for i in range(noise_blocks)
+    )
+    return f'<html><head>{head}</head><body><ul>{menu}</ul>{offer}{noise}</body></html>'
+
+
+# Функция для измерения среднего времени вызова в миллисекундах
+def measure(func, html, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(html)
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк извлечения полей объявления")
+    parser.add_argument('pages', nargs='*', help="сохранённые HTML-страницы объявлений")
+    parser.add_argument('-n', '--repeat', type=int, default=20, help="количество повторов на страницу")
+    args = parser.parse_args(argv)
+
+    pages = []
+    for path in args.pages:
+        with open(path, 'r', encoding='utf-8') as f:
+            pages.append((os.path.basename(path), f.read()))
+    if not pages:
+        pages.append(('synthetic', build_sample_page()))
+
+    print(f"Парсер быстрого пути: {parser_engine.HTML_PARSER}")
+    failed = False
+    for name, html in pages:
+        full = parser_engine.extract_listing_full(html)
+        fast = parser_engine.extract_listing(html)
+        if full != fast:
+            failed = True
+            print(f"{name}: РАСХОЖДЕНИЕ ПОЛЕЙ\n  полный: {full}\n  быстрый: {fast}")
+            continue
+        full_ms = measure(parser_engine.extract_listing_full, html, args.repeat)
+        fast_ms = measure(parser_engine.extract_listing, html, args.repeat)
+        print(f"{name}: {len(html) // 1024} КБ, полный разбор {full_ms:.1f} мс, "
+              f"быстрый {fast_ms:.1f} мс, ускорение x{full_ms / fast_ms:.1f}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
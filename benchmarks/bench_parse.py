@@ -0,0 +1,177 @@
+"""Сквозной офлайн-бенчмарк парсинга на локальном сервере-заменителе.
+
+Запуск:
+    python benchmarks/bench_parse.py --listings 20 --photos 30 --latency-ms 20
+    python benchmarks/bench_parse.py --compare-workers 1,4,8,16
+    python benchmarks/bench_parse.py --drop-rate 0.2 --resume
+    python benchmarks/bench_parse.py --rate-limit 100
+    python benchmarks/bench_parse.py --reuse
+
+Печатает страниц/с, фото/с, МБ/с, p50/p95 времени задания и пиковую память.
+История, кэш страниц, хранилище фото и папки объявлений пишутся во временную папку.
+"""
+import argparse
+import logging
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import parser_engine  # noqa: E402
+from parser_cache import PageCache  # noqa: E402
+from parser_db import HistoryStore  # noqa: E402
+from parser_ratelimit import describe_limit  # noqa: E402
+from parser_store import PhotoStore  # noqa: E402
+from stand_server import StandConfig, StandServer  # noqa: E402
+
+
+# Функция для вычисления процентиля по отсортированному списку
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+# Функция для одного прогона: все объявления через планировщик движка
+# (folder — подпапка прогона: другая подпапка изображает отправку тех же объявлений другому клиенту)
+def run_once(server, work_dir, listings, workers, jobs, sync=False, folder='listing', store=True):
+    # Движок пишет историю, кэш и хранилище фото во временную папку, а не рядом с программой
+    parser_engine.history = HistoryStore(os.path.join(work_dir, 'parsing_history.db'))
+    parser_engine.page_cache = PageCache(os.path.join(work_dir, 'page_cache.db'), ttl=0)
+    parser_engine.photo_store = PhotoStore(os.path.join(work_dir, 'photo_store'))
+    parser_engine.photo_store.enabled = store
+    # Каждый прогон начинает с исходных ограничений хоста
+    parser_engine.rate_limiter.reset()
+    scheduler = parser_engine.JobScheduler(max_jobs=jobs, host_interval=0)
+
+    started_at = {}
+    latencies = []
+    downloaded = 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    submitted = []
+    for listing_id in range(1, listings + 1):
+        save_path = os.path.join(work_dir, f'{folder}_{listing_id}')
+        submitted.append(scheduler.submit(server.listing_url(listing_id), 'bench', save_path, workers, sync))
+
+    # Сообщения движка разбираются здесь, чтобы очередь не росла
+    while not all(job.finished.is_set() for job in submitted) or not parser_engine.update_queue.empty():
+        try:
+            message = parser_engine.update_queue.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        now = time.perf_counter()
+        if message.get('type') == 'job_status' and message.get('status') == parser_engine.JOB_RUNNING:
+            started_at[message['job_id']] = now
+        elif message.get('type') == 'complete':
+            downloaded += message.get('downloaded', 0)
+        if message.get('type') == 'job_status' and message.get('status') in (
+                parser_engine.JOB_DONE, parser_engine.JOB_FAILED, parser_engine.JOB_CANCELLED):
+            latencies.append(now - started_at.get(message['job_id'], started))
+
+    elapsed = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    scheduler.shutdown()
+    parser_engine.close_connection()
+    return {
+        'elapsed': elapsed,
+        'done': sum(job.status == parser_engine.JOB_DONE for job in submitted),
+        'downloaded': downloaded,
+        'latencies': latencies,
+        'peak_memory': peak_memory,
+        'limits': parser_engine.rate_limiter.snapshot(),
+    }
+
+
+# Функция для печати результатов прогона
+def report(title, result, server_stats, bytes_before):
+    elapsed = result['elapsed']
+    megabytes = (server_stats.bytes_sent - bytes_before) / (1024 * 1024)
+    print(f"{title}: {result['done']} объявлений за {elapsed:.2f} с | "
+          f"{result['done'] / elapsed:.2f} стр/с | {result['downloaded'] / elapsed:.1f} фото/с | "
+          f"{megabytes / elapsed:.1f} МБ/с | "
+          f"p50 {percentile(result['latencies'], 0.5) * 1000:.0f} мс, "
+          f"p95 {percentile(result['latencies'], 0.95) * 1000:.0f} мс | "
+          f"пик памяти {result['peak_memory'] / (1024 * 1024):.1f} МБ")
+    for limit in result['limits']:
+        if limit['throttled']:
+            print(f"  ограничения хоста {describe_limit(limit)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк парсинга")
+    parser.add_argument('--listings', type=int, default=10, help="количество объявлений")
+    parser.add_argument('--photos', type=int, default=30, help="фото в галерее объявления")
+    parser.add_argument('--image-size', type=int, default=200 * 1024, help="размер фото, байт")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="задержка ответа сервера, мс")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 503 на фото")
+    parser.add_argument('--missing-rate', type=float, default=0.0, help="доля отсутствующих фото (404)")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="доля фото с обрывом соединения")
+    parser.add_argument('--pages', help="папка с записанными страницами объявлений (*.html)")
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help="предел частоты запросов сервера, запр/с (сверх него 429 с Retry-After)")
+    parser.add_argument('-w', '--workers', type=int, default=parser_engine.DOWNLOAD_WORKERS,
+                        help="потоков загрузки фото на объявление")
+    parser.add_argument('-j', '--jobs', type=int, default=parser_engine.JOB_WORKERS,
+                        help="одновременно выполняемых объявлений")
+    parser.add_argument('--compare-workers', help="список значений --workers через запятую для сравнения")
+    parser.add_argument('--sync', action='store_true', help="второй прогон в режиме синхронизации папок")
+    parser.add_argument('--resume', action='store_true',
+                        help="второй прогон без обрывов продолжает прерванные загрузки первого")
+    parser.add_argument('--reuse', action='store_true',
+                        help="второй прогон тех же объявлений в новые папки (другой клиент) через хранилище фото")
+    parser.add_argument('--no-store', action='store_true', help="не использовать общее хранилище фото")
+    parser.add_argument('--log-file', help="файл лога движка (по умолчанию лог не пишется)")
+    args = parser.parse_args(argv)
+
+    if args.log_file:
+        parser_engine.setup_logging(args.log_file)
+    else:
+        logging.getLogger().addHandler(logging.NullHandler())
+
+    config = StandConfig(args.photos, args.image_size, args.latency_ms, args.error_rate,
+                         args.missing_rate, args.pages, drop_rate=args.drop_rate, rate_limit=args.rate_limit)
+    server = StandServer(config).start()
+    worker_counts = [int(value) for value in args.compare_workers.split(',')] if args.compare_workers \
+        else [args.workers]
+    try:
+        for workers in worker_counts:
+            work_dir = tempfile.mkdtemp(prefix='krisha_bench_')
+            try:
+                bytes_before = server.stats.bytes_sent
+                result = run_once(server, work_dir, args.listings, workers, args.jobs, store=not args.no_store)
+                report(f"потоков {workers}", result, server.stats, bytes_before)
+                if args.reuse:
+                    bytes_before = server.stats.bytes_sent
+                    result = run_once(server, work_dir, args.listings, workers, args.jobs, folder='client2',
+                                      store=not args.no_store)
+                    report(f"потоков {workers}, другой клиент", result, server.stats, bytes_before)
+                if args.sync:
+                    bytes_before = server.stats.bytes_sent
+                    result = run_once(server, work_dir, args.listings, workers, args.jobs, sync=True,
+                                      store=not args.no_store)
+                    report(f"потоков {workers}, синхронизация", result, server.stats, bytes_before)
+                if args.resume:
+                    config.drop_rate = 0.0
+                    bytes_before = server.stats.bytes_sent
+                    result = run_once(server, work_dir, args.listings, workers, args.jobs, store=not args.no_store)
+                    report(f"потоков {workers}, продолжение", result, server.stats, bytes_before)
+                    config.drop_rate = args.drop_rate
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+"""Локальный сервер-заменитель krisha.kz для офлайн-бенчмарков.
+
+Отдаёт страницы объявлений /a/show/<id> (записанные страницы из папки или
+синтетические) и галерею /photos/<id>/<n>-750x470.jpg с настраиваемым
+количеством и размером фото, задержкой, долей ошибок 503, отсутствующих фото
+и обрывов соединения посреди фото. Фото поддерживают запросы Range с If-Range.
+При заданном пределе частоты лишние запросы получают 429 с Retry-After.
+Выдача поиска /search/?page=<n> ссылается на объявления и следующую страницу.
+Страницы объявлений отдаются с ETag и отвечают 304 на условные запросы; цену
+объявления можно изменить, а объявление — снять (404), чтобы проверить наблюдение.
+
+Отдельный запуск:
+    python benchmarks/stand_server.py --port 8080 --photos 30
+"""
+import argparse
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_extract import build_sample_page  # noqa: E402
+
+# Галерея записанной страницы: каталог первой картинки 750x470, он переписывается на локальный сервер
+GALLERY_PREFIX_PATTERN = re.compile(r'((?:https?:)?//[^"\'\s<>]+/)\d+-750x470\.\w+')
+PAGE_PATH = re.compile(r'^/a/show/(\d+)$')
+SEARCH_PATH = re.compile(r'^/search/(?:\?page=(\d+))?$')
+PHOTO_PATH = re.compile(r'^/photos/(\d+)/(\d+)-(\d+x\d+)\.(\w+)$')
+RANGE_HEADER = re.compile(r'^bytes=(\d+)-$')
+
+
+class StandConfig:
+    def __init__(self, photos=30, image_size=200 * 1024, latency_ms=0.0, error_rate=0.0,
+                 missing_rate=0.0, pages_dir=None, seed=1, drop_rate=0.0, search_pages=3,
+                 search_page_size=20, rate_limit=0.0, retry_after=1):
+        self.photos = photos
+        self.image_size = image_size
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.missing_rate = missing_rate
+        self.pages_dir = pages_dir
+        self.seed = seed
+        self.drop_rate = drop_rate
+        self.search_pages = search_pages
+        self.search_page_size = search_page_size
+        # Предел частоты запросов, запр/с (0 — без предела), и пауза, которую сервер просит при превышении, сек
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+
+
+# Счётчики запросов сервера
+class StandStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pages = 0
+        self.searches = 0
+        self.images = 0
+        self.heads = 0
+        self.errors = 0
+        self.not_found = 0
+        self.not_modified = 0
+        self.drops = 0
+        self.ranges = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+
+    def add(self, **counters):
+        with self.lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+class StandServer:
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or StandConfig()
+        self.stats = StandStats()
+        self.random = random.Random(self.config.seed)
+        self.recorded_pages = self._load_pages()
+        # Содержимое фото одно на все запросы; плохо сжимаемое, как настоящий JPEG
+        self.image_body = os.urandom(self.config.image_size)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+        # Ведро токенов предела частоты: запас не больше одной секунды запросов
+        self.tokens = self.config.rate_limit
+        self.refilled_at = time.monotonic()
+        self.tokens_lock = threading.Lock()
+        # Версии изменённых объявлений (каждая меняет цену и ETag) и снятые объявления
+        self.listing_versions = {}
+        self.removed_listings = set()
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def listing_url(self, listing_id):
+        return f'{self.base_url}/a/show/{listing_id}'
+
+    def search_url(self):
+        return f'{self.base_url}/search/'
+
+    # Изменение цены объявления: страница получает новый ETag
+    def change_listing(self, listing_id):
+        self.listing_versions[listing_id] = self.listing_versions.get(listing_id, 0) + 1
+
+    def remove_listing(self, listing_id):
+        self.removed_listings.add(listing_id)
+
+    def page_etag(self, listing_id):
+        return f'"page-{listing_id}-{self.listing_versions.get(listing_id, 0)}"'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _load_pages(self):
+        pages = []
+        if self.config.pages_dir:
+            for name in sorted(os.listdir(self.config.pages_dir)):
+                if name.endswith('.html'):
+                    with open(os.path.join(self.config.pages_dir, name), 'r', encoding='utf-8') as f:
+                        pages.append(f.read())
+        return pages
+
+    # Страница объявления: записанная (по кругу) или синтетическая, фото указывают на этот сервер
+    def render_page(self, listing_id):
+        photo_base = f'{self.base_url}/photos/{listing_id}/'
+        if not self.recorded_pages:
+            page = build_sample_page(self.config.photos, base=photo_base)
+            version = self.listing_versions.get(listing_id, 0)
+            if version:
+                page = page.replace('32 500 000', f'{32500000 - version * 100000:,}'.replace(',', ' '))
+            return page
+        page = self.recorded_pages[listing_id % len(self.recorded_pages)]
+        match = GALLERY_PREFIX_PATTERN.search(page)
+        if not match:
+            return page
+        prefix = match.group(1)
+        # Ссылки встречаются и в атрибутах, и во встроенном JSON с экранированными слэшами
+        page = page.replace(prefix, photo_base)
+        return page.replace(prefix.replace('/', '\\/'), photo_base.replace('/', '\\/'))
+
+    # Страница выдачи: объявления страницы, закреплённое объявление 1 на каждой странице и пагинатор
+    def render_search_page(self, page):
+        size = self.config.search_page_size
+        first = (page - 1) * size + 1
+        items = ''.join(f'<div class="a-card"><a class="a-card__title" href="/a/show/{listing_id}">'
+                        f'Квартира {listing_id}</a></div>' for listing_id in range(first, first + size))
+        promoted = '<div class="a-card a-card--hot"><a href="/a/show/1">Закреплённое</a></div>'
+        paginator = ''
+        if page < self.config.search_pages:
+            paginator = (f'<nav class="paginator"><a class="paginator__btn paginator__btn--next" '
+                         f'href="/search/?page={page + 1}">Дальше</a></nav>')
+        return f'<html><body>{promoted}{items}{paginator}</body></html>'
+
+    # Проверка предела частоты: False, если запрос сверх предела
+    def take_token(self):
+        rate = self.config.rate_limit
+        if not rate:
+            return True
+        with self.tokens_lock:
+            now = time.monotonic()
+            self.tokens = min(max(1.0, rate), self.tokens + (now - self.refilled_at) * rate)
+            self.refilled_at = now
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+    # Отсутствие фото определяется детерминированно, чтобы повторные запросы давали тот же ответ
+    def is_missing(self, listing_id, number):
+        if number > self.config.photos:
+            return True
+        return zlib.crc32(f'{listing_id}/{number}'.encode()) % 10000 < self.config.missing_rate * 10000
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send(self, status, body=b'', content_type='application/octet-stream', send_body=True):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if send_body and body:
+                    self.wfile.write(body)
+                    server.stats.add(bytes_sent=len(body))
+
+            def _handle(self, send_body):
+                if server.config.latency_ms:
+                    time.sleep(server.config.latency_ms / 1000)
+                if not server.take_token():
+                    server.stats.add(throttled=1)
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(server.config.retry_after))
+                    self.send_header('Content-Length', '0')
+                    return self.end_headers()
+                search_match = SEARCH_PATH.match(self.path)
+                if search_match:
+                    page = int(search_match.group(1) or 1)
+                    if page > server.config.search_pages:
+                        server.stats.add(not_found=1)
+                        return self._send(404, send_body=send_body)
+                    server.stats.add(searches=1)
+                    body = server.render_search_page(page).encode('utf-8')
+                    return self._send(200, body, 'text/html; charset=utf-8', send_body)
+                page_match = PAGE_PATH.match(self.path)
+                if page_match:
+                    listing_id = int(page_match.group(1))
+                    if listing_id in server.removed_listings:
+                        server.stats.add(not_found=1)
+                        return self._send(404, send_body=send_body)
+                    etag = server.page_etag(listing_id)
+                    if self.headers.get('If-None-Match') == etag:
+                        server.stats.add(not_modified=1)
+                        self.send_response(304)
+                        self.send_header('ETag', etag)
+                        self.send_header('Content-Length', '0')
+                        return self.end_headers()
+                    server.stats.add(pages=1)
+                    body = server.render_page(listing_id).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    if send_body:
+                        self.wfile.write(body)
+                        server.stats.add(bytes_sent=len(body))
+                    return
+                photo_match = PHOTO_PATH.match(self.path)
+                if not photo_match:
+                    server.stats.add(not_found=1)
+                    return self._send(404, send_body=send_body)
+                listing_id, number = int(photo_match.group(1)), int(photo_match.group(2))
+                if server.random.random() < server.config.error_rate:
+                    server.stats.add(errors=1)
+                    return self._send(503, send_body=send_body)
+                if server.is_missing(listing_id, number):
+                    server.stats.add(not_found=1)
+                    return self._send(404, send_body=send_body)
+                server.stats.add(**({'images': 1} if send_body else {'heads': 1}))
+                etag = f'"{listing_id}-{number}"'
+                if self.headers.get('If-None-Match') == etag:
+                    return self._send(304, send_body=False)
+                body = server.image_body
+                start = 0
+                range_match = RANGE_HEADER.match(self.headers.get('Range', ''))
+                if range_match and self.headers.get('If-Range', etag) == etag:
+                    start = int(range_match.group(1))
+                    if start >= len(body):
+                        return self._send(416, send_body=send_body)
+                    server.stats.add(ranges=1)
+                self.send_response(206 if start else 200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(body) - start))
+                if start:
+                    self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+                self.send_header('ETag', etag)
+                self.end_headers()
+                if not send_body:
+                    return
+                if server.random.random() < server.config.drop_rate:
+                    # Обрыв соединения на середине оставшейся части фото
+                    half = start + (len(body) - start) // 2
+                    self.wfile.write(body[start:half])
+                    self.wfile.flush()
+                    server.stats.add(drops=1, bytes_sent=half - start)
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                self.wfile.write(body[start:])
+                server.stats.add(bytes_sent=len(body) - start)
+
+            def do_GET(self):
+                self._handle(True)
+
+            def do_HEAD(self):
+                self._handle(False)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный сервер-заменитель krisha.kz")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--photos', type=int, default=30, help="фото в галерее каждого объявления")
+    parser.add_argument('--image-size', type=int, default=200 * 1024, help="размер фото, байт")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="задержка каждого ответа, мс")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 503 на фото")
+    parser.add_argument('--missing-rate', type=float, default=0.0, help="доля отсутствующих фото (404)")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="доля фото с обрывом соединения")
+    parser.add_argument('--pages', help="папка с записанными страницами объявлений (*.html)")
+    parser.add_argument('--search-pages', type=int, default=3, help="страниц в выдаче поиска")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="предел частоты запросов, запр/с (429 сверх него)")
+    args = parser.parse_args(argv)
+    config = StandConfig(args.photos, args.image_size, args.latency_ms, args.error_rate,
+                         args.missing_rate, args.pages, drop_rate=args.drop_rate, search_pages=args.search_pages,
+                         rate_limit=args.rate_limit)
+    server = StandServer(config, port=args.port).start()
+    print(f"Сервер запущен: {server.listing_url(1)}, выдача: {server.search_url()}")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
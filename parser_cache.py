@@ -0,0 +1,184 @@
+"""Дисковый кэш страниц объявлений с условной перепроверкой.
+
+Тело страницы хранится сжатым в SQLite вместе с ETag/Last-Modified.
+Свежие записи (моложе TTL) отдаются без обращения к сети, устаревшие
+перепроверяются условным GET-запросом. При превышении общего размера
+вытесняются давно не использованные записи (LRU).
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from requests.structures import CaseInsensitiveDict
+
+# Время жизни записи без перепроверки, сек, и предельный размер кэша, байт
+PAGE_CACHE_TTL = 15 * 60
+PAGE_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+# Объявление кодировки в <meta> и сколько байт от начала страницы в нём просматривается
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([-\w.:]+)', re.IGNORECASE)
+META_CHARSET_WINDOW = 4096
+
+# Параметры ссылок, не влияющие на содержимое страницы
+IGNORED_QUERY_PREFIXES = ('utm_', 'fbclid', 'gclid', 'yclid')
+
+
+# Функция для нормализации ссылки: ключ кэша не зависит от регистра хоста, фрагмента и меток
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and not (scheme == 'http' and parts.port == 80 or scheme == 'https' and parts.port == 443):
+        host = f'{host}:{parts.port}'
+    path = parts.path.rstrip('/') or '/'
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.lower().startswith(IGNORED_QUERY_PREFIXES))
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+
+# Функция для декодирования страницы из байтов: кодировка берётся из заголовка Content-Type,
+# затем из <meta charset>, затем UTF-8 (без charset в заголовке requests декодирует text/html
+# как ISO-8859-1, и кириллица превращается в мусор)
+def decode_page(response) -> str:
+    if 'charset=' in response.headers.get('Content-Type', '').lower():
+        return response.text
+    content = response.content
+    match = META_CHARSET_PATTERN.search(content[:META_CHARSET_WINDOW])
+    encodings = [match.group(1).decode('ascii')] if match else []
+    for encoding in encodings + ['utf-8']:
+        try:
+            return content.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return content.decode(response.apparent_encoding or 'utf-8', errors='replace')
+
+
+# Ответ, отданный из кэша или из сети (совместим с requests.Response по используемым полям)
+class CachedResponse:
+    def __init__(self, url: str, status_code: int, text: str, from_cache: bool = False,
+                 headers: Optional[Dict[str, str]] = None, retries: int = 0):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.from_cache = from_cache
+        # Заголовки без учёта регистра, как в requests (через HTTP/2 имена приходят строчными)
+        self.headers = CaseInsensitiveDict(headers or {})
+        # Число повторов запроса, выполненных сессией (для замеров запуска)
+        self.retries = retries
+
+    @property
+    def content(self) -> bytes:
+        return self.text.encode('utf-8')
+
+
+class PageCache:
+    def __init__(self, db_path: str, ttl: float = PAGE_CACHE_TTL, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+
+    # Соединение открывается при первом обращении к кэшу
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS pages (
+                    key TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_pages_accessed_at ON pages (accessed_at)')
+            self._conn.commit()
+        return self._conn
+
+    def get(self, url: str) -> Optional[dict]:
+        key = normalize_url(url)
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute('SELECT etag, last_modified, body, stored_at FROM pages WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE pages SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            conn.commit()
+        etag, last_modified, body, stored_at = row
+        return {'etag': etag, 'last_modified': last_modified, 'stored_at': stored_at,
+                'text': zlib.decompress(body).decode('utf-8')}
+
+    def put(self, url: str, text: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        body = zlib.compress(text.encode('utf-8'), 6)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute('''
+                INSERT OR REPLACE INTO pages (key, etag, last_modified, body, size, stored_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (normalize_url(url), etag, last_modified, body, len(body), now, now))
+            conn.commit()
+            self._evict(conn)
+
+    # Отметка об успешной перепроверке (304): запись снова считается свежей
+    def touch(self, url: str) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute('UPDATE pages SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, normalize_url(url)))
+            conn.commit()
+
+    # Вытеснение давно не использованных записей при превышении размера
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        removed = 0
+        for key, size in conn.execute('SELECT key, size FROM pages ORDER BY accessed_at').fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM pages WHERE key = ?', (key,))
+            total -= size
+            removed += 1
+        conn.commit()
+        logging.info(f'Из кэша страниц вытеснено записей: {removed}')
+
+    # Загрузка страницы через кэш: свежая запись без сети, устаревшая — условным запросом
+    def fetch(self, session, url: str, timeout: float = 10) -> CachedResponse:
+        entry = self.get(url)
+        if entry and time.time() - entry['stored_at'] < self.ttl:
+            logging.info(f'Страница взята из кэша: {url}')
+            return CachedResponse(url, 200, entry['text'], from_cache=True)
+
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        response = session.get(url, timeout=timeout, headers=headers or None)
+        retries = getattr(response.raw, 'retries', None)
+        retries = len(retries.history) if retries is not None else 0
+
+        if response.status_code == 304 and entry:
+            self.touch(url)
+            logging.info(f'Страница не изменилась, взята из кэша: {url}')
+            return CachedResponse(url, 200, entry['text'], from_cache=True, headers=response.headers,
+                                  retries=retries)
+        text = decode_page(response)
+        if response.status_code == 200:
+            self.put(url, text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return CachedResponse(url, response.status_code, text, headers=response.headers, retries=retries)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
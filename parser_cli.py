@@ -0,0 +1,292 @@
+"""Командная строка парсера Krisha.
+
+Примеры:
+    python parser_cli.py parse https://krisha.kz/a/show/123 -c 777 -o photos
+    python parser_cli.py batch jobs.txt -o photos --sync --postprocess
+    python parser_cli.py crawl "https://krisha.kz/prodazha/kvartiry/almaty/" -c 777 -o photos --max-pages 5
+    python parser_cli.py metrics --days 7 --csv metrics.csv
+    python parser_cli.py search "Абая 150" -c 777 --from 2024-01-01
+    python parser_cli.py export history.parquet -c 777 --from 2024-01-01 --to 2024-01-07
+    python parser_cli.py watch --interval 360
+    python parser_cli.py watch --once --all
+    python parser_cli.py store --gc --max-mb 2048
+"""
+import argparse
+import logging
+import multiprocessing
+import queue
+import sys
+
+import parser_cache
+import parser_engine
+from parser_db import fetch_listing_changes, search_history
+from parser_export import EXPORT_FORMATS, EXPORT_TABLES
+from parser_logging import flush_logging
+
+
+# Функция для вывода сообщений движка, пока задания (и обход выдачи или наблюдение, если есть) не завершатся
+def drain_events(jobs, quiet=False, task=None):
+    while True:
+        try:
+            message = parser_engine.update_queue.get(timeout=0.2)
+        except queue.Empty:
+            if (task is None or task.finished.is_set()) and all(job.finished.is_set() for job in list(jobs)):
+                break
+            continue
+        msg_type = message.get('type')
+        if msg_type == 'log' and not quiet:
+            sys.stdout.write(message.get('message', ''))
+        elif msg_type == 'description':
+            print(f"Задание {message.get('job_id')}: {message.get('description', '')}")
+        elif msg_type == 'job_status':
+            print(f"Задание {message.get('job_id')}: {message.get('status')} ({message.get('url')})")
+        elif msg_type == 'error':
+            print(f"Задание {message.get('job_id')}: {message.get('message', '')}", file=sys.stderr)
+        elif msg_type == 'crawl_status':
+            print(f"Обход: {message.get('message', '')}")
+        elif msg_type == 'watch_status' and message.get('message'):
+            print(f"Наблюдение: {message['message']}")
+        elif msg_type == 'listing_changed':
+            changes = '; '.join(parser_engine.describe_change(*change) for change in message.get('changes', []))
+            print(f"{message.get('changed_at', '')}\t{', '.join(message.get('clients', []))}\t"
+                  f"{message.get('url', '')}\t{changes}")
+
+
+# Функция для ожидания заданий и вычисления кода возврата
+def wait_jobs(jobs, quiet=False, crawl=None):
+    try:
+        drain_events(jobs, quiet, crawl)
+    except KeyboardInterrupt:
+        # Ctrl+C отменяет все задания (и обход выдачи) и дожидается их корректной остановки
+        if crawl is not None:
+            crawl.cancel()
+        for job in list(jobs):
+            parser_engine.scheduler.cancel(job.id)
+        drain_events(jobs, quiet=True, task=crawl)
+    # Последние строки лога пишутся фоновым потоком: они дописываются и выводятся до выхода
+    flush_logging()
+    drain_events(jobs, quiet)
+    # Если хосты просили снизить нагрузку, видно, до каких ограничений она снижена
+    if parser_engine.rate_limiter.throttled_total():
+        print(f"Ограничения запросов по хостам:\n{parser_engine.host_limits_report()}")
+    return 0 if all(job.status == parser_engine.JOB_DONE for job in jobs) else 1
+
+
+# Команда parse: одно объявление
+def cmd_parse(args):
+    if not parser_engine.is_valid_url(args.url):
+        print(f"Некорректный URL: {args.url}", file=sys.stderr)
+        return 2
+    job = parser_engine.scheduler.submit(args.url, args.client, args.folder, args.workers, args.sync,
+                                         args.postprocess)
+    return wait_jobs([job], args.quiet)
+
+
+# Команда batch: список объявлений из файла
+def cmd_batch(args):
+    try:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            lines = f.read()
+    except OSError as e:
+        print(f"Не удалось прочитать файл заданий: {e}", file=sys.stderr)
+        return 2
+    job_specs = parser_engine.parse_job_lines(lines, args.folder or '')
+    if not job_specs:
+        print("В списке нет корректных заданий.", file=sys.stderr)
+        return 2
+    jobs = [parser_engine.scheduler.submit(url, client_number, save_path, args.workers, args.sync, args.postprocess)
+            for url, client_number, save_path in job_specs]
+    return wait_jobs(jobs, args.quiet)
+
+
+# Команда crawl: обход выдачи поиска, каждое новое объявление в папку <папка>/<номер объявления>
+def cmd_crawl(args):
+    if not parser_engine.is_valid_url(args.url):
+        print(f"Некорректный URL: {args.url}", file=sys.stderr)
+        return 2
+    crawl = parser_engine.start_crawl(args.url, args.client, args.folder, args.workers, args.sync,
+                                      args.postprocess, not args.all, args.max_pages)
+    return wait_jobs(crawl.jobs, args.quiet, crawl)
+
+
+# Команда search: поиск по истории (слова описания или ссылки, клиент, даты)
+def cmd_search(args):
+    rows = search_history(parser_engine.get_connection(), args.text or '', args.client or '',
+                          args.date_from or '', args.date_to or '', limit=args.limit)
+    if not rows:
+        print("Ничего не найдено.")
+        return 1
+    for row_id, day, time_only, client_number, url, description in rows:
+        print(f"{day} {time_only}\t{client_number}\t{url}\t{description or ''}")
+    return 0
+
+
+# Команда export: потоковая выгрузка истории или запусков (формат по расширению или --format)
+def cmd_export(args):
+    try:
+        rows = parser_engine.export_data(args.file, args.table, args.format, args.client or '',
+                                         args.date_from or '', args.date_to or '')
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f"Не удалось выгрузить: {e}", file=sys.stderr)
+        return 2
+    print(f"Выгружено строк: {rows} ({args.file})")
+    return 0
+
+
+# Команда watch: перепроверка объявлений из истории (изменения цены и полей, снятые объявления)
+def cmd_watch(args):
+    if args.changes:
+        rows = fetch_listing_changes(parser_engine.get_connection(), args.changes)
+        if not rows:
+            print("Изменений нет.")
+            return 1
+        for row_id, changed_at, url, clients, field, old_value, new_value in rows:
+            print(f"{changed_at}\t{clients or ''}\t{url}\t"
+                  f"{parser_engine.describe_change(field, old_value, new_value)}")
+        return 0
+    watch = parser_engine.start_watch(args.interval * 60, args.workers, args.once, args.all)
+    try:
+        drain_events([], args.quiet, watch)
+    except KeyboardInterrupt:
+        # Ctrl+C останавливает наблюдение после начатых проверок
+        watch.cancel()
+        drain_events([], True, watch)
+    flush_logging()
+    drain_events([], args.quiet)
+    return 0
+
+
+# Команда store: размер общего хранилища фото и сборка мусора (вытеснение давно не использованных фото)
+def cmd_store(args):
+    store = parser_engine.photo_store
+    if args.gc:
+        max_bytes = int(args.max_mb * 1024 * 1024) if args.max_mb is not None else None
+        removed, freed = store.collect_garbage(max_bytes)
+        print(f"Удалено фото: {removed}, освобождено {freed / 1048576:.1f} МБ")
+    stats = store.stats()
+    print(f"Хранилище фото {store.root}: {stats['objects']} фото, {stats['bytes'] / 1048576:.1f} МБ "
+          f"(предел {store.max_bytes / 1048576:.0f} МБ), ссылок на фото {stats['sources']}")
+    return 0
+
+
+# Команда metrics: сводка замеров запусков по дням и выгрузка в CSV
+def cmd_metrics(args):
+    print(parser_engine.run_summary_report(args.days))
+    if args.csv:
+        rows = parser_engine.export_run_metrics(args.csv, args.days, args.runs)
+        print(f"Выгружено строк: {rows} ({args.csv})")
+    return 0
+
+
+# Функция для построения разбора аргументов командной строки
+def build_parser():
+    parser = argparse.ArgumentParser(prog='parser_cli', description="Парсер Krisha без графического интерфейса")
+    parser.add_argument('--log-file', help="файл лога (по умолчанию parser_log.txt рядом с программой)")
+    parser.add_argument('--log-rotate', metavar='КОГДА',
+                        help="ротация лога по времени (midnight, H, D и т. п.) вместо ротации по размеру")
+    parser.add_argument('--image-log-level', choices=('DEBUG', 'INFO', 'WARNING'), default='INFO',
+                        help="порог строк по каждому фото (WARNING — только ошибки загрузки)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="не выводить строки по каждому фото")
+    parser.add_argument('--no-photo-store', action='store_true',
+                        help="не использовать общее хранилище фото (каждое фото скачивается в папку заново)")
+    parser.add_argument('--cache-ttl', type=float, default=parser_cache.PAGE_CACHE_TTL,
+                        help="сколько секунд страница объявления берётся из кэша без перепроверки")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    # Общие параметры загрузки
+    download_options = argparse.ArgumentParser(add_help=False)
+    download_options.add_argument('-w', '--workers', type=int, default=parser_engine.DOWNLOAD_WORKERS,
+                                  help="потоков загрузки фото на одно объявление")
+    download_options.add_argument('--sync', action='store_true',
+                                  help="синхронизировать папку вместо очистки (докачать только новые фото)")
+    download_options.add_argument('--postprocess', action='store_true',
+                                  help="после загрузки построить миниатюры и найти дубликаты фото (нужен Pillow)")
+    download_options.add_argument('--recompress', type=int, metavar='КАЧЕСТВО',
+                                  help="при обработке также пережать фото в JPEG с этим качеством (папка compressed)")
+
+    parse_parser = subparsers.add_parser('parse', parents=[download_options], help="спарсить одно объявление")
+    parse_parser.add_argument('url', help="ссылка на объявление")
+    parse_parser.add_argument('-c', '--client', required=True, help="номер клиента")
+    parse_parser.add_argument('-o', '--folder', required=True, help="папка для сохранения фото")
+    parse_parser.set_defaults(func=cmd_parse)
+
+    batch_parser = subparsers.add_parser('batch', parents=[download_options],
+                                         help="спарсить список объявлений из файла (ссылка;номер клиента;папка)")
+    batch_parser.add_argument('file', help="файл со списком заданий")
+    batch_parser.add_argument('-o', '--folder', help="папка по умолчанию для строк без папки")
+    batch_parser.set_defaults(func=cmd_batch)
+
+    crawl_parser = subparsers.add_parser('crawl', parents=[download_options],
+                                         help="обойти выдачу поиска и спарсить найденные объявления")
+    crawl_parser.add_argument('url', help="ссылка на выдачу поиска")
+    crawl_parser.add_argument('-c', '--client', required=True, help="номер клиента")
+    crawl_parser.add_argument('-o', '--folder', required=True,
+                              help="папка, в которой создаются подпапки по номерам объявлений")
+    crawl_parser.add_argument('--max-pages', type=int, default=parser_engine.CRAWL_MAX_PAGES,
+                              help="сколько страниц выдачи обойти не больше")
+    crawl_parser.add_argument('--all', action='store_true', help="не пропускать уже спарсенные объявления")
+    crawl_parser.set_defaults(func=cmd_crawl)
+
+    search_parser = subparsers.add_parser('search', help="поиск по истории парсинга")
+    search_parser.add_argument('text', nargs='?', help="слова из описания (адрес, площадь, цена) или ссылки")
+    search_parser.add_argument('-c', '--client', help="номер клиента")
+    search_parser.add_argument('--from', dest='date_from', help="с даты ГГГГ-ММ-ДД")
+    search_parser.add_argument('--to', dest='date_to', help="по дату ГГГГ-ММ-ДД включительно")
+    search_parser.add_argument('--limit', type=int, default=50, help="сколько последних записей вывести")
+    search_parser.set_defaults(func=cmd_search)
+
+    export_parser = subparsers.add_parser('export', help="выгрузить историю или запуски в CSV, JSON Lines или Parquet")
+    export_parser.add_argument('file', help="файл выгрузки (.csv, .jsonl или .parquet)")
+    export_parser.add_argument('--table', choices=sorted(EXPORT_TABLES), default='history', help="что выгружать")
+    export_parser.add_argument('--format', choices=sorted(set(EXPORT_FORMATS.values())),
+                               help="формат (по умолчанию по расширению файла)")
+    export_parser.add_argument('-c', '--client', help="только этот клиент")
+    export_parser.add_argument('--from', dest='date_from', help="с даты ГГГГ-ММ-ДД")
+    export_parser.add_argument('--to', dest='date_to', help="по дату ГГГГ-ММ-ДД включительно")
+    export_parser.set_defaults(func=cmd_export)
+
+    watch_parser = subparsers.add_parser('watch', help="следить за изменениями объявлений из истории")
+    watch_parser.add_argument('--interval', type=float, default=parser_engine.WATCH_INTERVAL / 60,
+                              help="как часто перепроверять каждое объявление, мин")
+    watch_parser.add_argument('-w', '--workers', type=int, default=parser_engine.WATCH_WORKERS,
+                              help="сколько объявлений проверять одновременно")
+    watch_parser.add_argument('--once', action='store_true',
+                              help="один проход по объявлениям, которым подошёл срок, и выход")
+    watch_parser.add_argument('--all', action='store_true', help="в первом проходе проверить все объявления")
+    watch_parser.add_argument('--changes', type=int, metavar='N',
+                              help="вывести N последних изменений и выйти")
+    watch_parser.set_defaults(func=cmd_watch)
+
+    store_parser = subparsers.add_parser('store', help="общее хранилище фото: размер и сборка мусора")
+    store_parser.add_argument('--gc', action='store_true', help="вытеснить давно не использованные фото")
+    store_parser.add_argument('--max-mb', type=float, help="до какого размера сократить хранилище, МБ")
+    store_parser.set_defaults(func=cmd_store)
+
+    metrics_parser = subparsers.add_parser('metrics', help="сводка замеров запусков (время этапов, фото/с, МБ/с)")
+    metrics_parser.add_argument('--days', type=int, default=30, help="за сколько последних дней")
+    metrics_parser.add_argument('--csv', help="выгрузить в CSV-файл")
+    metrics_parser.add_argument('--runs', action='store_true', help="выгружать каждый запуск, а не сводку по дням")
+    metrics_parser.set_defaults(func=cmd_metrics)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    parser_engine.setup_logging(args.log_file, image_level=getattr(logging, args.image_log_level),
+                                when=args.log_rotate)
+    parser_engine.page_cache.ttl = args.cache_ttl
+    parser_engine.photo_store.enabled = not args.no_photo_store
+    if getattr(args, 'recompress', None):
+        parser_engine.postprocess_options.recompress_quality = args.recompress
+    try:
+        return args.func(args)
+    finally:
+        parser_engine.scheduler.shutdown()
+        parser_engine.close_connection()
+
+
+if __name__ == '__main__':
+    # В собранном exe дочерние процессы пула обработки фото запускаются через этот же файл
+    multiprocessing.freeze_support()
+    sys.exit(main())
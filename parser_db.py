@@ -0,0 +1,667 @@
+"""Хранилище истории парсинга и замеров запусков (SQLite).
+
+База работает в режиме WAL: чтение из интерфейса не блокирует запись.
+Все изменения выполняет один поток записи, который собирает их в пакеты
+и фиксирует одной транзакцией. Схема обновляется миграциями по номеру
+версии в PRAGMA user_version.
+"""
+import logging
+import queue
+import re
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Sequence, Set, Tuple
+
+# Максимум операций в одной транзакции и сколько ждать следующую операцию пакета, сек
+WRITE_BATCH_SIZE = 200
+WRITE_BATCH_WAIT = 0.05
+
+# Номер объявления krisha.kz в ссылке
+LISTING_ID_PATTERN = re.compile(r'/a/show/(\d+)')
+
+
+# Миграция 1: таблица истории (старые базы без столбца description дополняются)
+def _migration_history(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            time TEXT NOT NULL,
+            client_number TEXT NOT NULL,
+            url TEXT NOT NULL,
+            description TEXT
+        )
+    ''')
+    columns = [info[1] for info in conn.execute("PRAGMA table_info(history);")]
+    if 'description' not in columns:
+        conn.execute("ALTER TABLE history ADD COLUMN description TEXT;")
+        logging.info("Добавлен столбец 'description' в таблицу 'history'.")
+
+
+# Миграция 2: индексы для отчётов и фильтров по клиенту
+def _migration_history_indexes(conn: sqlite3.Connection) -> None:
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_time ON history (time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_client_number ON history (client_number)')
+
+
+# Миграция 3: замеры запусков парсинга по этапам и по каждому изображению
+def _migration_runs(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            url TEXT NOT NULL,
+            client_number TEXT NOT NULL,
+            status TEXT NOT NULL,
+            from_cache INTEGER NOT NULL DEFAULT 0,
+            page_fetch_ms REAL,
+            parse_ms REAL,
+            discover_ms REAL,
+            download_ms REAL,
+            total_ms REAL NOT NULL,
+            images_total INTEGER NOT NULL DEFAULT 0,
+            images_downloaded INTEGER NOT NULL DEFAULT 0,
+            images_missing INTEGER NOT NULL DEFAULT 0,
+            images_failed INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            retries INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS run_images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id INTEGER NOT NULL REFERENCES runs (id),
+            number INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            status INTEGER,
+            latency_ms REAL,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            retries INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_runs_started_at ON runs (started_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_run_images_run_id ON run_images (run_id)')
+
+
+# Количество 16-битных частей перцептивного хеша в индексе
+PHASH_BANDS = 4
+
+
+# Миграция 4: индекс хешей фото для поиска дубликатов между объявлениями и время обработки фото.
+# Перцептивный хеш разбит на 4 части по 16 бит: фото с расстоянием Хэмминга до 3 совпадают
+# хотя бы в одной части, поэтому кандидаты ищутся по индексам частей, а не перебором таблицы.
+def _migration_image_hashes(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS image_hashes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            url TEXT NOT NULL,
+            client_number TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            sha256 TEXT,
+            phash INTEGER,
+            phash_b0 INTEGER,
+            phash_b1 INTEGER,
+            phash_b2 INTEGER,
+            phash_b3 INTEGER
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_image_hashes_url ON image_hashes (url)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_image_hashes_sha256 ON image_hashes (sha256)')
+    for band in range(PHASH_BANDS):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_image_hashes_b{band} ON image_hashes (phash_b{band})')
+    columns = [info[1] for info in conn.execute("PRAGMA table_info(runs);")]
+    if 'postprocess_ms' not in columns:
+        conn.execute('ALTER TABLE runs ADD COLUMN postprocess_ms REAL')
+
+
+# Миграция 5: сколько раз хосты просили снизить нагрузку за время запуска и их ограничения в конце запуска
+def _migration_run_limits(conn: sqlite3.Connection) -> None:
+    columns = [info[1] for info in conn.execute("PRAGMA table_info(runs);")]
+    if 'throttled' not in columns:
+        conn.execute('ALTER TABLE runs ADD COLUMN throttled INTEGER')
+    if 'host_limits' not in columns:
+        conn.execute('ALTER TABLE runs ADD COLUMN host_limits TEXT')
+
+
+# Токенизаторы полнотекстового индекса в порядке предпочтения: remove_diacritics 2 есть
+# только в SQLite 3.27+, на более старых сборках с FTS5 используется обычный unicode61
+FTS5_TOKENIZERS = ('unicode61 remove_diacritics 2', 'unicode61')
+
+
+# Функция для выбора токенизатора FTS5, который принимает эта сборка SQLite;
+# None, если FTS5 нет или ни один токенизатор не подходит
+def fts5_tokenizer(conn: sqlite3.Connection) -> Optional[str]:
+    for tokenizer in FTS5_TOKENIZERS:
+        try:
+            conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe "
+                         f"USING fts5(value, tokenize='{tokenizer}')")
+            conn.execute('DROP TABLE temp.fts5_probe')
+            return tokenizer
+        except sqlite3.OperationalError:
+            continue
+    return None
+
+
+# Миграция 6: полнотекстовый индекс описаний и ссылок истории (FTS5 с внешним содержимым:
+# текст хранится только в history, индекс поддерживается триггерами) и индекс фильтра клиент + дата.
+# Без FTS5 (или без подходящего токенизатора) индекс не создаётся, а поиск идёт по LIKE.
+def _migration_history_search(conn: sqlite3.Connection) -> None:
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_client_time ON history (client_number, time)')
+    tokenizer = fts5_tokenizer(conn)
+    if tokenizer is None:
+        logging.warning('SQLite собран без FTS5: поиск по истории будет выполняться без полнотекстового индекса.')
+        return
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+            description, url, content='history', content_rowid='id',
+            tokenize='{tokenizer}'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+            INSERT INTO history_fts (rowid, description, url) VALUES (new.id, new.description, new.url);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+            INSERT INTO history_fts (history_fts, rowid, description, url)
+            VALUES ('delete', old.id, old.description, old.url);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS history_fts_update AFTER UPDATE OF description, url ON history BEGIN
+            INSERT INTO history_fts (history_fts, rowid, description, url)
+            VALUES ('delete', old.id, old.description, old.url);
+            INSERT INTO history_fts (rowid, description, url) VALUES (new.id, new.description, new.url);
+        END
+    ''')
+    conn.execute("INSERT INTO history_fts (history_fts) VALUES ('rebuild')")
+
+
+# Миграция 7: поля объявлений для наблюдения за изменениями (последнее известное состояние, условия
+# перепроверки) и история изменений по полям
+def _migration_listings(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS listings (
+            url TEXT PRIMARY KEY,
+            title TEXT,
+            size TEXT,
+            address TEXT,
+            full_address TEXT,
+            price TEXT,
+            status TEXT NOT NULL DEFAULT 'active',
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            first_seen TEXT NOT NULL,
+            checked_at TEXT,
+            changed_at TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_status_checked ON listings (status, checked_at)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS listing_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            changed_at TEXT NOT NULL,
+            url TEXT NOT NULL,
+            field TEXT NOT NULL,
+            old_value TEXT,
+            new_value TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_listing_changes_url ON listing_changes (url)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_url ON history (url)')
+
+
+# Миграции по порядку: номер версии схемы равен количеству применённых миграций
+MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _migration_history,
+    _migration_history_indexes,
+    _migration_runs,
+    _migration_image_hashes,
+    _migration_run_limits,
+    _migration_history_search,
+    _migration_listings,
+]
+
+# Поля запуска в порядке столбцов таблицы runs (без id)
+RUN_FIELDS = ('started_at', 'url', 'client_number', 'status', 'from_cache', 'page_fetch_ms', 'parse_ms',
+              'discover_ms', 'download_ms', 'total_ms', 'images_total', 'images_downloaded', 'images_missing',
+              'images_failed', 'bytes', 'retries', 'postprocess_ms', 'throttled', 'host_limits')
+
+
+# Функция для открытия соединения с настройками WAL
+def connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+
+# Функция для применения недостающих миграций (в одной транзакции с блокировкой записи,
+# чтобы несколько соединений не мигрировали базу одновременно)
+def migrate(conn: sqlite3.Connection) -> None:
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for migration in MIGRATIONS[version:]:
+            migration(conn)
+        conn.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if version < len(MIGRATIONS):
+        logging.info(f'База истории обновлена с версии {version} до {len(MIGRATIONS)}.')
+
+
+# Функция для инициализации базы данных
+def init_db(db_path: str) -> sqlite3.Connection:
+    conn = connect(db_path)
+    migrate(conn)
+    return conn
+
+
+# Функция для чтения страницы отчёта: записи с id не больше before_id (ключевая пагинация по индексу id),
+# сгруппированные в базе по дате и клиенту; клиенты внутри даты идут по их последней записи
+def fetch_history_page(conn: sqlite3.Connection, before_id: Optional[int] = None, limit: int = 200) -> List[tuple]:
+    # Условие по id задаётся явно, чтобы SQLite искал по первичному ключу, а не сканировал таблицу
+    condition, params = ('WHERE id <= ?', (before_id, limit)) if before_id is not None else ('', (limit,))
+    return conn.execute(f'''
+        SELECT id, day, time_only, client_number, url, description
+        FROM (
+            SELECT id, substr(time, 1, 10) AS day, substr(time, 12, 5) AS time_only,
+                   client_number, url, description
+            FROM history
+            {condition}
+            ORDER BY id DESC
+            LIMIT ?
+        )
+        ORDER BY day DESC, MAX(id) OVER (PARTITION BY day, client_number) DESC, id DESC
+    ''', params).fetchall()
+
+
+# Функция для превращения строки поиска в запрос FTS5: каждое слово ищется как начало слова,
+# все слова должны встретиться (служебные символы FTS5 в словах не действуют)
+def fts_query(text: str) -> str:
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _casefold(value: Optional[str]) -> Optional[str]:
+    return value.casefold() if value else value
+
+
+# Функция для поиска по истории: слова в описании или ссылке, клиент и диапазон дат (ГГГГ-ММ-ДД, включительно).
+# Возвращает строки в формате fetch_history_page; before_id — ключевая пагинация по id, как у отчёта.
+def search_history(conn: sqlite3.Connection, text: str = '', client_number: str = '',
+                   date_from: str = '', date_to: str = '', before_id: Optional[int] = None,
+                   limit: int = 200) -> List[tuple]:
+    conditions = []
+    params: List[object] = []
+    source = 'history'
+    order_column = 'history.id'
+    words = re.findall(r'\w+', text or '')
+    if words:
+        has_fts = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_fts'").fetchone()
+        if has_fts:
+            # Совпадения перебираются по индексу от новых к старым, строки истории берутся по первичному
+            # ключу: CROSS JOIN закрепляет порядок соединения, сортировка всех совпадений не нужна
+            source = 'history_fts CROSS JOIN history ON history.id = history_fts.rowid'
+            order_column = 'history_fts.rowid'
+            conditions.append('history_fts MATCH ?')
+            params.append(fts_query(text))
+        else:
+            # LIKE в SQLite не различает регистр только для латиницы, поэтому сравнение идёт через casefold
+            conn.create_function('casefold', 1, _casefold, deterministic=True)
+            for word in words:
+                conditions.append('(instr(casefold(history.description), ?) OR instr(casefold(history.url), ?))')
+                params.extend((word.casefold(), word.casefold()))
+    if client_number:
+        conditions.append('history.client_number = ?')
+        params.append(client_number)
+    if date_from:
+        conditions.append('history.time >= ?')
+        params.append(date_from)
+    if date_to:
+        conditions.append("history.time < date(?, '+1 day')")
+        params.append(date_to)
+    if before_id is not None:
+        conditions.append(f'{order_column} <= ?')
+        params.append(before_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    params.append(limit)
+    return conn.execute(f'''
+        SELECT id, day, time_only, client_number, url, description
+        FROM (
+            SELECT history.id AS id, substr(history.time, 1, 10) AS day, substr(history.time, 12, 5) AS time_only,
+                   history.client_number AS client_number, history.url AS url, history.description AS description
+            FROM {source}
+            {where}
+            ORDER BY {order_column} DESC
+            LIMIT ?
+        )
+        ORDER BY day DESC, MAX(id) OVER (PARTITION BY day, client_number) DESC, id DESC
+    ''', params).fetchall()
+
+
+# Функция для чтения записей новее after_id (по возрастанию id, не больше limit)
+def fetch_history_since(conn: sqlite3.Connection, after_id: int, limit: int = 200) -> List[tuple]:
+    return conn.execute('''
+        SELECT id, substr(time, 1, 10), substr(time, 12, 5), client_number, url, description
+        FROM history
+        WHERE id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (after_id, limit)).fetchall()
+
+
+# Функция для получения номеров уже спарсенных объявлений krisha.kz (по ссылкам вида /a/show/<номер>)
+def fetch_parsed_listing_ids(conn: sqlite3.Connection) -> Set[str]:
+    listing_ids = set()
+    for (url,) in conn.execute("SELECT DISTINCT url FROM history WHERE url LIKE '%/a/show/%'"):
+        match = LISTING_ID_PATTERN.search(url)
+        if match:
+            listing_ids.add(match.group(1))
+    return listing_ids
+
+
+# Поля объявления, за изменениями которых ведётся наблюдение, и состояния объявления
+LISTING_FIELDS = ('title', 'size', 'address', 'full_address', 'price')
+LISTING_ACTIVE = 'active'
+LISTING_REMOVED = 'removed'
+
+
+# Функция для приведения значения поля к сравнимому виду: пробелы (в том числе неразрывные) схлопываются
+def _normalize_field(value: Optional[str]) -> Optional[str]:
+    return ' '.join(value.split()) if value else None
+
+
+# Функция для записи результата проверки объявления (вызывается в транзакции потока записи).
+# fields — поля со страницы (None, если страница не загружалась или не изменилась); пустое поле не затирает
+# известное значение. status None оставляет прежнее состояние. Изменением считается только отличие
+# от известного значения: первое заполнение поля не в счёт. Возвращает изменения (поле, было, стало).
+def record_listing(conn: sqlite3.Connection, url: str, checked_at: str, fields: Optional[dict] = None,
+                   status: Optional[str] = None, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                   content_hash: Optional[str] = None) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    columns = LISTING_FIELDS + ('status',)
+    row = conn.execute(f'SELECT {", ".join(columns)} FROM listings WHERE url = ?', (url,)).fetchone()
+    if row is None:
+        conn.execute('INSERT INTO listings (url, first_seen) VALUES (?, ?)', (url, checked_at))
+        row = (None,) * len(LISTING_FIELDS) + (LISTING_ACTIVE,)
+    old = dict(zip(columns, row))
+    new = dict(old)
+    for field in LISTING_FIELDS:
+        value = _normalize_field((fields or {}).get(field))
+        if value:
+            new[field] = value
+    if status:
+        new['status'] = status
+    changes = [(field, old[field], new[field]) for field in columns
+               if old[field] is not None and old[field] != new[field]]
+    conn.execute(f'''
+        UPDATE listings
+        SET {', '.join(f'{field} = ?' for field in columns)},
+            etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified),
+            content_hash = COALESCE(?, content_hash), checked_at = ?,
+            changed_at = CASE WHEN ? THEN ? ELSE changed_at END
+        WHERE url = ?
+    ''', [new[field] for field in columns] + [etag, last_modified, content_hash, checked_at,
+                                             bool(changes), checked_at, url])
+    conn.executemany('''
+        INSERT INTO listing_changes (changed_at, url, field, old_value, new_value)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(checked_at, url, field, old_value, new_value) for field, old_value, new_value in changes])
+    return changes
+
+
+# Функция для добавления в наблюдение ссылок из истории, которых ещё нет среди объявлений
+# (вызывается в транзакции потока записи). Поля таких объявлений не известны: первая проверка
+# только запоминает их и изменением не считается. Возвращает число добавленных объявлений.
+def sync_listings(conn: sqlite3.Connection) -> int:
+    return conn.execute('''
+        INSERT OR IGNORE INTO listings (url, first_seen)
+        SELECT url, MIN(time) FROM history GROUP BY url
+    ''').rowcount
+
+
+# Функция для выбора объявлений на перепроверку: действующие, не проверявшиеся с checked_before
+# (ГГГГ-ММ-ДД ЧЧ:ММ:СС); сначала ни разу не проверенные, затем самые давние.
+# Возвращает (ссылка, ETag, Last-Modified, хеш содержимого).
+def fetch_watch_candidates(conn: sqlite3.Connection, checked_before: str, limit: int = 500) -> List[tuple]:
+    return conn.execute('''
+        SELECT url, etag, last_modified, content_hash
+        FROM listings
+        WHERE status = ? AND (checked_at IS NULL OR checked_at < ?)
+        ORDER BY checked_at
+        LIMIT ?
+    ''', (LISTING_ACTIVE, checked_before, limit)).fetchall()
+
+
+# Функция для получения клиентов, которым отправлялось объявление
+def fetch_listing_clients(conn: sqlite3.Connection, url: str) -> List[str]:
+    return [row[0] for row in conn.execute(
+        'SELECT DISTINCT client_number FROM history WHERE url = ? ORDER BY client_number', (url,))]
+
+
+# Функция для чтения последних изменений объявлений: (id, время, ссылка, клиенты через запятую,
+# поле, было, стало), новые сверху
+def fetch_listing_changes(conn: sqlite3.Connection, limit: int = 200) -> List[tuple]:
+    return conn.execute('''
+        SELECT id, changed_at, url,
+               (SELECT group_concat(DISTINCT client_number) FROM history WHERE history.url = listing_changes.url),
+               field, old_value, new_value
+        FROM listing_changes
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (limit,)).fetchall()
+
+
+# Функция для записи запуска вместе с замерами изображений (вызывается в транзакции потока записи).
+# images — кортежи (number, url, status, latency_ms, bytes, retries)
+def insert_run(conn: sqlite3.Connection, run: dict, images: Sequence[tuple]) -> int:
+    placeholders = ', '.join('?' for _ in RUN_FIELDS)
+    run_id = conn.execute(f'INSERT INTO runs ({", ".join(RUN_FIELDS)}) VALUES ({placeholders})',
+                          [run.get(field) for field in RUN_FIELDS]).lastrowid
+    conn.executemany('''
+        INSERT INTO run_images (run_id, number, url, status, latency_ms, bytes, retries)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(run_id,) + tuple(image) for image in images])
+    return run_id
+
+
+# Функция для сводки запусков по дням за последние days дней: число запусков и успешных, средние времена
+# этапов, фото, объём, повторы, пропускная способность загрузки (фото/с и МБ/с) и ограничения хостами
+def fetch_run_summary(conn: sqlite3.Connection, days: int = 30) -> List[tuple]:
+    return conn.execute('''
+        SELECT substr(started_at, 1, 10) AS day,
+               COUNT(*),
+               SUM(status = 'done'),
+               AVG(page_fetch_ms),
+               AVG(parse_ms),
+               AVG(discover_ms),
+               AVG(download_ms),
+               AVG(total_ms),
+               SUM(images_downloaded),
+               SUM(images_missing),
+               SUM(images_failed),
+               SUM(bytes),
+               SUM(retries),
+               SUM(images_downloaded) * 1000.0 / NULLIF(SUM(download_ms), 0),
+               SUM(bytes) * 1000.0 / 1048576 / NULLIF(SUM(download_ms), 0),
+               SUM(throttled)
+        FROM runs
+        WHERE started_at >= date('now', 'localtime', ?)
+        GROUP BY day
+        ORDER BY day DESC
+    ''', (f'-{max(0, days - 1)} days',)).fetchall()
+
+
+# Функция для чтения задержек успешно скачанных изображений за последние days дней (по возрастанию)
+def fetch_image_latencies(conn: sqlite3.Connection, days: int = 30) -> List[float]:
+    return [row[0] for row in conn.execute('''
+        SELECT run_images.latency_ms
+        FROM runs JOIN run_images ON run_images.run_id = runs.id
+        WHERE runs.started_at >= date('now', 'localtime', ?) AND run_images.status = 200
+        ORDER BY run_images.latency_ms
+    ''', (f'-{max(0, days - 1)} days',))]
+
+
+# Функция для перевода 64-битного хеша в знаковое целое SQLite и обратно
+def _to_signed(value: int) -> int:
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+# Функция для регистрации хешей фото объявления (вызывается в транзакции потока записи).
+# Прежние записи этого объявления в папке заменяются. Возвращает найденные дубликаты из других
+# объявлений: (фото, ссылка, клиент, папка, файл, расстояние). images — словари с ключами
+# file_name, sha256, phash; max_distance — порог расстояния Хэмминга (не больше PHASH_BANDS - 1).
+def register_image_hashes(conn: sqlite3.Connection, url: str, client_number: str, folder: str,
+                          images: Sequence[dict], created_at: str, max_distance: int = 3) -> List[tuple]:
+    conn.execute('DELETE FROM image_hashes WHERE url = ? AND folder = ?', (url, folder))
+    duplicates = []
+    for image in images:
+        phash = image.get('phash')
+        bands = [(phash >> (16 * band)) & 0xFFFF for band in range(PHASH_BANDS)] if phash is not None else []
+        conditions = ['sha256 = ?'] + [f'phash_b{band} = ?' for band in range(len(bands))]
+        candidates = conn.execute(f'''
+            SELECT url, client_number, folder, file_name, sha256, phash
+            FROM image_hashes
+            WHERE url != ? AND ({' OR '.join(conditions)})
+            ORDER BY id DESC
+        ''', [url, image.get('sha256')] + bands).fetchall()
+        for other_url, other_client, other_folder, other_file, sha256, other_phash in candidates:
+            if image.get('sha256') and sha256 == image['sha256']:
+                distance = 0
+            elif phash is not None and other_phash is not None:
+                distance = bin(phash ^ _to_unsigned(other_phash)).count('1')
+                if distance > max_distance:
+                    continue
+            else:
+                continue
+            duplicates.append((image['file_name'], other_url, other_client, other_folder, other_file, distance))
+            break
+        conn.execute(f'''
+            INSERT INTO image_hashes (created_at, url, client_number, folder, file_name, sha256, phash,
+                                      {', '.join(f'phash_b{band}' for band in range(PHASH_BANDS))})
+            VALUES (?, ?, ?, ?, ?, ?, ?, {', '.join('?' for _ in range(PHASH_BANDS))})
+        ''', [created_at, url, client_number, folder, image['file_name'], image.get('sha256'),
+              _to_signed(phash) if phash is not None else None] + (bands or [None] * PHASH_BANDS))
+    return duplicates
+
+
+class HistoryStore:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._reader = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = None
+
+    # Соединение для чтения (интерфейс, отчёты); база создаётся и мигрирует при первом обращении
+    def reader(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._reader is None:
+                self._reader = init_db(self.db_path)
+            return self._reader
+
+    # Постановка изменения в очередь потока записи; Future получает lastrowid после фиксации
+    def write(self, sql: str, params: Sequence = ()) -> Future:
+        self._ensure_writer()
+        done = Future()
+        self._queue.put((sql, params, done))
+        return done
+
+    # Выполнение функции func(conn) в потоке записи в составе пакета; Future получает её результат
+    def run(self, func: Callable[[sqlite3.Connection], object]) -> Future:
+        self._ensure_writer()
+        done = Future()
+        self._queue.put((func, (), done))
+        return done
+
+    # Ожидание фиксации всех поставленных ранее изменений
+    def flush(self, timeout: Optional[float] = None) -> None:
+        self.write('SELECT 1').result(timeout)
+
+    def close(self) -> None:
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+                logging.info("Соединение с базой данных закрыто.")
+
+    def _ensure_writer(self) -> None:
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, daemon=True)
+                self._writer.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while batch[-1] is not None and len(batch) < WRITE_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get(timeout=WRITE_BATCH_WAIT))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        try:
+            conn = init_db(self.db_path)
+        except Exception as e:
+            logging.error(f'Не удалось открыть базу истории {self.db_path}: {e}')
+            # Без соединения все операции завершаются ошибкой, а не зависают
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                item[2].set_exception(e)
+        try:
+            while True:
+                batch = self._next_batch()
+                stop = batch[-1] is None
+                items = [item for item in batch if item is not None]
+                if items:
+                    self._commit_batch(conn, items)
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    # Операция очереди: SQL-запрос с параметрами или функция, которой передаётся соединение
+    @staticmethod
+    def _apply(conn: sqlite3.Connection, operation, params):
+        if callable(operation):
+            return operation(conn)
+        return conn.execute(operation, params).lastrowid
+
+    # Пакет фиксируется одной транзакцией; при ошибке операции повторяются по одной,
+    # чтобы одна неудачная запись не отменяла остальные
+    def _commit_batch(self, conn: sqlite3.Connection, items) -> None:
+        try:
+            with conn:
+                results = [self._apply(conn, operation, params) for operation, params, _ in items]
+        except Exception as e:
+            logging.warning(f'Пакет записи в базу не удался ({e}), повтор по одной операции.')
+            for operation, params, done in items:
+                try:
+                    with conn:
+                        done.set_result(self._apply(conn, operation, params))
+                except Exception as item_error:
+                    done.set_exception(item_error)
+            return
+        for (_, _, done), result in zip(items, results):
+            done.set_result(result)
@@ -0,0 +1,1886 @@
+"""Движок парсера Krisha без графического интерфейса.
+
+Загрузка страницы объявления, извлечение описания, скачивание фото и история
+парсинга. Модуль не зависит от tkinter; bs4 импортируется лениво, поэтому
+импорт движка быстрый и он работает на серверах без дисплея.
+Сообщения о ходе работы публикуются в очередь update_queue.
+"""
+import sys
+import logging
+import logging.handlers
+import os
+import sqlite3  # Импорт sqlite3 для работы с базой данных
+import threading  # Для многопоточности
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed  # Пул потоков для скачивания
+from contextlib import contextmanager
+from functools import partial
+import queue  # Для очереди сообщений между потоками
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+import requests
+from urllib3.util.retry import Retry
+import random
+import time
+import re
+import json
+import csv
+import itertools
+import hashlib
+import importlib.util
+from html import unescape
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlsplit, urlunsplit
+import shutil
+from parser_cache import PageCache, decode_page, normalize_url
+from parser_store import PhotoStore
+from parser_ratelimit import MAX_PAUSE, THROTTLE_STATUSES, RateLimiter, ThrottledAdapter, describe_limit, host_key
+from parser_db import (
+    LISTING_ACTIVE, LISTING_FIELDS, LISTING_REMOVED, RUN_FIELDS, HistoryStore, fetch_image_latencies,
+    fetch_listing_clients, fetch_parsed_listing_ids, fetch_run_summary, fetch_watch_candidates, insert_run,
+    record_listing, register_image_hashes, sync_listings,
+)
+import parser_images
+import parser_logging
+from parser_export import export_table
+from parser_logging import IMAGE_LOG_LEVEL, IMAGE_LOGGER, LOG_MAX_BYTES, PROGRESS_LOGGER
+
+# Определение пути к директории с приложением
+if getattr(sys, 'frozen', False):
+    # Если программа упакована с помощью PyInstaller
+    application_path = os.path.dirname(sys.executable)
+else:
+    # Если программа запущена из исходного кода
+    application_path = os.path.dirname(os.path.abspath(__file__))
+
+# Функция для настройки логирования (вызывается приложением, а не при импорте движка).
+# Запись в файл с ротацией идёт в фоновом потоке; строки о ходе загрузки попадают и в update_queue.
+def setup_logging(log_file: Optional[str] = None, level: int = logging.DEBUG,
+                  image_level: int = IMAGE_LOG_LEVEL, max_bytes: int = LOG_MAX_BYTES,
+                  when: Optional[str] = None) -> logging.handlers.QueueListener:
+    if log_file is None:
+        log_file = os.path.join(application_path, 'parser_log.txt')
+    return parser_logging.setup_logging(log_file, level, update_queue, max_bytes=max_bytes, when=when,
+                                        image_level=image_level)
+
+# Строки о ходе загрузки и по каждому фото: одно событие лога идёт и в файл, и в лог интерфейса
+progress_log = logging.getLogger(PROGRESS_LOGGER)
+image_log = logging.getLogger(IMAGE_LOGGER)
+
+# Хранилище истории парсинга рядом с программой
+history = HistoryStore(os.path.join(application_path, 'parsing_history.db'))
+
+# Функция для получения соединения с базой данных для чтения
+def get_connection() -> sqlite3.Connection:
+    return history.reader()
+
+# Функция для закрытия соединений с базой данных и кэшем (ожидает запись накопленных изменений)
+def close_connection() -> None:
+    parser_images.shutdown_pool()
+    history.close()
+    page_cache.close()
+    photo_store.close()
+
+# Настройки общего HTTP-клиента
+HTTP_POOL_SIZE = 32  # Размер пула соединений на один хост (не меньше числа потоков загрузки)
+HTTP_RETRIES = 3  # Количество повторов при ошибках 5xx и таймаутах
+HTTP_BACKOFF = 0.5  # Базовая задержка экспоненциального отката, сек
+HTTP_TIMEOUT = 10  # Таймаут запроса, сек
+
+# Ограничения частоты и параллельности запросов по хостам, общие для всех заданий
+rate_limiter = RateLimiter()
+
+# Повтор запросов с экспоненциальной задержкой и случайным разбросом (jitter).
+# Каждый повтор из-за 429/503 или сетевой ошибки сообщается ограничителю хоста,
+# поэтому паузу по Retry-After выдерживают и остальные запросы к этому хосту.
+class JitterRetry(Retry):
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # Исчерпанные повторы поднимают исключение здесь, а итоговый ответ учитывает адаптер
+        new_retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if _pool is not None and _pool.host:
+            if response is not None and response.status in THROTTLE_STATUSES:
+                rate_limiter.backoff(_pool.host.lower(), response.status, self.get_retry_after(response))
+            elif response is None and error is not None:
+                rate_limiter.backoff(_pool.host.lower())
+        return new_retry
+
+    # Пауза по Retry-After не длиннее MAX_PAUSE, чтобы задание можно было отменить
+    def sleep_for_retry(self, response):
+        retry_after = self.get_retry_after(response)
+        if retry_after:
+            time.sleep(min(retry_after, MAX_PAUSE))
+            return True
+        return False
+
+# Функция для создания общей HTTP-сессии с пулом соединений, повторами и ограничением нагрузки на хосты
+def create_session(pool_size: int = HTTP_POOL_SIZE, retries: int = HTTP_RETRIES,
+                   backoff: float = HTTP_BACKOFF) -> requests.Session:
+    retry = JitterRetry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = ThrottledAdapter(rate_limiter, pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    new_session = requests.Session()
+    new_session.mount('http://', adapter)
+    new_session.mount('https://', adapter)
+    return new_session
+
+# Общая сессия для всех запросов парсера: соединения с хостами переиспользуются
+session = create_session()
+
+# Кэш страниц объявлений рядом с базой истории
+page_cache = PageCache(os.path.join(application_path, 'page_cache.db'))
+
+# Общее хранилище фото: фото, уже скачанное для одного клиента, в папки других попадает ссылкой
+photo_store = PhotoStore(os.path.join(application_path, 'photo_store'))
+
+# Создание очереди для сообщений между потоками
+update_queue = queue.Queue()
+
+# Валидация URL
+def is_valid_url(url: str) -> bool:
+    regex = re.compile(
+        r'^(?:http|ftp)s?://'  # протокол
+        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # доменное имя
+        r'localhost|'  # localhost
+        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # IP-адрес
+        r'(?::\d+)?'  # порт
+        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+    return re.match(regex, url) is not None
+
+# Функция для очистки папки
+def clear_folder(folder_path: str) -> None:
+    if os.path.exists(folder_path):
+        for file in os.listdir(folder_path):
+            file_path = os.path.join(folder_path, file)
+            try:
+                if os.path.isfile(file_path) or os.path.islink(file_path):
+                    os.unlink(file_path)
+                elif os.path.isdir(file_path):
+                    shutil.rmtree(file_path)
+            except Exception as e:
+                logging.error(f'Не удалось удалить {file_path}. Причина: {e}')
+        logging.info(f'Папка {folder_path} успешно очищена.')
+    else:
+        logging.warning(f'Папка {folder_path} не найдена.')
+
+# Количество одновременных загрузок изображений
+DOWNLOAD_WORKERS = 8
+
+# Верхняя граница номера фото в галерее
+MAX_IMAGES = 200
+
+# Статусы ответа, означающие, что фото больше нет на сервере
+GONE_STATUSES = (404, 410)
+
+# Размер блока при потоковом скачивании и лимит блоков, ожидающих записи на диск
+WRITE_CHUNK_SIZE = 64 * 1024
+WRITE_QUEUE_SIZE = 64
+
+# Отдельный поток записи файлов: сетевые потоки только передают ему блоки данных.
+# Файл пишется во временный '.part' и атомарно переименовывается после завершения.
+# Прерванный '.part' остаётся на диске, чтобы его можно было докачать (append=True дописывает в конец).
+class FileWriter:
+    def __init__(self, max_pending: int = WRITE_QUEUE_SIZE):
+        # Ограниченная очередь держит память постоянной: при отставании диска загрузчики ждут
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def open(self, file_path: str, append: bool = False) -> Future:
+        done = Future()
+        self.queue.put(('open', file_path, (done, append)))
+        return done
+
+    def write(self, file_path: str, chunk: bytes) -> None:
+        self.queue.put(('write', file_path, chunk))
+
+    def close(self, file_path: str) -> None:
+        self.queue.put(('close', file_path, None))
+
+    def abort(self, file_path: str) -> None:
+        self.queue.put(('abort', file_path, None))
+
+    def stop(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        files = {}  # file_path -> (файл, хеш содержимого, future)
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            action, file_path, payload = item
+            if action == 'open':
+                done, append = payload
+                try:
+                    hasher = hashlib.sha256()
+                    if append:
+                        # Хеш продолжается с уже скачанной части
+                        with open(file_path + '.part', 'rb') as existing:
+                            for block in iter(lambda: existing.read(WRITE_CHUNK_SIZE), b''):
+                                hasher.update(block)
+                    files[file_path] = (open(file_path + '.part', 'ab' if append else 'wb'), hasher, done)
+                except Exception as e:
+                    done.set_exception(e)
+                continue
+            if file_path not in files:
+                continue  # файл не удалось открыть, ошибка уже передана
+            f, hasher, done = files[file_path]
+            try:
+                if action == 'write':
+                    f.write(payload)
+                    hasher.update(payload)
+                    continue
+                del files[file_path]
+                f.close()
+                if action == 'close':
+                    os.replace(file_path + '.part', file_path)
+                    done.set_result(hasher.hexdigest())
+                else:
+                    done.cancel()
+            except Exception as e:
+                files.pop(file_path, None)
+                f.close()
+                if os.path.exists(file_path + '.part'):
+                    os.remove(file_path + '.part')
+                done.set_exception(e)
+        # Незавершённые файлы при остановке остаются для докачки
+        for file_path, (f, hasher, done) in files.items():
+            f.close()
+            done.cancel()
+
+# Функция для получения числа повторов запроса, выполненных urllib3
+def response_retries(response) -> int:
+    retries = getattr(response.raw, 'retries', None)
+    return len(retries.history) if retries is not None else 0
+
+# Функция для проверки, что ответ 206 продолжает файл ровно с нужного байта
+def range_matches(response, offset: int) -> bool:
+    match = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+    return bool(match) and int(match.group(1)) == offset
+
+# Функция для потокового скачивания одного изображения через поток записи.
+# Кроме статуса возвращает сведения об ответе: валидаторы для манифеста, размер, задержку и повторы.
+# resume ({'offset', 'etag', 'last_modified'}) докачивает '.part' запросом Range с If-Range: если фото
+# на сервере изменилось, сервер отдаёт его целиком (200). on_response вызывается до начала записи.
+def download_image(image_url: str, file_path: str, writer: FileWriter,
+                   headers: Optional[Dict[str, str]] = None, resume: Optional[dict] = None,
+                   on_response: Optional[Callable[[dict], None]] = None) -> Tuple[int, Optional[Future], dict]:
+    started = time.perf_counter()
+    request_headers = dict(headers or {})
+    if resume:
+        request_headers['Range'] = f"bytes={resume['offset']}-"
+        request_headers['If-Range'] = resume.get('etag') or resume['last_modified']
+    with session.get(image_url, timeout=HTTP_TIMEOUT, stream=True, headers=request_headers or None) as img_response:
+        # Валидаторы ответа сохраняются в манифест для последующих условных запросов
+        info = {
+            'url': image_url,
+            'etag': img_response.headers.get('ETag'),
+            'last_modified': img_response.headers.get('Last-Modified'),
+            'bytes': 0,
+            'retries': response_retries(img_response),
+        }
+        status_code = img_response.status_code
+        restart = resume is not None and (status_code == 416 or status_code == 206 and
+                                          not range_matches(img_response, resume['offset']))
+        if not restart:
+            if status_code not in (200, 206):
+                info['latency'] = time.perf_counter() - started
+                return status_code, None, info
+            # Ответ 206 может прийти без валидаторов: фото то же, что и по If-Range, валидаторы берутся оттуда
+            if status_code == 206:
+                info['etag'] = info['etag'] or resume.get('etag')
+                info['last_modified'] = info['last_modified'] or resume.get('last_modified')
+            if on_response:
+                on_response(info)
+            done = writer.open(file_path, append=status_code == 206)
+            try:
+                for chunk in img_response.iter_content(WRITE_CHUNK_SIZE):
+                    if chunk:
+                        writer.write(file_path, chunk)
+                        info['bytes'] += len(chunk)
+            except Exception:
+                writer.abort(file_path)
+                raise
+            writer.close(file_path)
+            info['latency'] = time.perf_counter() - started
+            return status_code, done, info
+    # Недокачанная часть не подходит к файлу на сервере: она удаляется, фото скачивается заново
+    logging.info(f'Недокачанный файл не совпадает с сервером, скачивание заново: {image_url}')
+    os.remove(file_path + '.part')
+    return download_image(image_url, file_path, writer, headers, None, on_response)
+
+# Функция для параметров докачки: только если '.part' на месте, относится к той же ссылке
+# и известен валидатор, по которому сервер подтвердит, что фото не изменилось
+def resume_info(partial_entry: Optional[dict], image_url: str, file_path: str) -> Optional[dict]:
+    if not partial_entry or partial_entry.get('url') != image_url:
+        return None
+    if not (partial_entry.get('etag') or partial_entry.get('last_modified')):
+        return None
+    try:
+        offset = os.path.getsize(file_path + '.part')
+    except OSError:
+        return None
+    if offset <= 0:
+        return None
+    return {'offset': offset, 'etag': partial_entry.get('etag'), 'last_modified': partial_entry.get('last_modified')}
+
+# Имя файла манифеста папки: какие фото и из каких ссылок в ней лежат
+MANIFEST_NAME = '.krisha_manifest.json'
+
+# Функция для чтения манифеста папки
+def load_manifest(folder_path: str) -> Dict[str, dict]:
+    manifest_path = os.path.join(folder_path, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.warning(f'Не удалось прочитать манифест {manifest_path}: {e}')
+        return {}
+
+# Функция для атомарной записи манифеста папки
+def save_manifest(folder_path: str, manifest: Dict[str, dict]) -> None:
+    manifest_path = os.path.join(folder_path, MANIFEST_NAME)
+    try:
+        with open(manifest_path + '.part', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(manifest_path + '.part', manifest_path)
+    except Exception as e:
+        logging.error(f'Не удалось сохранить манифест {manifest_path}: {e}')
+
+# Функция для заголовков условного запроса: только если файл на месте и совпадает с манифестом
+def conditional_headers(entry: Optional[dict], image_url: str, file_path: str) -> Optional[Dict[str, str]]:
+    if not entry or entry.get('url') != image_url:
+        return None
+    try:
+        if os.path.getsize(file_path) != entry.get('size'):
+            return None
+    except OSError:
+        return None
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers or None
+
+# Функция для размещения фото из хранилища в папке (файл, уже связанный с хранилищем, не трогается).
+# Возвращает запись манифеста или None, если разместить не удалось.
+def link_stored_image(stored: dict, file_path: str) -> Optional[dict]:
+    try:
+        if not (os.path.exists(file_path) and os.path.samefile(stored['path'], file_path)):
+            photo_store.link(stored['path'], file_path)
+    except OSError as e:
+        logging.warning(f"Не удалось взять фото из хранилища {stored['url']}: {e}")
+        return None
+    photo_store.touch(stored)
+    image_log.info('Фото взято из хранилища: %s', stored['url'])
+    return {'url': stored['url'], 'size': stored['size'], 'etag': stored['etag'],
+            'last_modified': stored['last_modified'], 'sha256': stored['sha256']}
+
+# Функция для заголовков условной перепроверки записи хранилища
+def store_headers(stored: dict) -> Optional[Dict[str, str]]:
+    headers = {}
+    if stored['etag']:
+        headers['If-None-Match'] = stored['etag']
+    if stored['last_modified']:
+        headers['If-Modified-Since'] = stored['last_modified']
+    return headers or None
+
+# Функция для добавления скачанного фото в хранилище (ошибка хранилища не мешает загрузке)
+def store_image(entry: dict, file_path: str) -> None:
+    if not photo_store.enabled:
+        return
+    try:
+        photo_store.add(entry['url'], file_path, entry['sha256'], entry['etag'], entry['last_modified'])
+    except OSError as e:
+        logging.warning(f"Не удалось добавить фото в хранилище {entry['url']}: {e}")
+
+# Функция для удаления устаревших фото, которых больше нет в галерее
+def remove_stale_files(folder_path: str, old_manifest: Dict[str, dict], new_manifest: Dict[str, dict]) -> None:
+    for file_name in old_manifest:
+        if file_name in new_manifest:
+            continue
+        file_path = os.path.join(folder_path, file_name)
+        try:
+            if os.path.isfile(file_path):
+                os.unlink(file_path)
+                logging.info(f'Удалено устаревшее фото: {file_path}')
+        except Exception as e:
+            logging.error(f'Не удалось удалить {file_path}. Причина: {e}')
+
+# Функция для удаления недокачанных '.part' файлов папки
+def remove_part_files(folder_path: str) -> None:
+    for file_name in os.listdir(folder_path):
+        if file_name.endswith('.part'):
+            try:
+                os.unlink(os.path.join(folder_path, file_name))
+            except OSError as e:
+                logging.error(f'Не удалось удалить {file_name}. Причина: {e}')
+
+# Имя файла контрольной точки прогона, её срок годности, сек, и минимальный интервал сохранения, сек
+CHECKPOINT_NAME = '.krisha_checkpoint.json'
+CHECKPOINT_MAX_AGE = 24 * 60 * 60
+CHECKPOINT_SAVE_INTERVAL = 1.0
+
+# Контрольная точка прогона: ссылка объявления, список фото, скачанные и отсутствующие фото,
+# а также валидаторы недокачанных файлов для продолжения запросом Range. Клиент и день, за которые
+# прогон записан в историю, позволяют не записывать продолжение того же прогона повторно.
+# Прерванный прогон той же ссылки продолжается с места остановки, а не с первого фото.
+class Checkpoint:
+    def __init__(self, folder_path: str, data: dict):
+        self.path = os.path.join(folder_path, CHECKPOINT_NAME)
+        self.url = data['url']
+        self.base_url = data['base_url']
+        self.image_suffix = data['image_suffix']
+        self.indices: List[int] = data['indices']
+        self.completed: Dict[str, dict] = data.get('completed', {})
+        self.missing: List[int] = data.get('missing', [])
+        self.partial: Dict[str, dict] = data.get('partial', {})
+        self.client_number: Optional[str] = data.get('client_number')
+        self.day: Optional[str] = data.get('day')
+        self.saved_at = data.get('saved_at', time.time())
+        self._last_save = 0.0
+        self._lock = threading.Lock()
+
+    # Чтение контрольной точки папки; устаревшая или повреждённая точка не используется
+    @classmethod
+    def load(cls, folder_path: str) -> Optional['Checkpoint']:
+        path = os.path.join(folder_path, CHECKPOINT_NAME)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                checkpoint = cls(folder_path, json.load(f))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f'Не удалось прочитать контрольную точку {path}: {e}')
+            return None
+        if time.time() - checkpoint.saved_at > CHECKPOINT_MAX_AGE:
+            logging.info(f'Контрольная точка {path} устарела и не используется.')
+            return None
+        return checkpoint
+
+    @classmethod
+    def create(cls, folder_path: str, url: str, base_url: str, image_suffix: str,
+               indices: List[int], client_number: Optional[str] = None, day: Optional[str] = None) -> 'Checkpoint':
+        checkpoint = cls(folder_path, {'url': url, 'base_url': base_url, 'image_suffix': image_suffix,
+                                       'indices': indices, 'client_number': client_number, 'day': day})
+        checkpoint.save(force=True)
+        return checkpoint
+
+    # Прогон уже записан в историю для этого клиента в этот день (день в формате ГГГГ-ММ-ДД)
+    def recorded(self, client_number: str, day: str) -> bool:
+        return self.client_number == client_number and self.day == day
+
+    def mark_recorded(self, client_number: str, day: str) -> None:
+        with self._lock:
+            self.client_number = client_number
+            self.day = day
+        self.save(force=True)
+
+    # Валидаторы ответа запоминаются до начала записи: по ним докачка проверяет, что фото не изменилось
+    def mark_partial(self, file_name: str, info: dict) -> None:
+        with self._lock:
+            self.partial[file_name] = {'url': info['url'], 'etag': info['etag'],
+                                       'last_modified': info['last_modified']}
+
+    def mark_done(self, file_name: str, entry: dict) -> None:
+        with self._lock:
+            self.completed[file_name] = entry
+            self.partial.pop(file_name, None)
+        self.save()
+
+    def mark_missing(self, count: int) -> None:
+        with self._lock:
+            self.missing.append(count)
+        self.save()
+
+    # Атомарная запись; без force не чаще CHECKPOINT_SAVE_INTERVAL, чтобы не писать файл на каждое фото
+    def save(self, force: bool = False) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_save < CHECKPOINT_SAVE_INTERVAL:
+                return
+            self._last_save = now
+            self.saved_at = time.time()
+            data = {'url': self.url, 'base_url': self.base_url, 'image_suffix': self.image_suffix,
+                    'indices': self.indices, 'completed': self.completed, 'missing': self.missing,
+                    'partial': self.partial, 'client_number': self.client_number, 'day': self.day,
+                    'saved_at': self.saved_at}
+            try:
+                with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(self.path + '.tmp', self.path)
+            except Exception as e:
+                logging.error(f'Не удалось сохранить контрольную точку {self.path}: {e}')
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f'Не удалось удалить контрольную точку {self.path}: {e}')
+
+# Функция для поиска номеров фото галереи в HTML-коде страницы (теги <img> и встроенные данные галереи)
+def find_gallery_indices(html: str, base_url: str) -> List[int]:
+    # Сравниваем только путь: в JSON ссылки бывают без протокола и с экранированными слэшами.
+    # Учитываются любые размеры превью, поэтому номера находятся и по миниатюрам.
+    base_path = urlparse(base_url).path
+    pattern = re.compile(re.escape(base_path).replace('/', r'\\?/') + r'(\d+)-\d+x\d+\.\w+')
+    return sorted({int(number) for number in pattern.findall(html)})
+
+# Функция для проверки существования фото по номеру лёгким HEAD-запросом
+def image_exists(base_url: str, image_suffix: str, count: int) -> bool:
+    try:
+        response = session.head(f"{base_url}{count}{image_suffix}", timeout=HTTP_TIMEOUT, allow_redirects=True)
+        return response.status_code == 200
+    except Exception as e:
+        logging.warning(f"Ошибка HEAD-запроса для фото {count}: {e}")
+        return False
+
+# Функция для определения размера галереи: экспоненциальный поиск, затем двоичный
+def probe_gallery_size(base_url: str, image_suffix: str, max_images: int = MAX_IMAGES) -> int:
+    if not image_exists(base_url, image_suffix, 1):
+        return 0
+    # Экспоненциальный поиск первого отсутствующего номера
+    low, high = 1, 2
+    while high <= max_images and image_exists(base_url, image_suffix, high):
+        low, high = high, high * 2
+    high = min(high, max_images + 1)
+    # Двоичный поиск последнего существующего номера между low и high
+    while high - low > 1:
+        middle = (low + high) // 2
+        if image_exists(base_url, image_suffix, middle):
+            low = middle
+        else:
+            high = middle
+    logging.info(f'Размер галереи определён пробными запросами: {low}')
+    return low
+
+# Функция для получения списка номеров фото объявления
+def discover_gallery(html: str, base_url: str, image_suffix: str, max_images: int = MAX_IMAGES) -> List[int]:
+    indices = [count for count in find_gallery_indices(html, base_url) if count <= max_images]
+    # Одна найденная ссылка обычно означает, что страница показывает только обложку
+    if len(indices) > 1:
+        logging.info(f'Список фото найден на странице: {len(indices)} шт.')
+        return indices
+    return list(range(1, probe_gallery_size(base_url, image_suffix, max_images) + 1))
+
+# Функция для параллельного скачивания изображений пулом потоков.
+# В режиме синхронизации неизменённые фото проверяются условными запросами, а устаревшие удаляются.
+# Если передано задание, прогресс помечается его номером, а отмена задания прерывает загрузку.
+# С контрольной точкой уже скачанные и отсутствующие фото пропускаются, недокачанные докачиваются,
+# а прогон, прерванный отменой или сетевыми ошибками, можно продолжить следующим запуском.
+# Фото, которые уже есть в хранилище, размещаются в папке ссылкой на файл хранилища без загрузки
+# (устаревшие записи хранилища перепроверяются условным запросом); скачанные фото добавляются в хранилище.
+def download_images(base_url: str, image_suffix: str, save_path: str, indices: List[int],
+                    workers: int = DOWNLOAD_WORKERS, sync: bool = False, job: Optional['Job'] = None,
+                    checkpoint: Optional[Checkpoint] = None) -> Tuple[int, int]:
+    downloaded = 0
+    attempted = 0
+    failed = 0
+    max_images = len(indices)
+    manifest = load_manifest(save_path) if sync else {}
+    new_manifest = {}
+    # Записи хранилища, перепроверяемые условным запросом, по именам файлов
+    revalidating = {}
+    reused = 0
+    job_id = job.id if job else None
+    metrics = job.metrics if job else None
+    writer = FileWriter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {}
+            for count in indices:
+                image_url = f"{base_url}{count}{image_suffix}"
+                # Определение расширения файла из URL
+                ext = os.path.splitext(image_url)[1]  # включает точку
+                if not ext:
+                    ext = '.jpg'  # стандартное расширение, если отсутствует
+                # Генерация уникального имени файла
+                file_name = f'image_{count}{ext}'
+                file_path = os.path.join(save_path, file_name)
+                resume = None
+                on_response = None
+                if checkpoint:
+                    # Фото, готовые по контрольной точке, не запрашиваются повторно
+                    entry = checkpoint.completed.get(file_name)
+                    if entry and os.path.isfile(file_path) and os.path.getsize(file_path) == entry.get('size'):
+                        new_manifest[file_name] = entry
+                        downloaded += 1
+                        attempted += 1
+                        continue
+                    if count in checkpoint.missing:
+                        attempted += 1
+                        continue
+                    resume = resume_info(checkpoint.partial.get(file_name), image_url, file_path)
+                    on_response = partial(checkpoint.mark_partial, file_name)
+                stored = photo_store.lookup(image_url) if photo_store.enabled and not resume else None
+                if stored and stored['fresh']:
+                    entry = link_stored_image(stored, file_path)
+                    if entry:
+                        new_manifest[file_name] = entry
+                        if checkpoint:
+                            checkpoint.mark_done(file_name, entry)
+                        downloaded += 1
+                        attempted += 1
+                        reused += 1
+                        continue
+                    stored = None
+                if stored:
+                    revalidating[file_name] = stored
+                    headers = store_headers(stored)
+                else:
+                    headers = None if resume else conditional_headers(manifest.get(file_name), image_url, file_path)
+                futures[executor.submit(download_image, image_url, file_path, writer, headers, resume,
+                                        on_response)] = (count, image_url, file_name)
+            if reused:
+                progress_log.info(f'Взято из хранилища фото без загрузки: {reused} из {max_images}.')
+            if attempted > reused:
+                progress_log.info(f'Продолжение прерванной загрузки: готово {downloaded} из {max_images} фото.')
+            if attempted:
+                update_queue.put({'type': 'update_progress', 'job_id': job_id, 'attempted': attempted, 'downloaded': downloaded, 'max_images': max_images})
+
+            # Результаты обрабатываются по мере готовности, прогресс обновляется из одного потока
+            for future in as_completed(futures):
+                if job and job.cancel_event.is_set():
+                    # Ещё не начатые загрузки снимаются, уже идущие завершаются
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                count, image_url, file_name = futures[future]
+                attempted += 1
+                try:
+                    status_code, done, info = future.result()
+                    if metrics:
+                        metrics.add_image(count, image_url, status_code, info['latency'], info['bytes'], info['retries'])
+                    if status_code == 200:
+                        # Ожидание записи файла на диск (ошибка записи поднимется здесь)
+                        sha256 = done.result()
+                        new_manifest[file_name] = {
+                            'url': image_url,
+                            'size': os.path.getsize(os.path.join(save_path, file_name)),
+                            'etag': info['etag'],
+                            'last_modified': info['last_modified'],
+                            'sha256': sha256,
+                        }
+                        store_image(new_manifest[file_name], os.path.join(save_path, file_name))
+                        if checkpoint:
+                            checkpoint.mark_done(file_name, new_manifest[file_name])
+                        # Строки по каждому фото форматируются, только если проходят порог их логгера
+                        image_log.info('Скачано изображение: %s', image_url)
+                        downloaded += 1
+                    elif status_code == 206:
+                        sha256 = done.result()
+                        new_manifest[file_name] = {
+                            'url': image_url,
+                            'size': os.path.getsize(os.path.join(save_path, file_name)),
+                            'etag': info['etag'],
+                            'last_modified': info['last_modified'],
+                            'sha256': sha256,
+                        }
+                        store_image(new_manifest[file_name], os.path.join(save_path, file_name))
+                        checkpoint.mark_done(file_name, new_manifest[file_name])
+                        image_log.info('Докачано изображение: %s (%d байт)', image_url, info['bytes'])
+                        downloaded += 1
+                    elif status_code == 304 and file_name in revalidating:
+                        # Фото хранилища подтверждено сервером и снова считается свежим
+                        stored = revalidating[file_name]
+                        photo_store.touch(stored, checked=True)
+                        entry = link_stored_image(stored, os.path.join(save_path, file_name))
+                        if entry is None:
+                            raise OSError('фото из хранилища не удалось разместить в папке')
+                        new_manifest[file_name] = entry
+                        if checkpoint:
+                            checkpoint.mark_done(file_name, entry)
+                        downloaded += 1
+                    elif status_code == 304:
+                        new_manifest[file_name] = manifest[file_name]
+                        if checkpoint:
+                            checkpoint.mark_done(file_name, manifest[file_name])
+                        image_log.info('Изображение не изменилось: %s', image_url)
+                        downloaded += 1
+                    else:
+                        if checkpoint and status_code == 404:
+                            checkpoint.mark_missing(count)
+                        elif status_code != 404:
+                            failed += 1
+                        # Устаревшим считается только фото, которого больше нет на сервере: после временной
+                        # ошибки (429, 5xx) ранее скачанный файл остаётся в папке
+                        if status_code not in GONE_STATUSES and file_name in manifest:
+                            new_manifest[file_name] = manifest[file_name]
+                        image_log.warning('Не удалось скачать изображение: %s (Статус: %s)', image_url, status_code)
+                except Exception as e:
+                    if metrics:
+                        metrics.add_image(count, image_url, None, None, 0, 0)
+                    failed += 1
+                    # При сетевой ошибке ранее скачанный файл не считается устаревшим
+                    if file_name in manifest:
+                        new_manifest[file_name] = manifest[file_name]
+                    image_log.error('Ошибка при скачивании %s: %s', image_url, e)
+
+                # Обновление прогресса
+                update_queue.put({'type': 'update_progress', 'job_id': job_id, 'attempted': attempted, 'downloaded': downloaded, 'max_images': max_images})
+    finally:
+        writer.stop()
+        if checkpoint:
+            checkpoint.save(force=True)
+
+    # При отмене манифест не перезаписывается: папка остаётся в прежнем согласованном состоянии
+    if job and job.cancel_event.is_set():
+        if checkpoint:
+            logging.info(f'Контрольная точка сохранена, прогон можно продолжить: {checkpoint.path}')
+        else:
+            remove_part_files(save_path)
+        return downloaded, attempted
+
+    if sync:
+        remove_stale_files(save_path, manifest, new_manifest)
+    save_manifest(save_path, new_manifest)
+
+    # Контрольная точка остаётся, пока есть фото, не скачанные из-за сетевых ошибок
+    if checkpoint and failed:
+        progress_log.info(f'Не скачано из-за ошибок: {failed} фото. Повторный запуск продолжит загрузку.')
+        logging.info(f'Контрольная точка сохранена: {checkpoint.path}')
+    else:
+        if checkpoint:
+            checkpoint.remove()
+        remove_part_files(save_path)
+
+    return downloaded, attempted
+
+# Функция для сохранения истории в базу данных (запись выполняет поток записи хранилища)
+def save_history(client_number: str, url: str, time: str, description: str) -> Future:
+    done = history.write('''
+        INSERT INTO history (time, client_number, url, description)
+        VALUES (?, ?, ?, ?)
+    ''', (time, client_number, url, description))
+
+    def log_result(future):
+        if future.exception():
+            logging.error(f'Не удалось сохранить историю: {future.exception()}')
+        else:
+            logging.info(f'История сохранена: Клиент {client_number}, Ссылка {url}, Описание {description}')
+
+    done.add_done_callback(log_result)
+    return done
+
+# Функция для сохранения полей объявления для наблюдения за изменениями (запись выполняет поток записи
+# хранилища). Future получает изменения относительно известных значений и клиентов, которым
+# отправлялось объявление (клиенты ищутся, только если есть изменения).
+def save_listing(url: str, fields: Optional[dict] = None, status: Optional[str] = LISTING_ACTIVE,
+                 etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 content_hash: Optional[str] = None) -> Future:
+    checked_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def store(conn):
+        changes = record_listing(conn, url, checked_at, fields, status, etag, last_modified, content_hash)
+        return changes, fetch_listing_clients(conn, url) if changes else []
+
+    return history.run(store)
+
+# Названия полей объявления и состояний для сообщений об изменениях
+LISTING_FIELD_NAMES = {'title': 'заголовок', 'size': 'метраж', 'address': 'район', 'full_address': 'адрес',
+                       'price': 'цена', 'status': 'состояние'}
+LISTING_STATUS_NAMES = {LISTING_ACTIVE: 'активно', LISTING_REMOVED: 'снято'}
+
+# Функция для текстового описания изменения поля объявления
+def describe_change(field: str, old_value: Optional[str], new_value: Optional[str]) -> str:
+    if field == 'status':
+        old_value = LISTING_STATUS_NAMES.get(old_value, old_value)
+        new_value = LISTING_STATUS_NAMES.get(new_value, new_value)
+    return f"{LISTING_FIELD_NAMES.get(field, field)}: {old_value or '—'} → {new_value or '—'}"
+
+# Функция для сообщения об изменениях объявления (в файл лога и в update_queue), вызывается по готовности
+# записи save_listing. Возвращает изменения.
+def report_listing_changes(url: str, future: Future) -> List[tuple]:
+    if future.exception():
+        logging.error(f'Не удалось сохранить поля объявления {url}: {future.exception()}')
+        return []
+    changes, clients = future.result()
+    if changes:
+        logging.info(f"Объявление изменилось: {url} (клиенты: {', '.join(clients) or '—'}): "
+                     + '; '.join(describe_change(*change) for change in changes))
+        update_queue.put({'type': 'listing_changed', 'url': url, 'clients': clients, 'changes': changes,
+                          'changed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+    return changes
+
+# Парсер HTML: lxml заметно быстрее встроенного, если установлен
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+
+# Классы полей объявления и сколько символов после первого упоминания последнего из них разбирается
+OFFER_MARKERS = ('offer__title', 'offer__advert-title', 'offer__location', 'offer__price')
+OFFER_REGION_TAIL = 20000
+
+# Первая картинка галереи нужного размера (атрибут src, но не data-src)
+IMAGE_PATTERN = re.compile(r'<img\b[^>]*?(?<![-\w])src\s*=\s*["\']([^"\']*750x470[^"\']*)["\']', re.IGNORECASE)
+# Ссылка на фото галереи: база, номер фото и суффикс размера
+GALLERY_URL_PATTERN = re.compile(r'(.*\/)(\d+)(-750x470\.\w+)')
+
+# Функция для извлечения полей объявления из дерева разбора.
+# Второе значение сообщает, найдены ли все теги (иначе быстрый путь уступает полному разбору).
+def _extract_fields(soup) -> Tuple[Dict[str, str], bool]:
+    # Парсинг заголовка объявления
+    title_tag = soup.find('h1', class_='offer__title')
+    title = title_tag.get_text(strip=True) if title_tag else ''
+
+    # Парсинг метража
+    size_tag = soup.find('div', class_='offer__advert-title')
+    size = size_tag.get_text(strip=True).split('Оставить')[0].strip() if size_tag else ''
+
+    # Парсинг адреса
+    address_tag = soup.find('div', class_='offer__location')
+    address = address_tag.get_text(strip=True) if address_tag else ''
+
+    # Парсинг цены
+    price_tag = soup.find('div', class_='offer__price')
+    price = price_tag.get_text(strip=True) if price_tag else ''
+
+    # Парсинг точного адреса
+    full_address_tag = address_tag.find_next('div') if address_tag else None
+    full_address = full_address_tag.get_text(strip=True) if full_address_tag else ''
+    full_address = full_address.replace('Адрес', '').strip()  # Удаление лишнего слова "Адрес"
+
+    listing = {'title': title, 'size': size, 'address': address, 'price': price, 'full_address': full_address}
+    complete = all(tag is not None for tag in (title_tag, size_tag, address_tag, price_tag, full_address_tag))
+    return listing, complete
+
+# Функция для полного разбора всей страницы (эталонный и запасной путь)
+def extract_listing_full(html: str, parser: str = 'html.parser') -> Dict[str, str]:
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, parser)
+    listing, _ = _extract_fields(soup)
+    img_tag = soup.find('img', src=re.compile('750x470'))
+    listing['image_url'] = img_tag['src'] if img_tag else ''
+    return listing
+
+# Функция для выделения области страницы с полями объявления
+def find_offer_region(html: str) -> Optional[str]:
+    positions = [html.find(marker) for marker in OFFER_MARKERS]
+    if min(positions) < 0:
+        return None
+    start = html.rfind('<', 0, min(positions))
+    return html[max(start, 0):max(positions) + OFFER_REGION_TAIL]
+
+# Функция для быстрого извлечения полей объявления: разбирается только область полей,
+# картинка ищется регулярным выражением по исходному тексту
+def extract_listing(html: str) -> Dict[str, str]:
+    from bs4 import BeautifulSoup
+    region = find_offer_region(html)
+    listing, complete = _extract_fields(BeautifulSoup(region, HTML_PARSER)) if region else ({}, False)
+    if not complete:
+        logging.debug('Область объявления не найдена целиком, выполняется полный разбор страницы.')
+        return extract_listing_full(html, HTML_PARSER)
+    img_match = IMAGE_PATTERN.search(html)
+    listing['image_url'] = unescape(img_match.group(1)) if img_match else ''
+    return listing
+
+# Функция для хеша области полей объявления: при совпадении с прежним страница не разбирается заново
+def listing_digest(html: str) -> str:
+    region = find_offer_region(html)
+    return hashlib.sha1((region if region is not None else html).encode('utf-8')).hexdigest()
+
+# Настройки обработки фото после загрузки (миниатюры, пережатие, хеши); меняются интерфейсом и командной строкой
+postprocess_options = parser_images.PostprocessOptions()
+
+# Функция для обработки скачанных фото в пуле процессов и поиска дубликатов:
+# внутри папки и среди фото других объявлений по индексу хешей в базе
+def postprocess_images(job: 'Job', save_path: str) -> None:
+    manifest = load_manifest(save_path)
+    # Порядок галереи, а не алфавитный: дубликатом считается более позднее фото
+    names = sorted(manifest, key=lambda name: int(re.sub(r'\D', '', name) or 0))
+    if not parser_images.PIL_AVAILABLE:
+        logging.warning('Pillow не установлен: миниатюры и перцептивные хеши не строятся, '
+                        'дубликаты ищутся только по точному совпадению.')
+    results = {result['file_name']: result for result in parser_images.process_images(
+        [os.path.join(save_path, name) for name in names], postprocess_options, job.cancel_event)}
+    if job.cancel_event.is_set():
+        return
+    images = []
+    for name in names:
+        result = results.get(name, {})
+        if result.get('error'):
+            logging.warning(f"Не удалось обработать фото {name}: {result['error']}")
+        images.append({'file_name': name, 'sha256': manifest[name].get('sha256'), 'phash': result.get('phash')})
+    variants = sum(len(result['variants']) for result in results.values())
+
+    folder_duplicates = parser_images.find_folder_duplicates(images)
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        other_duplicates = history.run(lambda conn: register_image_hashes(
+            conn, job.url, job.client_number, save_path, images, current_time,
+            parser_images.PHASH_MAX_DISTANCE)).result()
+    except Exception as e:
+        logging.error(f'Не удалось сохранить хеши фото: {e}')
+        other_duplicates = []
+
+    lines = [f'Обработано фото: {len(images)}, создано вариантов: {variants}.']
+    for name, original, distance in folder_duplicates:
+        lines.append(f'Дубликат в папке: {name} = {original}' + (f' (отличие {distance})' if distance else ''))
+    for name, other_url, other_client, other_folder, other_file, distance in other_duplicates:
+        lines.append(f'Фото {name} уже было в объявлении {other_url} (клиент {other_client}, '
+                     f'{os.path.join(other_folder, other_file)})' + (f', отличие {distance}' if distance else ''))
+    for line in lines:
+        progress_log.info(line)
+
+# Итоговые статусы запуска в таблице runs
+RUN_DONE = 'done'
+RUN_FAILED = 'failed'
+RUN_CANCELLED = 'cancelled'
+
+# Замеры одного запуска: время этапов, сведения о каждом изображении и число повторов запросов
+class RunMetrics:
+    def __init__(self, url: str, client_number: str):
+        self.url = url
+        self.client_number = client_number
+        self.started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.stages: Dict[str, float] = {}
+        self.images: List[tuple] = []
+        self.from_cache = False
+        self.page_retries = 0
+        # Ограничения хостов общие для всех заданий: за запуск считается прирост счётчика
+        self.throttled_before = rate_limiter.throttled_total()
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    # Замер этапа в миллисекундах: with metrics.stage('fetch'): ...
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+    # Сведения об одном изображении (вызывается из потоков загрузки); status None — сетевая ошибка
+    def add_image(self, number: int, url: str, status: Optional[int], latency: Optional[float],
+                  size: int, retries: int) -> None:
+        latency_ms = latency * 1000 if latency is not None else None
+        with self._lock:
+            self.images.append((number, url, status, latency_ms, size, retries))
+
+    # Строки для таблицы run_images
+    def image_rows(self) -> List[tuple]:
+        with self._lock:
+            return list(self.images)
+
+    # Ограничения хостов страницы и фото этого запуска на текущий момент
+    def host_limits(self) -> str:
+        hosts = {host_key(self.url)} | {host_key(image[1]) for image in self.image_rows()}
+        return '; '.join(
+            f"{limit['host']} {'-' if limit['rate'] is None else format(limit['rate'], '.1f')} запр/с "
+            f"x{limit['concurrency']}" for limit in rate_limiter.snapshot() if limit['host'] in hosts)
+
+    # Итоговая запись для таблицы runs
+    def summary(self, status: str) -> dict:
+        images = self.image_rows()
+        downloaded = sum(image[2] in (200, 206, 304) for image in images)
+        missing = sum(image[2] == 404 for image in images)
+        return {
+            'started_at': self.started_at,
+            'url': self.url,
+            'client_number': self.client_number,
+            'status': status,
+            'from_cache': int(self.from_cache),
+            'page_fetch_ms': self.stages.get('fetch'),
+            'parse_ms': self.stages.get('parse'),
+            'discover_ms': self.stages.get('discover'),
+            'download_ms': self.stages.get('download'),
+            'postprocess_ms': self.stages.get('postprocess'),
+            'total_ms': (time.perf_counter() - self._started) * 1000,
+            'images_total': len(images),
+            'images_downloaded': downloaded,
+            'images_missing': missing,
+            'images_failed': len(images) - downloaded - missing,
+            'bytes': sum(image[4] for image in images),
+            'retries': self.page_retries + sum(image[5] for image in images),
+            'throttled': rate_limiter.throttled_total() - self.throttled_before,
+            'host_limits': self.host_limits(),
+        }
+
+# Функция для сохранения замеров запуска: запуск и его изображения записываются одной транзакцией
+def save_run(metrics: RunMetrics, status: str) -> Future:
+    run = metrics.summary(status)
+    images = metrics.image_rows()
+    logging.info(
+        f"Замеры запуска {metrics.url}: страница {run['page_fetch_ms'] or 0:.0f} мс"
+        f"{' (кэш)' if run['from_cache'] else ''}, разбор {run['parse_ms'] or 0:.0f} мс, "
+        f"поиск фото {run['discover_ms'] or 0:.0f} мс, загрузка {run['download_ms'] or 0:.0f} мс, "
+        f"всего {run['total_ms']:.0f} мс; фото {run['images_downloaded']}/{run['images_total']}, "
+        f"{run['bytes'] / (1024 * 1024):.1f} МБ, повторов {run['retries']}, ограничений хостом {run['throttled']}"
+        f"{'; ' + run['host_limits'] if run['throttled'] else ''}")
+    done = history.run(lambda conn: insert_run(conn, run, images))
+
+    def log_result(future):
+        if future.exception():
+            logging.error(f'Не удалось сохранить замеры запуска: {future.exception()}')
+
+    done.add_done_callback(log_result)
+    return done
+
+# Заголовки сводки замеров по дням (порядок столбцов fetch_run_summary)
+RUN_SUMMARY_HEADERS = ('день', 'запусков', 'успешно', 'страница, мс', 'разбор, мс', 'поиск фото, мс',
+                       'загрузка, мс', 'всего, мс', 'фото', 'нет фото', 'ошибок фото', 'байт', 'повторов',
+                       'фото/с', 'МБ/с', 'ограничений')
+
+# Функция для процентиля по отсортированному списку
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))]
+
+# Функция для текстовой сводки замеров за последние days дней (вкладка метрик и командная строка)
+def run_summary_report(days: int = 30) -> str:
+    conn = get_connection()
+    rows = fetch_run_summary(conn, days)
+    if not rows:
+        return f'Запусков за последние {days} дн. нет.'
+    lines = []
+    for row in rows:
+        (day, runs, done, fetch_ms, parse_ms, discover_ms, download_ms, total_ms, images, missing,
+         failed, size, retries, images_per_second, megabytes_per_second, throttled) = row
+        lines.append(
+            f'{day}: запусков {runs} (успешно {done}); в среднем страница {fetch_ms or 0:.0f} мс, '
+            f'разбор {parse_ms or 0:.0f} мс, поиск фото {discover_ms or 0:.0f} мс, '
+            f'загрузка {download_ms or 0:.0f} мс, всего {total_ms or 0:.0f} мс; '
+            f'фото {images or 0} (нет {missing or 0}, ошибок {failed or 0}), '
+            f'{(size or 0) / (1024 * 1024):.1f} МБ, повторов {retries or 0}, ограничений хостами {throttled or 0}; '
+            f'{images_per_second or 0:.1f} фото/с, {megabytes_per_second or 0:.2f} МБ/с')
+    latencies = fetch_image_latencies(conn, days)
+    if latencies:
+        lines.append(f'Задержка фото за {days} дн.: p50 {percentile(latencies, 0.5):.0f} мс, '
+                     f'p95 {percentile(latencies, 0.95):.0f} мс, максимум {latencies[-1]:.0f} мс '
+                     f'({len(latencies)} шт.)')
+    return '\n'.join(lines)
+
+# Функция для текущих ограничений запросов по хостам (вкладка метрик и командная строка)
+def host_limits_report() -> str:
+    limits = rate_limiter.snapshot()
+    if not limits:
+        return 'Запросов к хостам ещё не было.'
+    return '\n'.join(describe_limit(limit) for limit in limits)
+
+# Функция для выгрузки замеров в CSV: сводка по дням или все запуски (runs=True); возвращает число строк
+def export_run_metrics(path: str, days: int = 30, runs: bool = False) -> int:
+    conn = get_connection()
+    if runs:
+        headers = ('id',) + RUN_FIELDS
+        rows = conn.execute(f'''
+            SELECT id, {', '.join(RUN_FIELDS)} FROM runs
+            WHERE started_at >= date('now', 'localtime', ?)
+            ORDER BY id
+        ''', (f'-{max(0, days - 1)} days',)).fetchall()
+    else:
+        headers = RUN_SUMMARY_HEADERS
+        rows = fetch_run_summary(conn, days)
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(headers)
+        writer.writerows(rows)
+    logging.info(f'Замеры выгружены в {path}: {len(rows)} строк')
+    return len(rows)
+
+# Функция для потоковой выгрузки истории или запусков в CSV, JSON Lines или Parquet; возвращает число строк.
+# Накопленные записи фиксируются, а база мигрирует до начала чтения.
+def export_data(path: str, table: str = 'history', export_format: Optional[str] = None, client_number: str = '',
+                date_from: str = '', date_to: str = '', progress: Optional[Callable[[int], None]] = None) -> int:
+    get_connection()
+    history.flush()
+    return export_table(history.db_path, path, table, export_format, client_number, date_from, date_to,
+                        progress=progress)
+
+# Основная функция парсинга одного объявления (выполняется в потоке задания).
+# Замеры этапов сохраняются при любом исходе, включая ошибку и отмену.
+def parse_listing(job: 'Job') -> bool:
+    metrics = job.metrics = RunMetrics(job.url, job.client_number)
+    success = False
+    try:
+        success = _parse_listing(job, metrics)
+        return success
+    finally:
+        status = RUN_DONE if success else RUN_CANCELLED if job.cancel_event.is_set() else RUN_FAILED
+        save_run(metrics, status)
+
+def _parse_listing(job: 'Job', metrics: RunMetrics) -> bool:
+    url = job.url
+    client_number = job.client_number
+    save_path = job.save_path
+    progress_queue = update_queue
+
+    # Прерванный прогон той же ссылки продолжается: папка не очищается, список фото берётся из контрольной точки
+    checkpoint = Checkpoint.load(save_path) if os.path.isdir(save_path) else None
+    if checkpoint and checkpoint.url != url:
+        checkpoint = None
+    if checkpoint:
+        logging.info(f'Найдена контрольная точка прерванного прогона: {url}')
+
+    # Очистка папки (в режиме синхронизации содержимое сохраняется)
+    if not job.sync and not checkpoint:
+        clear_folder(save_path)
+    os.makedirs(save_path, exist_ok=True)
+
+    # Упреждающая загрузка той же ссылки (из поля ввода) заменяет загрузку и разбор страницы
+    prefetch = take_prefetch(url)
+    prefetched = None
+
+    # Загрузка страницы
+    try:
+        with metrics.stage('fetch'):
+            prefetched = prefetch.result() if prefetch else None
+            if prefetched:
+                response = prefetched['response']
+                logging.info(f'Страница взята из упреждающей загрузки: {url}')
+            else:
+                response = page_cache.fetch(session, url, timeout=HTTP_TIMEOUT)
+        metrics.from_cache = response.from_cache
+        metrics.page_retries = response.retries
+        logging.info(f'Страница загружена: {url} Статус: {response.status_code}')
+    except Exception as e:
+        logging.error(f"Не удалось загрузить страницу {url}: {e}")
+        progress_queue.put({'type': 'error', 'job_id': job.id, 'message': f"Не удалось загрузить страницу: {e}"})
+        return False
+
+    if response.status_code == 200:
+        # Извлечение полей объявления
+        with metrics.stage('parse'):
+            listing = prefetched['listing'] if prefetched else extract_listing(response.text)
+        size = listing['size']
+        full_address = listing['full_address']
+        price = listing['price']
+
+        # Форматирование вывода
+        formatted_output = f"{size}, {full_address}, {price}"
+
+        # Обновление поля описания квартиры
+        progress_queue.put({'type': 'description', 'job_id': job.id, 'description': formatted_output})
+
+        # Сохранение истории в базу данных (продолжение прогона того же клиента в тот же день
+        # уже записано в историю)
+        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        today = current_time[:10]
+        if not (checkpoint and checkpoint.recorded(client_number, today)):
+            description = formatted_output  # Используем спарсенное описание
+            save_history(client_number, url, current_time, description)
+            if checkpoint:
+                checkpoint.mark_recorded(client_number, today)
+
+        # Поля объявления (вместе с заголовком) запоминаются для наблюдения за изменениями
+        saved = save_listing(url, listing, etag=response.headers.get('ETag'),
+                             last_modified=response.headers.get('Last-Modified'),
+                             content_hash=listing_digest(response.text))
+        saved.add_done_callback(partial(report_listing_changes, url))
+
+        # Первая картинка нужного размера
+        img_url = listing['image_url']
+        if img_url:
+            # Извлекаем base_url и суффикс из найденной ссылки
+            match = GALLERY_URL_PATTERN.match(img_url)
+            if match:
+                base_url = match.group(1)
+                image_suffix = match.group(3)
+
+                # Логирование готовности папки
+                logging.info(f'Папка для изображений готова: {save_path}')
+
+                # Определение списка фото и настройка прогресс-бара
+                if checkpoint and (checkpoint.base_url, checkpoint.image_suffix) == (base_url, image_suffix):
+                    indices = checkpoint.indices
+                else:
+                    # Галерея объявления сменилась: старая контрольная точка не подходит
+                    if checkpoint and not job.sync:
+                        clear_folder(save_path)
+                    with metrics.stage('discover'):
+                        if prefetched and prefetched['gallery'] == (base_url, image_suffix):
+                            indices = prefetched['indices']
+                        else:
+                            indices = discover_gallery(response.text, base_url, image_suffix)
+                    checkpoint = Checkpoint.create(save_path, url, base_url, image_suffix, indices,
+                                                   client_number, today)
+                max_images = len(indices)
+                progress_queue.put({'type': 'init_progress', 'job_id': job.id, 'max_images': max_images})
+
+                # Параллельное скачивание изображений
+                with metrics.stage('download'):
+                    # Прогреваемые фото дожидаются, чтобы взять их из хранилища, а не скачать второй раз
+                    if prefetch:
+                        prefetch.wait_images(HTTP_TIMEOUT)
+                    downloaded, attempted = download_images(base_url, image_suffix, save_path, indices,
+                                                            job.workers, job.sync, job, checkpoint)
+                if job.postprocess and not job.cancel_event.is_set():
+                    with metrics.stage('postprocess'):
+                        postprocess_images(job, save_path)
+                if job.cancel_event.is_set():
+                    logging.info(f'Задание {job.id} отменено: {url}')
+                    return False
+
+                # После завершения скачивания
+                progress_log.info(f'Попытки загрузки завершены. Скачано {downloaded} изображений.')
+                update_queue.put({'type': 'complete', 'job_id': job.id, 'downloaded': downloaded, 'max_images': max_images})
+                return True
+            else:
+                progress_log.warning("Не удалось извлечь base_url из ссылки на изображение.")
+        else:
+            progress_log.warning("Не удалось найти изображение нужного размера на странице.")
+    else:
+        logging.error(f"Страница {url} вернула статус {response.status_code}")
+        progress_queue.put({'type': 'error', 'job_id': job.id, 'message': f"Страница вернула статус {response.status_code}"})
+    return False
+
+# Количество одновременно выполняемых заданий и минимальный интервал между заданиями к одному хосту, сек
+JOB_WORKERS = 2
+HOST_INTERVAL = 1.0
+
+# Статусы заданий
+JOB_QUEUED = 'В очереди'
+JOB_RUNNING = 'Выполняется'
+JOB_DONE = 'Готово'
+JOB_FAILED = 'Ошибка'
+JOB_CANCELLED = 'Отменено'
+
+# Задание на парсинг одного объявления
+class Job:
+    def __init__(self, job_id: int, url: str, client_number: str, save_path: str,
+                 workers: int = DOWNLOAD_WORKERS, sync: bool = False, postprocess: bool = False):
+        self.id = job_id
+        self.url = url
+        self.client_number = client_number
+        self.save_path = save_path
+        self.workers = workers
+        self.sync = sync
+        self.postprocess = postprocess
+        self.status = JOB_QUEUED
+        self.cancel_event = threading.Event()
+        self.finished = threading.Event()
+        self.metrics: Optional[RunMetrics] = None
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    # Ожидание завершения задания; возвращает True, если задание завершилось
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.finished.wait(timeout)
+
+    # Функция callback(job) вызывается по завершении задания (сразу, если оно уже завершено)
+    def add_done_callback(self, callback: Callable[['Job'], None]) -> None:
+        with self._callbacks_lock:
+            if not self.finished.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _finish(self) -> None:
+        with self._callbacks_lock:
+            self.finished.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logging.error(f'Ошибка обработчика завершения задания {self.id}: {e}')
+
+# Планировщик заданий: ограниченный пул потоков и ограничение частоты обращений к каждому хосту
+class JobScheduler:
+    def __init__(self, max_jobs: int = JOB_WORKERS, host_interval: float = HOST_INTERVAL):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_jobs))
+        self.host_interval = host_interval
+        self.jobs = {}
+        self.host_next_time = {}
+        self.lock = threading.Lock()
+        self.last_id = 0
+
+    def submit(self, url: str, client_number: str, save_path: str,
+               workers: int = DOWNLOAD_WORKERS, sync: bool = False, postprocess: bool = False) -> 'Job':
+        with self.lock:
+            self.last_id += 1
+            job = Job(self.last_id, url, client_number, save_path, workers, sync, postprocess)
+            self.jobs[job.id] = job
+        self._set_status(job, JOB_QUEUED)
+        self.executor.submit(self._run, job)
+        logging.info(f'Задание {job.id} поставлено в очередь: {url}')
+        return job
+
+    def cancel(self, job_id: int) -> None:
+        job = self.jobs.get(job_id)
+        if job and job.status in (JOB_QUEUED, JOB_RUNNING):
+            job.cancel_event.set()
+            logging.info(f'Запрошена отмена задания {job_id}')
+
+    def shutdown(self) -> None:
+        for job in list(self.jobs.values()):
+            job.cancel_event.set()
+        self.executor.shutdown(wait=False)
+
+    def _set_status(self, job, status):
+        job.status = status
+        update_queue.put({'type': 'job_status', 'job_id': job.id, 'status': status,
+                          'url': job.url, 'client_number': job.client_number})
+
+    # Ожидание очереди хоста; возвращает False, если задание отменили во время ожидания
+    def _wait_for_host(self, job):
+        return self.wait_for_host(job.url, job.cancel_event)
+
+    # Ожидание очереди хоста ссылки (общей для заданий и обхода выдачи); False — если отменили
+    def wait_for_host(self, url: str, cancel_event: threading.Event) -> bool:
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            start_time = max(now, self.host_next_time.get(host, now))
+            self.host_next_time[host] = start_time + self.host_interval
+        return not cancel_event.wait(start_time - now)
+
+    def _run(self, job):
+        try:
+            self._execute(job)
+        finally:
+            job._finish()
+
+    def _execute(self, job):
+        if job.cancel_event.is_set() or not self._wait_for_host(job):
+            self._set_status(job, JOB_CANCELLED)
+            return
+        self._set_status(job, JOB_RUNNING)
+        try:
+            success = parse_listing(job)
+        except Exception as e:
+            logging.error(f'Задание {job.id} завершилось с ошибкой: {e}')
+            update_queue.put({'type': 'error', 'job_id': job.id, 'message': f"Ошибка парсинга: {e}"})
+            success = False
+        if job.cancel_event.is_set():
+            self._set_status(job, JOB_CANCELLED)
+        else:
+            self._set_status(job, JOB_DONE if success else JOB_FAILED)
+
+# Функция для разбора списка заданий: по одному в строке "ссылка;номер клиента;папка"
+def parse_job_lines(text: str, default_folder: str = '') -> List[Tuple[str, str, str]]:
+    jobs = []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = [part.strip() for part in re.split(r'[;\t]', line)]
+        url = parts[0]
+        client_number = parts[1] if len(parts) > 1 else ''
+        save_path = parts[2] if len(parts) > 2 and parts[2] else default_folder
+        if not is_valid_url(url) or not client_number or not save_path:
+            logging.warning(f'Пропущена строка {line_number} списка заданий: {line}')
+            continue
+        jobs.append((url, client_number, save_path))
+    return jobs
+
+# Планировщик заданий парсинга
+scheduler = JobScheduler()
+
+# Функция для синхронного парсинга одного объявления через общий планировщик
+def run_job(url: str, client_number: str, save_path: str,
+            workers: int = DOWNLOAD_WORKERS, sync: bool = False, postprocess: bool = False) -> Job:
+    job = scheduler.submit(url, client_number, save_path, workers, sync, postprocess)
+    job.wait()
+    return job
+
+# Ссылки на объявления в выдаче поиска (относительные и абсолютные)
+LISTING_LINK_PATTERN = re.compile(r'href\s*=\s*["\']((?:https?://[^"\'/]+)?/a/show/(\d+))', re.IGNORECASE)
+
+# Ссылка на следующую страницу выдачи: rel="next" или кнопка пагинатора krisha.kz
+NEXT_PAGE_PATTERNS = (
+    re.compile(r'<(?:a|link)\b[^>]*\brel\s*=\s*["\']next["\'][^>]*>', re.IGNORECASE),
+    re.compile(r'<a\b[^>]*\bclass\s*=\s*["\'][^"\']*paginator__btn--next[^"\']*["\'][^>]*>', re.IGNORECASE),
+)
+HREF_PATTERN = re.compile(r'\bhref\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+
+# Предельное число страниц выдачи за один обход и сколько объявлений обхода одновременно в планировщике
+CRAWL_MAX_PAGES = 50
+CRAWL_MAX_IN_FLIGHT = 4
+
+# Функция для извлечения ссылок на объявления со страницы выдачи: (номер объявления, ссылка) без повторов
+def find_listing_links(html: str, page_url: str) -> List[Tuple[str, str]]:
+    links = {}
+    for match in LISTING_LINK_PATTERN.finditer(html):
+        listing_id = match.group(2)
+        if listing_id not in links:
+            links[listing_id] = urljoin(page_url, match.group(1))
+    return list(links.items())
+
+# Функция для поиска ссылки на следующую страницу выдачи
+def find_next_page(html: str, page_url: str) -> Optional[str]:
+    for pattern in NEXT_PAGE_PATTERNS:
+        tag = pattern.search(html)
+        if tag:
+            href = HREF_PATTERN.search(tag.group(0))
+            if href:
+                return urljoin(page_url, unescape(href.group(1)))
+    return None
+
+# Функция для ссылки на страницу выдачи с номером page_number (запасной путь, если пагинатор не найден)
+def search_page_url(search_url: str, page_number: int) -> str:
+    parts = urlsplit(search_url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key != 'page']
+    if page_number > 1:
+        query.append(('page', str(page_number)))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+
+# Обход выдачи поиска: страницы проходятся по пагинации, новые объявления сразу ставятся
+# в планировщик (не больше max_in_flight одновременно), результаты идут по мере готовности
+class Crawl:
+    def __init__(self, crawl_id: int, search_url: str, client_number: str, folder: str,
+                 workers: int = DOWNLOAD_WORKERS, sync: bool = False, postprocess: bool = False,
+                 skip_parsed: bool = True, max_pages: int = CRAWL_MAX_PAGES,
+                 max_in_flight: int = CRAWL_MAX_IN_FLIGHT, job_scheduler: Optional['JobScheduler'] = None):
+        self.id = crawl_id
+        self.search_url = search_url
+        self.client_number = client_number
+        self.folder = folder
+        self.workers = workers
+        self.sync = sync
+        self.postprocess = postprocess
+        self.skip_parsed = skip_parsed
+        self.max_pages = max_pages
+        self.max_in_flight = max_in_flight
+        self.scheduler = job_scheduler or scheduler
+        self.jobs: List[Job] = []
+        self.pages = 0
+        self.found = 0
+        self.skipped = 0
+        self.cancel_event = threading.Event()
+        self.finished = threading.Event()
+
+    # Остановка обхода: новые страницы не загружаются, поставленные задания отменяются
+    def cancel(self) -> None:
+        self.cancel_event.set()
+        for job in list(self.jobs):
+            self.scheduler.cancel(job.id)
+        logging.info(f'Запрошена остановка обхода выдачи {self.id}')
+
+    # Ожидание окончания обхода и всех его заданий
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self.finished.wait(timeout):
+            return False
+        for job in list(self.jobs):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not job.wait(remaining):
+                return False
+        return True
+
+# Функция для публикации состояния обхода
+def _crawl_status(crawl: Crawl, message: str = '') -> None:
+    update_queue.put({'type': 'crawl_status', 'crawl_id': crawl.id, 'pages': crawl.pages, 'found': crawl.found,
+                      'skipped': crawl.skipped, 'queued': len(crawl.jobs), 'finished': crawl.finished.is_set(),
+                      'message': message})
+
+# Функция обхода выдачи (выполняется в отдельном потоке)
+def _run_crawl(crawl: Crawl) -> None:
+    job_scheduler = crawl.scheduler
+    try:
+        # Уже спарсенные объявления берутся из истории один раз, через поток записи базы
+        parsed_ids = history.run(fetch_parsed_listing_ids).result() if crawl.skip_parsed else set()
+        seen = set()
+        slots = threading.BoundedSemaphore(max(1, crawl.max_in_flight))
+        page_url = crawl.search_url
+        visited = set()
+        # Номер страницы подставлен без ссылки пагинатора: её отсутствие означает конец выдачи
+        guessed = False
+        while page_url and page_url not in visited and crawl.pages < crawl.max_pages:
+            visited.add(page_url)
+            if not job_scheduler.wait_for_host(page_url, crawl.cancel_event):
+                break
+            try:
+                response = session.get(page_url, timeout=HTTP_TIMEOUT)
+            except Exception as e:
+                logging.error(f'Не удалось загрузить страницу выдачи {page_url}: {e}')
+                _crawl_status(crawl, f'Не удалось загрузить страницу выдачи: {e}')
+                break
+            if response.status_code == 404 and guessed:
+                break
+            if response.status_code != 200:
+                logging.error(f'Страница выдачи {page_url} вернула статус {response.status_code}')
+                _crawl_status(crawl, f'Страница выдачи вернула статус {response.status_code}')
+                break
+            crawl.pages += 1
+            html = decode_page(response)
+            links = [(listing_id, url) for listing_id, url in find_listing_links(html, page_url)
+                     if listing_id not in seen]
+            seen.update(listing_id for listing_id, _ in links)
+            new_links = [(listing_id, url) for listing_id, url in links if listing_id not in parsed_ids]
+            crawl.found += len(links)
+            crawl.skipped += len(links) - len(new_links)
+            logging.info(f'Страница выдачи {crawl.pages}: объявлений {len(links)}, новых {len(new_links)} ({page_url})')
+            _crawl_status(crawl, f'Страница выдачи {crawl.pages}: объявлений {len(links)}, новых {len(new_links)}')
+
+            for listing_id, url in new_links:
+                # Задание ставится, только когда освободилось место: планировщик не заваливается всей выдачей
+                while not slots.acquire(timeout=0.2):
+                    if crawl.cancel_event.is_set():
+                        return
+                if crawl.cancel_event.is_set():
+                    slots.release()
+                    return
+                job = job_scheduler.submit(url, crawl.client_number, os.path.join(crawl.folder, listing_id),
+                                           crawl.workers, crawl.sync, crawl.postprocess)
+                crawl.jobs.append(job)
+                job.add_done_callback(lambda _job: slots.release())
+
+            if not links:
+                break
+            next_page = find_next_page(html, page_url)
+            guessed = next_page is None
+            page_url = next_page or search_page_url(crawl.search_url, crawl.pages + 1)
+    except Exception as e:
+        logging.error(f'Обход выдачи {crawl.search_url} завершился с ошибкой: {e}')
+        _crawl_status(crawl, f'Ошибка обхода выдачи: {e}')
+    finally:
+        crawl.finished.set()
+        logging.info(f'Обход выдачи завершён: страниц {crawl.pages}, объявлений {crawl.found}, '
+                     f'пропущено спарсенных {crawl.skipped}, поставлено {len(crawl.jobs)}')
+        _crawl_status(crawl, f'Обход завершён: страниц {crawl.pages}, объявлений {crawl.found}, '
+                             f'пропущено спарсенных {crawl.skipped}, поставлено в очередь {len(crawl.jobs)}')
+
+_crawl_ids = itertools.count(1)
+
+# Функция для запуска обхода выдачи поиска в фоне; объявления сохраняются в папки folder/<номер объявления>
+def start_crawl(search_url: str, client_number: str, folder: str, workers: int = DOWNLOAD_WORKERS,
+                sync: bool = False, postprocess: bool = False, skip_parsed: bool = True,
+                max_pages: int = CRAWL_MAX_PAGES, job_scheduler: Optional[JobScheduler] = None) -> Crawl:
+    crawl = Crawl(next(_crawl_ids), search_url, client_number, folder, workers, sync, postprocess,
+                  skip_parsed, max_pages, job_scheduler=job_scheduler)
+    threading.Thread(target=_run_crawl, args=(crawl,), daemon=True).start()
+    logging.info(f'Запущен обход выдачи {crawl.id}: {search_url}')
+    return crawl
+
+# Настройки наблюдения за объявлениями: как часто перепроверяется каждое объявление, сек, сколько
+# проверок идёт одновременно, сколько объявлений берётся из базы за раз и как часто ищутся
+# объявления, которым подошёл срок, сек
+WATCH_INTERVAL = 6 * 60 * 60
+WATCH_WORKERS = 8
+WATCH_BATCH_SIZE = 500
+WATCH_POLL = 60
+
+# Статусы ответа, означающие, что объявление снято
+REMOVED_STATUSES = (404, 410)
+
+# Итоги проверки объявления
+CHECK_NOT_MODIFIED = 'not_modified'
+CHECK_UNCHANGED = 'unchanged'
+CHECK_FETCHED = 'fetched'
+CHECK_REMOVED = 'removed'
+CHECK_ERROR = 'error'
+
+# Функция для проверки объявления условным запросом (ETag / Last-Modified с прошлой проверки).
+# Ответ 304 и страница с прежним хешем области полей не разбираются; 404/410, переход со страницы
+# объявления и страница без полей объявления означают, что объявление снято.
+def check_listing(url: str, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                  content_hash: Optional[str] = None) -> dict:
+    result = {'url': url, 'outcome': CHECK_ERROR, 'fields': None, 'etag': None, 'last_modified': None,
+              'content_hash': None, 'error': ''}
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    try:
+        response = session.get(url, timeout=HTTP_TIMEOUT, headers=headers or None)
+    except Exception as e:
+        result['error'] = str(e)
+        return result
+    result['etag'] = response.headers.get('ETag')
+    result['last_modified'] = response.headers.get('Last-Modified')
+    if response.status_code == 304:
+        result['outcome'] = CHECK_NOT_MODIFIED
+    elif response.status_code in REMOVED_STATUSES or (response.history and '/a/show/' not in response.url):
+        result['outcome'] = CHECK_REMOVED
+    elif response.status_code == 200:
+        # Ошибка разбора одной страницы считается ошибкой проверки этого объявления, а не всего прохода
+        try:
+            html = decode_page(response)
+            result['content_hash'] = listing_digest(html)
+            if result['content_hash'] == content_hash:
+                result['outcome'] = CHECK_UNCHANGED
+            else:
+                listing = extract_listing(html)
+                if any(listing.get(field) for field in LISTING_FIELDS):
+                    result['outcome'] = CHECK_FETCHED
+                    result['fields'] = listing
+                else:
+                    result['outcome'] = CHECK_REMOVED
+        except Exception as e:
+            result['outcome'] = CHECK_ERROR
+            result['content_hash'] = None
+            result['error'] = str(e)
+    else:
+        result['error'] = f'статус {response.status_code}'
+    return result
+
+# Наблюдение за объявлениями из истории: объявления, которым подошёл срок, проверяются в фоне
+# не больше workers одновременно, изменения записываются в базу и публикуются по мере обнаружения
+class Watch:
+    def __init__(self, watch_id: int, interval: float = WATCH_INTERVAL, workers: int = WATCH_WORKERS,
+                 once: bool = False, force: bool = False, batch_size: int = WATCH_BATCH_SIZE):
+        self.id = watch_id
+        self.interval = interval
+        self.workers = workers
+        self.once = once
+        self.force = force
+        self.batch_size = batch_size
+        self.passes = 0
+        self.counts = dict.fromkeys((CHECK_NOT_MODIFIED, CHECK_UNCHANGED, CHECK_FETCHED, CHECK_REMOVED,
+                                     CHECK_ERROR), 0)
+        self.changed = 0
+        self.cancel_event = threading.Event()
+        self.finished = threading.Event()
+
+    # Остановка наблюдения: начатые проверки завершаются, новые не начинаются
+    def cancel(self) -> None:
+        self.cancel_event.set()
+        logging.info(f'Запрошена остановка наблюдения {self.id}')
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.finished.wait(timeout)
+
+    @property
+    def checked(self) -> int:
+        return sum(self.counts.values())
+
+# Функция для публикации состояния наблюдения
+def _watch_status(watch: Watch, message: str = '') -> None:
+    update_queue.put({'type': 'watch_status', 'watch_id': watch.id, 'passes': watch.passes,
+                      'checked': watch.checked, 'not_modified': watch.counts[CHECK_NOT_MODIFIED],
+                      'unchanged': watch.counts[CHECK_UNCHANGED], 'removed': watch.counts[CHECK_REMOVED],
+                      'errors': watch.counts[CHECK_ERROR], 'changed': watch.changed,
+                      'finished': watch.finished.is_set(), 'message': message})
+
+# Функция для записи результата проверки; изменения публикуются, когда поток записи их зафиксирует
+def _record_check(watch: Watch, result: dict) -> None:
+    outcome = result['outcome']
+    watch.counts[outcome] += 1
+    if outcome == CHECK_ERROR:
+        logging.warning(f"Не удалось проверить объявление {result['url']}: {result['error']}")
+    status = None if outcome == CHECK_ERROR else LISTING_REMOVED if outcome == CHECK_REMOVED else LISTING_ACTIVE
+
+    def count_changes(future):
+        if report_listing_changes(result['url'], future):
+            watch.changed += 1
+
+    saved = save_listing(result['url'], result['fields'], status, result['etag'], result['last_modified'],
+                         result['content_hash'])
+    saved.add_done_callback(count_changes)
+
+# Функция для одного прохода: проверяются все действующие объявления, не проверявшиеся с checked_before.
+# Возвращает число проверенных объявлений.
+def _run_watch_pass(watch: Watch, checked_before: str) -> int:
+    checked = 0
+    added = history.run(sync_listings).result()
+    if added:
+        logging.info(f'В наблюдение добавлено объявлений из истории: {added}')
+    with ThreadPoolExecutor(max_workers=max(1, watch.workers)) as executor:
+        while not watch.cancel_event.is_set():
+            # Выборка идёт через поток записи: результаты предыдущей пачки к этому моменту уже записаны
+            candidates = history.run(partial(fetch_watch_candidates, checked_before=checked_before,
+                                             limit=watch.batch_size)).result()
+            if not candidates:
+                break
+            futures = [executor.submit(check_listing, *candidate) for candidate in candidates]
+            for future in as_completed(futures):
+                # При остановке не начатые проверки отменяются, а начатые дожидаются закрытия пула
+                if watch.cancel_event.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                _record_check(watch, future.result())
+                checked += 1
+            _watch_status(watch, f'Проверено объявлений: {checked}')
+    return checked
+
+# Функция наблюдения (выполняется в отдельном потоке): проходы повторяются, пока наблюдение не остановят
+def _run_watch(watch: Watch) -> None:
+    force = watch.force
+    try:
+        while not watch.cancel_event.is_set():
+            started = time.monotonic()
+            counts_before, changed_before = dict(watch.counts), watch.changed
+            cutoff = datetime.now() - timedelta(seconds=0 if force else watch.interval)
+            force = False
+            checked = _run_watch_pass(watch, cutoff.strftime('%Y-%m-%d %H:%M:%S'))
+            if checked:
+                # Изменения считаются после записи всех результатов прохода
+                history.flush()
+                watch.passes += 1
+                counts = {outcome: watch.counts[outcome] - counts_before[outcome] for outcome in watch.counts}
+                message = (f'Проверено {checked} объявлений за {time.monotonic() - started:.0f} с: '
+                           f'без изменений (304) {counts[CHECK_NOT_MODIFIED]}, '
+                           f'страница не изменилась {counts[CHECK_UNCHANGED]}, '
+                           f'изменились {watch.changed - changed_before}, сняты {counts[CHECK_REMOVED]}, '
+                           f'ошибок {counts[CHECK_ERROR]}')
+                logging.info(f'Наблюдение {watch.id}: {message}')
+                _watch_status(watch, message)
+            if watch.once:
+                break
+            watch.cancel_event.wait(min(watch.interval, WATCH_POLL))
+    except Exception as e:
+        logging.error(f'Наблюдение за объявлениями завершилось с ошибкой: {e}')
+        _watch_status(watch, f'Ошибка наблюдения: {e}')
+    finally:
+        watch.finished.set()
+        logging.info(f'Наблюдение {watch.id} завершено: проходов {watch.passes}, проверено {watch.checked}, '
+                     f'изменились {watch.changed}')
+        _watch_status(watch)
+
+_watch_ids = itertools.count(1)
+
+# Функция для запуска наблюдения за объявлениями из истории в фоне. once — один проход по объявлениям,
+# которым подошёл срок; force — первый проход проверяет все объявления независимо от срока.
+def start_watch(interval: float = WATCH_INTERVAL, workers: int = WATCH_WORKERS, once: bool = False,
+                force: bool = False) -> Watch:
+    watch = Watch(next(_watch_ids), interval, workers, once, force)
+    threading.Thread(target=_run_watch, args=(watch,), daemon=True).start()
+    logging.info(f'Запущено наблюдение за объявлениями {watch.id}: раз в {interval / 60:.0f} мин, '
+                 f'одновременно {workers}')
+    return watch
+
+# Упреждающая загрузка: сколько первых фото галереи прогревается в хранилище и сколько секунд
+# результат считается актуальным
+PREFETCH_IMAGES = 4
+PREFETCH_MAX_AGE = 10 * 60
+
+# Упреждающая загрузка объявления, ссылка на которое появилась в поле ввода: страница загружается
+# и разбирается в фоне, первые фото галереи скачиваются в хранилище. Задание по той же ссылке берёт
+# готовый (или ещё выполняющийся) результат вместо повторной загрузки.
+class Prefetch:
+    def __init__(self, prefetch_id: int, url: str):
+        self.id = prefetch_id
+        self.url = url
+        self.started = time.monotonic()
+        # data: {'response', 'listing', 'gallery': (base_url, image_suffix) или None, 'indices'}
+        self.data: Optional[dict] = None
+        self.warmed = 0
+        self.cancel_event = threading.Event()
+        # page_ready — страница загружена и разобрана (или не удалось), finished — прогрев фото окончен
+        self.page_ready = threading.Event()
+        self.finished = threading.Event()
+
+    # Отмена: прогрев фото прекращается, результат больше не используется
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    @property
+    def stale(self) -> bool:
+        return self.cancel_event.is_set() or time.monotonic() - self.started > PREFETCH_MAX_AGE
+
+    # Результат загрузки страницы (ожидает его); None, если загрузка не удалась или отменена
+    def result(self, timeout: Optional[float] = None) -> Optional[dict]:
+        if not self.page_ready.wait(timeout) or self.cancel_event.is_set():
+            return None
+        return self.data
+
+    # Ожидание прогрева фото, чтобы задание взяло их из хранилища, а не скачивало параллельно
+    def wait_images(self, timeout: Optional[float] = None) -> bool:
+        return self.finished.wait(timeout)
+
+# Функция для прогрева одного фото в хранилище; возвращает True, если фото есть в хранилище
+def _warm_image(prefetch: Prefetch, writer: FileWriter, temp_dir: str, base_url: str, image_suffix: str,
+                count: int) -> bool:
+    if prefetch.cancel_event.is_set():
+        return False
+    image_url = f"{base_url}{count}{image_suffix}"
+    stored = photo_store.lookup(image_url)
+    if stored and stored['fresh']:
+        return True
+    file_path = os.path.join(temp_dir, f"{prefetch.id}_{count}{os.path.splitext(image_url)[1] or '.jpg'}")
+    try:
+        status_code, done, info = download_image(image_url, file_path, writer, store_headers(stored) if stored else None)
+        if status_code == 304 and stored:
+            photo_store.touch(stored, checked=True)
+            return True
+        if status_code != 200:
+            return False
+        photo_store.add(image_url, file_path, done.result(), info['etag'], info['last_modified'])
+        return True
+    except Exception as e:
+        logging.warning(f'Не удалось прогреть фото {image_url}: {e}')
+        return False
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+# Функция упреждающей загрузки (выполняется в отдельном потоке)
+def _run_prefetch(prefetch: Prefetch) -> None:
+    try:
+        try:
+            response = page_cache.fetch(session, prefetch.url, timeout=HTTP_TIMEOUT)
+            if response.status_code == 200 and not prefetch.cancel_event.is_set():
+                data = {'response': response, 'listing': extract_listing(response.text), 'gallery': None,
+                        'indices': None}
+                match = GALLERY_URL_PATTERN.match(data['listing']['image_url'] or '')
+                if match and not prefetch.cancel_event.is_set():
+                    data['gallery'] = (match.group(1), match.group(3))
+                    data['indices'] = discover_gallery(response.text, match.group(1), match.group(3))
+                prefetch.data = data
+            elif response.status_code != 200:
+                logging.info(f'Упреждающая загрузка {prefetch.url}: страница вернула статус {response.status_code}')
+        except Exception as e:
+            logging.warning(f'Упреждающая загрузка {prefetch.url} не удалась: {e}')
+        finally:
+            prefetch.page_ready.set()
+
+        data = prefetch.data
+        if data and data['indices'] and photo_store.enabled and not prefetch.cancel_event.is_set():
+            base_url, image_suffix = data['gallery']
+            indices = data['indices'][:PREFETCH_IMAGES]
+            temp_dir = os.path.join(photo_store.root, 'prefetch')
+            os.makedirs(temp_dir, exist_ok=True)
+            writer = FileWriter()
+            try:
+                with ThreadPoolExecutor(max_workers=len(indices)) as executor:
+                    prefetch.warmed = sum(executor.map(
+                        partial(_warm_image, prefetch, writer, temp_dir, base_url, image_suffix), indices))
+            finally:
+                writer.stop()
+        logging.info(f'Упреждающая загрузка {prefetch.url} завершена: прогрето фото {prefetch.warmed}')
+    except Exception as e:
+        logging.warning(f'Упреждающая загрузка {prefetch.url} завершилась с ошибкой: {e}')
+    finally:
+        prefetch.page_ready.set()
+        prefetch.finished.set()
+
+_prefetch_ids = itertools.count(1)
+# Упреждающие загрузки по нормализованной ссылке
+_prefetches: Dict[str, Prefetch] = {}
+_prefetch_lock = threading.Lock()
+
+# Функция для запуска упреждающей загрузки ссылки (уже идущая и актуальная загрузка переиспользуется)
+def start_prefetch(url: str) -> Prefetch:
+    key = normalize_url(url)
+    with _prefetch_lock:
+        prefetch = _prefetches.get(key)
+        if prefetch and not prefetch.stale:
+            return prefetch
+        prefetch = _prefetches[key] = Prefetch(next(_prefetch_ids), url.strip())
+    threading.Thread(target=_run_prefetch, args=(prefetch,), daemon=True).start()
+    logging.info(f'Запущена упреждающая загрузка {prefetch.id}: {prefetch.url}')
+    return prefetch
+
+# Функция для отмены упреждающей загрузки (например, когда ссылка в поле ввода сменилась)
+def cancel_prefetch(prefetch: Prefetch) -> None:
+    prefetch.cancel()
+    with _prefetch_lock:
+        key = normalize_url(prefetch.url)
+        if _prefetches.get(key) is prefetch:
+            del _prefetches[key]
+
+# Функция для получения актуальной упреждающей загрузки ссылки заданием; загрузка забирается из реестра
+def take_prefetch(url: str) -> Optional[Prefetch]:
+    with _prefetch_lock:
+        prefetch = _prefetches.pop(normalize_url(url), None)
+    if prefetch and not prefetch.stale:
+        return prefetch
+    return None
@@ -0,0 +1,157 @@
+"""Потоковая выгрузка истории парсинга и замеров запусков.
+
+Строки читаются курсором пакетами fetchmany и сразу пишутся в файл, поэтому
+память не зависит от размера таблицы. Форматы: CSV (разделитель «;», как у
+выгрузки замеров), JSON Lines и Parquet (колоночный, нужен pyarrow). Выгрузка
+идёт в отдельном соединении WAL и видит базу на момент начала чтения.
+"""
+import csv
+import importlib.util
+import json
+import logging
+import os
+import sqlite3
+from typing import Callable, List, Optional, Tuple
+
+# pyarrow подключается, только если установлен
+PYARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+# Строк в одном пакете чтения (и в одной группе строк Parquet)
+EXPORT_BATCH_SIZE = 5000
+
+# Форматы по расширению файла
+EXPORT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.parquet': 'parquet'}
+
+# Выгружаемые таблицы: столбец даты для фильтра и столбцы в порядке выгрузки
+EXPORT_TABLES = {
+    'history': ('time', ('id', 'time', 'client_number', 'url', 'description')),
+    'runs': ('started_at', None),
+}
+
+
+# Функция для определения формата по расширению файла
+def format_for_path(path: str) -> Optional[str]:
+    return EXPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+
+
+# Функция для столбцов таблицы и их объявленных типов SQLite
+def _table_columns(conn: sqlite3.Connection, table: str) -> List[Tuple[str, str]]:
+    return [(info[1], (info[2] or '').upper()) for info in conn.execute(f'PRAGMA table_info({table})')]
+
+
+# Функция для запроса выгрузки с фильтрами по клиенту и датам (ГГГГ-ММ-ДД, включительно)
+def _export_query(conn: sqlite3.Connection, table: str, client_number: str, date_from: str,
+                  date_to: str) -> Tuple[str, list, List[Tuple[str, str]]]:
+    date_column, columns = EXPORT_TABLES[table]
+    declared = dict(_table_columns(conn, table))
+    columns = [(name, declared[name]) for name in (columns or declared) if name in declared]
+    conditions = []
+    params = []
+    if client_number:
+        conditions.append('client_number = ?')
+        params.append(client_number)
+    if date_from:
+        conditions.append(f'{date_column} >= ?')
+        params.append(date_from)
+    if date_to:
+        conditions.append(f"{date_column} < date(?, '+1 day')")
+        params.append(date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    sql = f"SELECT {', '.join(name for name, _ in columns)} FROM {table} {where} ORDER BY id"
+    return sql, params, columns
+
+
+# Запись в CSV
+class _CsvSink:
+    def __init__(self, f, columns):
+        self.writer = csv.writer(f, delimiter=';')
+        self.writer.writerow([name for name, _ in columns])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+# Запись в JSON Lines: один объект на строку
+class _JsonLinesSink:
+    def __init__(self, f, columns):
+        self.f = f
+        self.names = [name for name, _ in columns]
+
+    def write(self, rows):
+        self.f.writelines(json.dumps(dict(zip(self.names, row)), ensure_ascii=False) + '\n' for row in rows)
+
+    def close(self):
+        pass
+
+
+# Запись в Parquet: каждый пакет — отдельная группа строк, схема берётся из типов столбцов SQLite
+class _ParquetSink:
+    def __init__(self, path, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        types = {'INTEGER': pa.int64(), 'REAL': pa.float64()}
+        self.pa = pa
+        self.schema = pa.schema([(name, types.get(declared, pa.string())) for name, declared in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, rows):
+        arrays = [self.pa.array([row[index] for row in rows], type=field.type)
+                  for index, field in enumerate(self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+# Функция для выгрузки таблицы в файл; формат по расширению, если не указан. Пишется во временный
+# файл, который заменяет целевой только после успешной выгрузки. Возвращает число строк.
+# progress(rows) вызывается после каждого пакета.
+def export_table(db_path: str, path: str, table: str = 'history', export_format: Optional[str] = None,
+                 client_number: str = '', date_from: str = '', date_to: str = '',
+                 batch_size: int = EXPORT_BATCH_SIZE,
+                 progress: Optional[Callable[[int], None]] = None) -> int:
+    if table not in EXPORT_TABLES:
+        raise ValueError(f'Неизвестная таблица: {table}')
+    export_format = export_format or format_for_path(path)
+    if export_format not in EXPORT_FORMATS.values():
+        raise ValueError(f'Неизвестный формат выгрузки: {path}')
+    if export_format == 'parquet' and not PYARROW_AVAILABLE:
+        raise RuntimeError('Для выгрузки в Parquet нужен pyarrow (pip install pyarrow)')
+
+    conn = sqlite3.connect(db_path)
+    part_path = path + '.part'
+    rows_written = 0
+    try:
+        sql, params, columns = _export_query(conn, table, client_number, date_from, date_to)
+        cursor = conn.execute(sql, params)
+        if export_format == 'parquet':
+            f = None
+            sink = _ParquetSink(part_path, columns)
+        else:
+            f = open(part_path, 'w', encoding='utf-8-sig' if export_format == 'csv' else 'utf-8', newline='')
+            sink = _CsvSink(f, columns) if export_format == 'csv' else _JsonLinesSink(f, columns)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                sink.write(rows)
+                rows_written += len(rows)
+                if progress:
+                    progress(rows_written)
+        finally:
+            sink.close()
+            if f is not None:
+                f.close()
+        os.replace(part_path, path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    finally:
+        conn.close()
+    logging.info(f'Таблица {table} выгружена в {path} ({export_format}): {rows_written} строк')
+    return rows_written
@@ -1,114 +1,34 @@
-import sys
 import logging
+import multiprocessing
 import os
-import sqlite3  # Импорт sqlite3 для работы с базой данных
-import threading  # Для многопоточности
 import queue  # Для очереди сообщений между потоками
+import sys
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 from tkinter import ttk  # Для прогресс-бара
-from datetime import datetime
-import requests
-from bs4 import BeautifulSoup
-import re
-import shutil
 import pyperclip
 import webbrowser  # Для открытия ссылок в браузере
-
-# Определение пути к директории с приложением
-if getattr(sys, 'frozen', False):
-    # Если программа упакована с помощью PyInstaller
-    application_path = os.path.dirname(sys.executable)
-else:
-    # Если программа запущена из исходного кода
-    application_path = os.path.dirname(os.path.abspath(__file__))
+from datetime import datetime
+from parser_engine import (
+    DOWNLOAD_WORKERS, MAX_IMAGES, WATCH_INTERVAL, WATCH_WORKERS, application_path, cancel_prefetch, close_connection,
+    describe_change, export_data, export_run_metrics, get_connection, host_limits_report, is_valid_url,
+    parse_job_lines, photo_store, run_summary_report, scheduler, setup_logging, start_crawl, start_prefetch,
+    start_watch, update_queue,
+)
+from parser_db import fetch_history_page, fetch_history_since, fetch_listing_changes, search_history
+import parser_images
+
+# В собранном exe дочерние процессы пула обработки фото запускаются через этот же файл
+multiprocessing.freeze_support()
+
+# При запуске из исходников без fork дочерний процесс заново импортировал бы этот модуль
+# и создал бы окно, поэтому фото обрабатываются в потоках
+if not getattr(sys, 'frozen', False) and multiprocessing.get_start_method() != 'fork':
+    parser_images.set_use_processes(False)
 
 # Настройка логирования
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-
-# Создание обработчика для записи в файл с нужной кодировкой
-log_file = os.path.join(application_path, 'parser_log.txt')
-handler = logging.FileHandler(log_file, encoding='utf-8')
-handler.setLevel(logging.DEBUG)
-
-# Создание формата логирования
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-
-# Добавление обработчика к логгеру
-logger.addHandler(handler)
-
-# Функция для инициализации базы данных
-def init_db():
-    db_path = os.path.join(application_path, 'parsing_history.db')
-    # Установите check_same_thread=False, чтобы разрешить доступ из нескольких потоков
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    cursor = conn.cursor()
-    # Проверка существования столбца 'description'
-    cursor.execute("PRAGMA table_info(history);")
-    columns = [info[1] for info in cursor.fetchall()]
-    if 'description' not in columns:
-        cursor.execute("ALTER TABLE history ADD COLUMN description TEXT;")
-        conn.commit()
-        logging.info("Добавлен столбец 'description' в таблицу 'history'.")
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            time TEXT NOT NULL,
-            client_number TEXT NOT NULL,
-            url TEXT NOT NULL,
-            description TEXT
-        )
-    ''')
-    conn.commit()
-    return conn
-
-# Инициализация базы данных
-conn = init_db()
-
-# Создание очереди для сообщений между потоками
-update_queue = queue.Queue()
-
-# Валидация URL
-def is_valid_url(url):
-    regex = re.compile(
-        r'^(?:http|ftp)s?://'  # протокол
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # доменное имя
-        r'localhost|'  # localhost
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # IP-адрес
-        r'(?::\d+)?'  # порт
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-    return re.match(regex, url) is not None
-
-# Функция для очистки папки
-def clear_folder(folder_path):
-    if os.path.exists(folder_path):
-        for file in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, file)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                logging.error(f'Не удалось удалить {file_path}. Причина: {e}')
-        logging.info(f'Папка {folder_path} успешно очищена.')
-    else:
-        logging.warning(f'Папка {folder_path} не найдена.')
-
-# Функция для сохранения истории в базу данных
-def save_history(client_number, url, time, description):
-    try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO history (time, client_number, url, description)
-            VALUES (?, ?, ?, ?)
-        ''', (time, client_number, url, description))
-        conn.commit()
-        logging.info(f'История сохранена: Клиент {client_number}, Ссылка {url}, Описание {description}')
-    except Exception as e:
-        logging.error(f'Не удалось сохранить историю: {e}')
+setup_logging()
 
 # Создание главного окна
 root = tk.Tk()
@@ -141,10 +61,22 @@ notebook.pack(pady=10, padx=10, fill='both', expand=True)
 main_tab = ttk.Frame(notebook)
 notebook.add(main_tab, text='Основная')
 
+# Вкладка "Пакет"
+batch_tab = ttk.Frame(notebook)
+notebook.add(batch_tab, text='Пакет')
+
 # Вкладка "Отчёты"
 reports_tab = ttk.Frame(notebook)
 notebook.add(reports_tab, text='Отчёты')
 
+# Вкладка "Метрики"
+metrics_tab = ttk.Frame(notebook)
+notebook.add(metrics_tab, text='Метрики')
+
+# Вкладка "Наблюдение"
+watch_tab = ttk.Frame(notebook)
+notebook.add(watch_tab, text='Наблюдение')
+
 # Вкладка "Логи"
 logs_tab = ttk.Frame(notebook)
 notebook.add(logs_tab, text='Логи')
@@ -165,6 +97,38 @@ tk.Label(url_frame, text="Ссылка для парсинга:", font=('Arial',
 entry_url = tk.Entry(url_frame, width=60, font=('Arial', 12))
 entry_url.pack(side=tk.LEFT, padx=5)
 
+# Задержка упреждающей загрузки после ввода в поле ссылки, мс
+PREFETCH_DELAY = 400
+
+# Упреждающая загрузка ссылки из поля ввода и отложенный запуск следующей
+current_prefetch = None
+prefetch_after_id = None
+
+# Функция для упреждающей загрузки ссылки из поля ввода: как только в поле корректная ссылка,
+# страница и первые фото загружаются в фоне; загрузка прежней ссылки отменяется
+def prefetch_url():
+    global current_prefetch, prefetch_after_id
+    prefetch_after_id = None
+    url = entry_url.get().strip()
+    if current_prefetch is not None:
+        if current_prefetch.url == url and not current_prefetch.stale:
+            return
+        cancel_prefetch(current_prefetch)
+        current_prefetch = None
+    if url and is_valid_url(url):
+        current_prefetch = start_prefetch(url)
+
+# Функция для отложенного запуска упреждающей загрузки (ссылка не загружается на каждое нажатие клавиши)
+def schedule_prefetch(event=None):
+    global prefetch_after_id
+    if prefetch_after_id is not None:
+        root.after_cancel(prefetch_after_id)
+    prefetch_after_id = root.after(PREFETCH_DELAY, prefetch_url)
+
+entry_url.bind('<KeyRelease>', schedule_prefetch)
+entry_url.bind('<<Paste>>', schedule_prefetch)
+entry_url.bind('<<Cut>>', schedule_prefetch)
+
 # Кнопка "Вставить" для вставки URL из буфера обмена
 def paste_url():
     try:
@@ -172,6 +136,7 @@ def paste_url():
         entry_url.delete(0, tk.END)  # Очистка текущего содержимого
         entry_url.insert(0, clipboard_content)  # Вставка содержимого буфера обмена
         logging.info("URL вставлен из буфера обмена.")
+        prefetch_url()
     except Exception as e:
         messagebox.showerror("Ошибка", f"Не удалось вставить URL: {e}")
         logging.error(f"Не удалось вставить URL из буфера обмена: {e}")
@@ -220,6 +185,30 @@ def open_folder():
 
 tk.Button(folder_frame, text="Открыть папку с фото", command=open_folder, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)  # Новая кнопка
 
+# Фрейм для выбора количества одновременных загрузок
+workers_frame = tk.Frame(main_tab)
+workers_frame.pack(pady=10, padx=10, anchor='w')
+
+tk.Label(workers_frame, text="Потоков загрузки:", font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+workers_var = tk.IntVar(value=DOWNLOAD_WORKERS)
+tk.Spinbox(workers_frame, from_=1, to=32, textvariable=workers_var, width=5, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+
+# Флажок режима синхронизации папки вместо полной очистки
+sync_var = tk.BooleanVar(value=False)
+tk.Checkbutton(workers_frame, text="Синхронизировать папку (докачать только новые фото)", variable=sync_var, font=('Arial', 12)).pack(side=tk.LEFT, padx=15)
+
+# Флажок обработки фото после загрузки
+postprocess_var = tk.BooleanVar(value=False)
+tk.Checkbutton(workers_frame, text="Миниатюры и поиск дубликатов", variable=postprocess_var, font=('Arial', 12)).pack(side=tk.LEFT, padx=15)
+
+# Флажок общего хранилища фото: уже скачанные фото попадают в папку ссылкой, без повторной загрузки
+photo_store_var = tk.BooleanVar(value=photo_store.enabled)
+
+def toggle_photo_store():
+    photo_store.enabled = photo_store_var.get()
+
+tk.Checkbutton(workers_frame, text="Общее хранилище фото", variable=photo_store_var, command=toggle_photo_store, font=('Arial', 12)).pack(side=tk.LEFT, padx=15)
+
 # Прогресс-бар и метка прогресса
 progress_frame = tk.Frame(main_tab)
 progress_frame.pack(pady=5, padx=10, anchor='w')
@@ -227,20 +216,181 @@ progress_frame.pack(pady=5, padx=10, anchor='w')
 progress_bar = ttk.Progressbar(progress_frame, orient='horizontal', length=400, mode='determinate')
 progress_bar.pack(side=tk.LEFT, padx=5)
 
-progress_label = tk.Label(progress_frame, text="Скачано 0 из 200 изображений.", font=('Arial', 12))
+progress_label = tk.Label(progress_frame, text="Скачано 0 изображений.", font=('Arial', 12))
 progress_label.pack(side=tk.LEFT, padx=10)
 
+# Номер задания, запущенного с вкладки "Основная" (его прогресс отображается на этой вкладке)
+main_job_id = None
+
+# Функция для чтения количества потоков загрузки из поля ввода
+def get_workers():
+    try:
+        return max(1, workers_var.get())
+    except tk.TclError:
+        return DOWNLOAD_WORKERS
+
 # Кнопка запуска парсинга
 def start_parse():
-    parse_thread = threading.Thread(target=parse, daemon=True)
-    parse_thread.start()
+    global main_job_id, current_prefetch, prefetch_after_id
+    url = entry_url.get()
+    client_number = entry_client.get()
+    save_path = entry_folder.get()
+    # Удаляем описание из начальной проверки
+    if not url or not client_number or not save_path:
+        messagebox.showwarning("Предупреждение", "Пожалуйста, заполните все поля.")
+        logging.warning("Пользователь не заполнил все поля.")
+        return
+
+    # Валидация URL
+    if not is_valid_url(url):
+        messagebox.showerror("Ошибка", "Введённый URL некорректен.")
+        logging.error(f"Некорректный URL: {url}")
+        return
+
+    # Задание берёт упреждающую загрузку этой ссылки себе; загрузка другой ссылки больше не нужна,
+    # а отложенный запуск не должен начать вторую загрузку уже после старта задания
+    if prefetch_after_id is not None:
+        root.after_cancel(prefetch_after_id)
+        prefetch_after_id = None
+    if current_prefetch is not None and current_prefetch.url != url.strip():
+        cancel_prefetch(current_prefetch)
+    current_prefetch = None
+    job = scheduler.submit(url, client_number, save_path, get_workers(), sync_var.get(), postprocess_var.get())
+    main_job_id = job.id
+    progress_bar['value'] = 0
+    progress_label.config(text="Поиск фото...")
 
 tk.Button(main_tab, text="Начать парсинг", command=start_parse, bg="green", fg="white", font=('Arial', 12, 'bold')).pack(pady=10)
 
+# ----- Вкладка "Пакет" -----
+batch_label = tk.Label(batch_tab, text="Задания (по одному в строке: ссылка;номер клиента;папка):", font=('Arial', 12, 'bold'))
+batch_label.pack(pady=5, padx=10, anchor='w')
+
+batch_text = scrolledtext.ScrolledText(batch_tab, width=105, height=8, font=('Arial', 10))
+batch_text.pack(pady=5, padx=10)
+
+batch_buttons_frame = tk.Frame(batch_tab)
+batch_buttons_frame.pack(pady=5, padx=10, anchor='w')
+
+# Функция для загрузки списка заданий из файла
+def load_jobs_file():
+    file_selected = filedialog.askopenfilename(filetypes=[("Текстовые файлы", "*.txt *.csv"), ("Все файлы", "*.*")])
+    if file_selected:
+        try:
+            with open(file_selected, 'r', encoding='utf-8') as f:
+                batch_text.delete(1.0, tk.END)
+                batch_text.insert(tk.END, f.read())
+            logging.info(f'Список заданий загружен из файла: {file_selected}')
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось прочитать файл: {e}")
+            logging.error(f"Не удалось прочитать файл заданий {file_selected}: {e}")
+
+# Функция для постановки заданий из списка в очередь
+def start_batch():
+    # Если папка в строке не указана, используется папка с вкладки "Основная"
+    jobs = parse_job_lines(batch_text.get(1.0, tk.END), entry_folder.get())
+    if not jobs:
+        messagebox.showwarning("Предупреждение", "В списке нет корректных заданий.")
+        logging.warning("Список заданий пуст или некорректен.")
+        return
+    workers = get_workers()
+    sync = sync_var.get()
+    postprocess = postprocess_var.get()
+    for url, client_number, save_path in jobs:
+        scheduler.submit(url, client_number, save_path, workers, sync, postprocess)
+    logging.info(f'Поставлено в очередь заданий: {len(jobs)}')
+
+tk.Button(batch_buttons_frame, text="Загрузить из файла", command=load_jobs_file, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+tk.Button(batch_buttons_frame, text="Запустить пакет", command=start_batch, bg="green", fg="white", font=('Arial', 12, 'bold')).pack(side=tk.LEFT, padx=5)
+
+# Таблица заданий с их статусом и прогрессом
+jobs_tree = ttk.Treeview(batch_tab, columns=('client', 'url', 'status', 'progress'), height=12)
+jobs_tree.heading('#0', text='№')
+jobs_tree.heading('client', text='Клиент')
+jobs_tree.heading('url', text='Ссылка')
+jobs_tree.heading('status', text='Статус')
+jobs_tree.heading('progress', text='Фото')
+jobs_tree.column('#0', width=50)
+jobs_tree.column('client', width=120)
+jobs_tree.column('url', width=450)
+jobs_tree.column('status', width=110)
+jobs_tree.column('progress', width=100)
+jobs_tree.pack(pady=5, padx=10, fill='x')
+
+# Функция для отмены выбранных заданий
+def cancel_selected_jobs():
+    for item in jobs_tree.selection():
+        scheduler.cancel(int(item))
+
+tk.Button(batch_tab, text="Отменить выбранные", command=cancel_selected_jobs, font=('Arial', 12)).pack(pady=5, padx=10, anchor='w')
+
+# Обход выдачи поиска: найденные объявления попадают в таблицу заданий по мере обхода
+crawl_label = tk.Label(batch_tab, text="Обход выдачи поиска (ссылка на страницу выдачи):", font=('Arial', 12, 'bold'))
+crawl_label.pack(pady=5, padx=10, anchor='w')
+
+entry_search_url = tk.Entry(batch_tab, width=80, font=('Arial', 12))
+entry_search_url.pack(pady=5, padx=10, anchor='w')
+
+crawl_options_frame = tk.Frame(batch_tab)
+crawl_options_frame.pack(pady=5, padx=10, anchor='w')
+skip_parsed_var = tk.BooleanVar(value=True)
+tk.Checkbutton(crawl_options_frame, text="Пропускать уже спарсенные", variable=skip_parsed_var, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+
+current_crawl = None
+
+# Функция для запуска обхода; номер клиента и папка берутся с вкладки "Основная",
+# каждое объявление сохраняется в подпапку с его номером
+def start_crawl_search():
+    global current_crawl
+    search_url = entry_search_url.get().strip()
+    client_number = entry_client.get()
+    folder = entry_folder.get()
+    if not search_url or not client_number or not folder:
+        messagebox.showwarning("Предупреждение", "Укажите ссылку на выдачу, номер клиента и папку на вкладке \"Основная\".")
+        logging.warning("Для обхода выдачи не заполнены поля.")
+        return
+    if not is_valid_url(search_url):
+        messagebox.showerror("Ошибка", "Введённый URL некорректен.")
+        logging.error(f"Некорректный URL выдачи: {search_url}")
+        return
+    if current_crawl is not None and not current_crawl.finished.is_set():
+        messagebox.showwarning("Предупреждение", "Обход выдачи уже выполняется.")
+        return
+    current_crawl = start_crawl(search_url, client_number, folder, get_workers(), sync_var.get(),
+                                postprocess_var.get(), skip_parsed_var.get())
+    crawl_status_label.config(text="Обход запущен...")
+
+# Функция для остановки обхода и его заданий
+def stop_crawl_search():
+    if current_crawl is not None:
+        current_crawl.cancel()
+
+tk.Button(crawl_options_frame, text="Обойти выдачу", command=start_crawl_search, bg="green", fg="white", font=('Arial', 12, 'bold')).pack(side=tk.LEFT, padx=5)
+tk.Button(crawl_options_frame, text="Остановить обход", command=stop_crawl_search, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+
+crawl_status_label = tk.Label(batch_tab, text="", font=('Arial', 10))
+crawl_status_label.pack(pady=5, padx=10, anchor='w')
+
 # ----- Вкладка "Отчёты" -----
 reports_label = tk.Label(reports_tab, text="Отчёты:", font=('Arial', 12, 'bold'))
 reports_label.pack(pady=5, padx=10, anchor='w')
 
+# Поиск по истории: слова описания или ссылки, клиент и даты (ГГГГ-ММ-ДД)
+search_frame = tk.Frame(reports_tab)
+search_frame.pack(pady=5, padx=10, anchor='w')
+tk.Label(search_frame, text="Поиск:", font=('Arial', 12)).pack(side=tk.LEFT)
+entry_search_text = tk.Entry(search_frame, width=30, font=('Arial', 12))
+entry_search_text.pack(side=tk.LEFT, padx=5)
+tk.Label(search_frame, text="Клиент:", font=('Arial', 12)).pack(side=tk.LEFT)
+entry_search_client = tk.Entry(search_frame, width=10, font=('Arial', 12))
+entry_search_client.pack(side=tk.LEFT, padx=5)
+tk.Label(search_frame, text="С:", font=('Arial', 12)).pack(side=tk.LEFT)
+entry_search_from = tk.Entry(search_frame, width=11, font=('Arial', 12))
+entry_search_from.pack(side=tk.LEFT, padx=5)
+tk.Label(search_frame, text="По:", font=('Arial', 12)).pack(side=tk.LEFT)
+entry_search_to = tk.Entry(search_frame, width=11, font=('Arial', 12))
+entry_search_to.pack(side=tk.LEFT, padx=5)
+
 reports_text = scrolledtext.ScrolledText(reports_tab, width=105, height=25, font=('Arial', 10))
 reports_text.pack(pady=5, padx=10)
 
@@ -256,11 +406,10 @@ reports_text.bind("<Key>", disable_event)
 def open_url(event):
     # Получаем позицию щелчка мыши
     index = reports_text.index(f"@{event.x},{event.y}")
-    # Проверяем, есть ли тег "url" в этой позиции
-    if "url" in reports_text.tag_names(index):
-        # Извлекаем полный URL
-        url = reports_text.get(f"{index} wordstart", f"{index} wordend")
-        webbrowser.open(url)
+    # Диапазон тега "url", в который попал щелчок
+    url_range = reports_text.tag_prevrange("url", f"{index}+1c")
+    if url_range:
+        webbrowser.open(reports_text.get(*url_range))
 
 # Настройка тега для ссылок
 reports_text.tag_configure("url", foreground="blue", underline=1)
@@ -286,55 +435,337 @@ def copy_link_to_clipboard(link):
         messagebox.showerror("Ошибка", f"Не удалось скопировать ссылку: {e}")
         logging.error(f"Не удалось скопировать ссылку: {e}")
 
-# Функция для обновления отчётов из базы данных
+# Количество записей на одной странице отчётов
+REPORTS_PAGE_SIZE = 200
+
+# Состояние отображаемой страницы отчётов
+reports_view = {
+    'page_starts': [None],  # верхние границы id просмотренных страниц (None — самая новая)
+    'next_start': None,  # граница следующей (более старой) страницы
+    'last_id': 0,  # последний показанный id на первой странице
+    'top_group': None,  # (дата, клиент) первой группы первой страницы
+    'search': None,  # условия поиска (None — показывается вся история)
+}
+
+# Функция для копирования ссылки из строки, по которой щёлкнули (один общий тег для всех строк)
+def copy_report_link(event):
+    index = reports_text.index(f"@{event.x},{event.y}")
+    url_range = reports_text.tag_prevrange("url", index)
+    if url_range:
+        copy_link_to_clipboard(reports_text.get(*url_range))
+
+reports_text.tag_configure("copy", foreground="green", underline=1)
+reports_text.tag_bind("copy", "<Button-1>", copy_report_link)
+
+# Функция для вставки одной записи отчёта в позицию index
+def insert_report_entry(index, time_only, url, description):
+    description = description if description else "Описание отсутствует"
+    # Вставка времени
+    reports_text.insert(index, f"{time_only} ")
+    # Вставка ссылки с тегом
+    reports_text.insert(index, url, "url")
+    # Вставка текста для копирования
+    reports_text.insert(index, " [Скопировать]", "copy")
+    # Добавление разделителя и описания
+    reports_text.insert(index, f", Описание квартиры: {description}\n\n")
+
+# Функция для отрисовки текущей страницы отчётов
+def render_reports_page():
+    page_starts = reports_view['page_starts']
+    search = reports_view['search']
+    if search:
+        rows = search_history(get_connection(), before_id=page_starts[-1], limit=REPORTS_PAGE_SIZE, **search)
+    else:
+        rows = fetch_history_page(get_connection(), page_starts[-1], REPORTS_PAGE_SIZE)
+
+    reports_text.delete(1.0, tk.END)
+    if search and not rows:
+        reports_text.insert(tk.END, "Ничего не найдено.\n")
+    if len(page_starts) == 1:
+        reports_view['top_group'] = None
+    current_date = current_client = None
+    for row_id, date, time_only, client, url, description in rows:
+        if date != current_date:
+            if current_date is not None:
+                reports_text.insert(tk.END, "\n")
+            reports_text.insert(tk.END, f"{date}\n\n")
+            current_date, current_client = date, None
+        if client != current_client:
+            reports_text.insert(tk.END, f"{client}\n")
+            if len(page_starts) == 1 and reports_view['top_group'] is None:
+                # Сюда вставляются новые записи первой группы без перерисовки страницы
+                reports_view['top_group'] = (date, client)
+                reports_text.mark_set("report_top", tk.END + "-1c")
+                reports_text.mark_gravity("report_top", tk.LEFT)
+            current_client = client
+        insert_report_entry(tk.END, time_only, url, description)
+
+    if len(page_starts) == 1:
+        reports_view['last_id'] = max((row[0] for row in rows), default=0)
+    full_page = len(rows) == REPORTS_PAGE_SIZE
+    reports_view['next_start'] = min(row[0] for row in rows) - 1 if full_page else None
+    reports_page_label.config(text=f"Страница {len(page_starts)}")
+    newer_button.config(state=tk.NORMAL if len(page_starts) > 1 else tk.DISABLED)
+    older_button.config(state=tk.NORMAL if full_page else tk.DISABLED)
+
+# Функция для обновления отчётов из базы данных: запрашиваются только записи новее последней показанной
 def update_reports():
     try:
-        cursor = conn.cursor()
-        cursor.execute('SELECT time, client_number, url, description FROM history ORDER BY id DESC')
-        rows = cursor.fetchall()
-
-        # Группировка по дате и клиенту
-        reports = {}
-        for row in rows:
-            time_str, client_number, url, description = row
-            date_str = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d')
-            time_only = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S').strftime('%H:%M')
-            if date_str not in reports:
-                reports[date_str] = {}
-            if client_number not in reports[date_str]:
-                reports[date_str][client_number] = []
-            reports[date_str][client_number].append({'time': time_only, 'url': url, 'description': description})
-
-        # Очистка и обновление поля отчётов
-        reports_text.delete(1.0, tk.END)
-        for date, clients in reports.items():
-            reports_text.insert(tk.END, f"{date}\n\n")
-            for client, entries in clients.items():
-                reports_text.insert(tk.END, f"{client}\n")
-                for entry in entries:
-                    time = entry['time']
-                    url = entry['url']
-                    description = entry['description'] if entry['description'] else "Описание отсутствует"
-                    # Вставка времени
-                    reports_text.insert(tk.END, f"{time} ")
-                    # Вставка ссылки с тегом
-                    reports_text.insert(tk.END, url, "url")
-                    # Вставка текста для копирования
-                    copy_tag = f"copy_{time}_{client}"
-                    reports_text.insert(tk.END, " [Скопировать]", copy_tag)
-                    reports_text.tag_configure(copy_tag, foreground="green", underline=1)
-                    # Используем lambda с аргументом по умолчанию для захвата текущего URL
-                    reports_text.tag_bind(copy_tag, "<Button-1>", lambda e, link=url: copy_link_to_clipboard(link))
-                    # Добавление разделителя и описания
-                    reports_text.insert(tk.END, f", Описание квартиры: {description}\n\n")
-            reports_text.insert(tk.END, "\n")
+        if len(reports_view['page_starts']) > 1 or reports_view['search']:
+            # На старых страницах и в результатах поиска новые записи не дописываются, перерисовка не нужна
+            return
+        if not reports_view['last_id']:
+            # Первая отрисовка (или история пуста)
+            render_reports_page()
+            logging.info("Отчёты обновлены.")
+            return
+        new_rows = fetch_history_since(get_connection(), reports_view['last_id'], REPORTS_PAGE_SIZE)
+        if not new_rows:
+            return
+        top_group = reports_view['top_group']
+        if len(new_rows) < REPORTS_PAGE_SIZE and top_group and all((row[1], row[3]) == top_group for row in new_rows):
+            # Новые записи того же дня и клиента дописываются в начало первой группы
+            for row_id, date, time_only, client, url, description in new_rows:
+                reports_text.mark_set("report_insert", "report_top")
+                insert_report_entry("report_insert", time_only, url, description)
+            reports_view['last_id'] = new_rows[-1][0]
+        else:
+            render_reports_page()
         logging.info("Отчёты обновлены.")
     except Exception as e:
         logging.error(f"Не удалось обновить отчёты: {e}")
 
+# Функции для перехода между страницами отчётов
+def show_older_reports():
+    if reports_view['next_start'] is not None:
+        reports_view['page_starts'].append(reports_view['next_start'])
+        render_reports_page()
+
+def show_newer_reports():
+    if len(reports_view['page_starts']) > 1:
+        reports_view['page_starts'].pop()
+        render_reports_page()
+
+# Функция для проверки дат строки поиска: фильтр сравнивает строки, поэтому дата в другом виде
+# дала бы пустой или неверный результат без всякой ошибки
+def check_search_dates(*dates: str) -> bool:
+    for date in dates:
+        if not date:
+            continue
+        try:
+            datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            messagebox.showerror("Ошибка", f"Некорректная дата: {date}. Даты указываются в виде ГГГГ-ММ-ДД.")
+            logging.error(f"Некорректная дата в строке поиска: {date}")
+            return False
+    return True
+
+# Функция для поиска по истории; результаты листаются теми же кнопками, что и отчёт
+def search_reports():
+    search = {
+        'text': entry_search_text.get().strip(),
+        'client_number': entry_search_client.get().strip(),
+        'date_from': entry_search_from.get().strip(),
+        'date_to': entry_search_to.get().strip(),
+    }
+    if not check_search_dates(search['date_from'], search['date_to']):
+        return
+    reports_view['search'] = search if any(search.values()) else None
+    reports_view['page_starts'] = [None]
+    reports_view['last_id'] = 0
+    try:
+        render_reports_page()
+    except Exception as e:
+        messagebox.showerror("Ошибка", f"Не удалось выполнить поиск: {e}")
+        logging.error(f"Не удалось выполнить поиск по истории: {e}")
+
+# Функция для сброса поиска и возврата к полной истории
+def reset_search():
+    for entry in (entry_search_text, entry_search_client, entry_search_from, entry_search_to):
+        entry.delete(0, tk.END)
+    search_reports()
+
+tk.Button(search_frame, text="Найти", command=search_reports, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+tk.Button(search_frame, text="Сбросить", command=reset_search, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+entry_search_text.bind("<Return>", lambda event: search_reports())
+
+reports_nav_frame = tk.Frame(reports_tab)
+reports_nav_frame.pack(pady=5, padx=10, anchor='w')
+
 # Создание кнопки "Обновить отчёты"
-update_reports_button = tk.Button(reports_tab, text="Обновить отчёты", command=update_reports, font=('Arial', 12))
-update_reports_button.pack(pady=5, padx=10, anchor='w')
+update_reports_button = tk.Button(reports_nav_frame, text="Обновить отчёты", command=update_reports, font=('Arial', 12))
+update_reports_button.pack(side=tk.LEFT, padx=5)
+newer_button = tk.Button(reports_nav_frame, text="← Новее", command=show_newer_reports, font=('Arial', 12), state=tk.DISABLED)
+newer_button.pack(side=tk.LEFT, padx=5)
+reports_page_label = tk.Label(reports_nav_frame, text="Страница 1", font=('Arial', 12))
+reports_page_label.pack(side=tk.LEFT, padx=5)
+older_button = tk.Button(reports_nav_frame, text="Старее →", command=show_older_reports, font=('Arial', 12), state=tk.DISABLED)
+older_button.pack(side=tk.LEFT, padx=5)
+
+# Функция для выгрузки истории в файл с фильтрами клиента и дат из строки поиска.
+# Выгрузка идёт в отдельном потоке, итог приходит через очередь сообщений.
+def export_history():
+    client_number = entry_search_client.get().strip()
+    date_from = entry_search_from.get().strip()
+    date_to = entry_search_to.get().strip()
+    if not check_search_dates(date_from, date_to):
+        return
+    file_selected = filedialog.asksaveasfilename(
+        defaultextension='.csv',
+        filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl"), ("Parquet", "*.parquet")])
+    if not file_selected:
+        return
+
+    def run_export():
+        try:
+            rows = export_data(file_selected, client_number=client_number, date_from=date_from, date_to=date_to)
+            update_queue.put({'type': 'export_complete', 'path': file_selected, 'rows': rows})
+        except Exception as e:
+            logging.error(f"Не удалось выгрузить историю в {file_selected}: {e}")
+            update_queue.put({'type': 'error', 'message': f"Не удалось выгрузить историю: {e}"})
+
+    threading.Thread(target=run_export, daemon=True).start()
+
+tk.Button(reports_nav_frame, text="Выгрузить историю", command=export_history, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+
+# ----- Вкладка "Метрики" -----
+METRICS_DAYS = 30  # За сколько последних дней показывается сводка замеров
+
+metrics_label = tk.Label(metrics_tab, text=f"Замеры запусков за {METRICS_DAYS} дн. (по дням):", font=('Arial', 12, 'bold'))
+metrics_label.pack(pady=5, padx=10, anchor='w')
+
+metrics_text = scrolledtext.ScrolledText(metrics_tab, width=105, height=18, font=('Arial', 10))
+metrics_text.pack(pady=5, padx=10)
+
+# Привязка событий для предотвращения редактирования
+metrics_text.bind("<Key>", disable_event)
+# Разрешаем выделение и контекстное меню
+metrics_text.bind("<Button-3>", show_context_menu)
+
+# Функция для обновления сводки замеров
+def update_metrics():
+    try:
+        report = run_summary_report(METRICS_DAYS)
+    except Exception as e:
+        messagebox.showerror("Ошибка", f"Не удалось загрузить замеры: {e}")
+        logging.error(f"Не удалось загрузить замеры: {e}")
+        return
+    metrics_text.delete(1.0, tk.END)
+    metrics_text.insert(tk.END, report + '\n')
+
+# Функция для выгрузки замеров в CSV
+def export_metrics():
+    file_selected = filedialog.asksaveasfilename(defaultextension='.csv', filetypes=[("CSV", "*.csv")])
+    if not file_selected:
+        return
+    try:
+        rows = export_run_metrics(file_selected, METRICS_DAYS)
+        messagebox.showinfo("Успех", f"Выгружено строк: {rows}")
+    except Exception as e:
+        messagebox.showerror("Ошибка", f"Не удалось выгрузить замеры: {e}")
+        logging.error(f"Не удалось выгрузить замеры: {e}")
+
+metrics_buttons_frame = tk.Frame(metrics_tab)
+metrics_buttons_frame.pack(pady=5, padx=10, anchor='w')
+tk.Button(metrics_buttons_frame, text="Обновить замеры", command=update_metrics, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+tk.Button(metrics_buttons_frame, text="Выгрузить в CSV", command=export_metrics, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+
+# Текущие ограничения запросов по хостам (обновляются раз в секунду)
+HOST_LIMITS_INTERVAL = 1000
+
+host_limits_label = tk.Label(metrics_tab, text="Ограничения запросов по хостам:", font=('Arial', 12, 'bold'))
+host_limits_label.pack(pady=5, padx=10, anchor='w')
+
+host_limits_value = tk.Label(metrics_tab, text="", font=('Arial', 10), justify=tk.LEFT, anchor='w')
+host_limits_value.pack(pady=5, padx=10, anchor='w')
+
+# Функция для обновления ограничений хостов
+def update_host_limits():
+    host_limits_value.config(text=host_limits_report())
+    root.after(HOST_LIMITS_INTERVAL, update_host_limits)
+
+# ----- Вкладка "Наблюдение" -----
+WATCH_CHANGES_LIMIT = 500  # Сколько последних изменений объявлений показывается
+
+watch_label = tk.Label(watch_tab, text="Наблюдение за объявлениями из истории (изменения цены и полей, снятые объявления):", font=('Arial', 12, 'bold'))
+watch_label.pack(pady=5, padx=10, anchor='w')
+
+watch_options_frame = tk.Frame(watch_tab)
+watch_options_frame.pack(pady=5, padx=10, anchor='w')
+tk.Label(watch_options_frame, text="Перепроверять раз в, мин:", font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+watch_interval_var = tk.IntVar(value=WATCH_INTERVAL // 60)
+tk.Spinbox(watch_options_frame, from_=1, to=7 * 24 * 60, textvariable=watch_interval_var, width=6, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+tk.Label(watch_options_frame, text="Одновременно:", font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+watch_workers_var = tk.IntVar(value=WATCH_WORKERS)
+tk.Spinbox(watch_options_frame, from_=1, to=32, textvariable=watch_workers_var, width=5, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+
+current_watch = None
+
+# Функция для запуска наблюдения; force — сразу проверить все объявления, не дожидаясь срока
+def start_watching(force=False):
+    global current_watch
+    if current_watch is not None and not current_watch.finished.is_set():
+        messagebox.showwarning("Предупреждение", "Наблюдение уже запущено.")
+        return
+    try:
+        interval = max(1, watch_interval_var.get()) * 60
+        workers = max(1, watch_workers_var.get())
+    except tk.TclError:
+        interval, workers = WATCH_INTERVAL, WATCH_WORKERS
+    current_watch = start_watch(interval, workers, force=force)
+    watch_status_label.config(text="Наблюдение запущено...")
+
+# Функция для остановки наблюдения
+def stop_watching():
+    if current_watch is not None:
+        current_watch.cancel()
+
+watch_buttons_frame = tk.Frame(watch_tab)
+watch_buttons_frame.pack(pady=5, padx=10, anchor='w')
+tk.Button(watch_buttons_frame, text="Начать наблюдение", command=start_watching, bg="green", fg="white", font=('Arial', 12, 'bold')).pack(side=tk.LEFT, padx=5)
+tk.Button(watch_buttons_frame, text="Проверить все сейчас", command=lambda: start_watching(force=True), font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+tk.Button(watch_buttons_frame, text="Остановить наблюдение", command=stop_watching, font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+
+watch_status_label = tk.Label(watch_tab, text="", font=('Arial', 10))
+watch_status_label.pack(pady=5, padx=10, anchor='w')
+
+# Таблица изменений объявлений, новые сверху
+changes_tree = ttk.Treeview(watch_tab, columns=('time', 'clients', 'url', 'change'), show='headings', height=20)
+changes_tree.heading('time', text='Время')
+changes_tree.heading('clients', text='Клиенты')
+changes_tree.heading('url', text='Ссылка')
+changes_tree.heading('change', text='Изменение')
+changes_tree.column('time', width=140)
+changes_tree.column('clients', width=100)
+changes_tree.column('url', width=300)
+changes_tree.column('change', width=400)
+changes_tree.pack(pady=5, padx=10, fill='x')
+
+# Функция для добавления изменения в начало таблицы с обрезкой старых строк
+def add_change_row(changed_at, clients, url, change):
+    changes_tree.insert('', 0, values=(changed_at, clients, url, change))
+    children = changes_tree.get_children()
+    if len(children) > WATCH_CHANGES_LIMIT:
+        changes_tree.delete(*children[WATCH_CHANGES_LIMIT:])
+
+# Функция для загрузки последних изменений из базы
+def update_changes():
+    try:
+        rows = fetch_listing_changes(get_connection(), WATCH_CHANGES_LIMIT)
+    except Exception as e:
+        logging.error(f"Не удалось загрузить изменения объявлений: {e}")
+        return
+    changes_tree.delete(*changes_tree.get_children())
+    for row_id, changed_at, url, clients, field, old_value, new_value in reversed(rows):
+        add_change_row(changed_at, clients or '', url, describe_change(field, old_value, new_value))
+
+# Открытие объявления двойным щелчком по строке
+def open_change_url(event):
+    item = changes_tree.identify_row(event.y)
+    if item:
+        webbrowser.open(changes_tree.set(item, 'url'))
+
+changes_tree.bind("<Double-1>", open_change_url)
 
 # ----- Вкладка "Логи" -----
 log_label = tk.Label(logs_tab, text="Логи:", font=('Arial', 12, 'bold'))
@@ -388,184 +819,151 @@ def copy_description():
 
 tk.Button(description_tab, text="Копировать описание", command=copy_description, font=('Arial', 12)).pack(pady=5, padx=10, anchor='w')
 
-# Основная функция парсинга
-def parse():
-    url = entry_url.get()
-    client_number = entry_client.get()
-    save_path = entry_folder.get()
-    # Удаляем описание из начальной проверки
-    if not url or not client_number or not save_path:
-        messagebox.showwarning("Предупреждение", "Пожалуйста, заполните все поля.")
-        logging.warning("Пользователь не заполнил все поля.")
-        return
-
-    # Валидация URL
-    if not is_valid_url(url):
-        messagebox.showerror("Ошибка", "Введённый URL некорректен.")
-        logging.error(f"Некорректный URL: {url}")
-        return
-
-    # Очистка папки
-    clear_folder(save_path)
-
-    # Настройка прогресс-бара
-    max_images = 200  # Максимальное количество изображений для попыток
-    progress_queue = update_queue
-    progress_queue.put({'type': 'init_progress', 'max_images': max_images})
-
-    # Загрузка страницы
-    try:
-        response = requests.get(url, timeout=10)
-        logging.info(f'Страница загружена: {url} Статус: {response.status_code}')
-    except Exception as e:
-        messagebox.showerror("Ошибка", f"Не удалось загрузить страницу: {e}")
-        logging.error(f"Не удалось загрузить страницу {url}: {e}")
-        progress_queue.put({'type': 'error', 'message': f"Не удалось загрузить страницу: {e}"})
-        return
-
-    if response.status_code == 200:
-        # Парсинг HTML-кода страницы
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        # Парсинг заголовка объявления
-        title_tag = soup.find('h1', class_='offer__title')
-        title = title_tag.get_text(strip=True) if title_tag else ''
-
-        # Парсинг метража
-        size_tag = soup.find('div', class_='offer__advert-title')
-        size = size_tag.get_text(strip=True).split('Оставить')[0].strip() if size_tag else ''
-
-        # Парсинг адреса
-        address_tag = soup.find('div', class_='offer__location')
-        address = address_tag.get_text(strip=True) if address_tag else ''
-
-        # Парсинг цены
-        price_tag = soup.find('div', class_='offer__price')
-        price = price_tag.get_text(strip=True) if price_tag else ''
-
-        # Парсинг точного адреса
-        full_address_tag = soup.find('div', class_='offer__location').find_next('div')
-        full_address = full_address_tag.get_text(strip=True) if full_address_tag else ''
-        full_address = full_address.replace('Адрес', '').strip()  # Удаление лишнего слова "Адрес"
-
-        # Форматирование вывода
-        formatted_output = f"{size}, {full_address}, {price}"
-
-        # Обновление поля описания квартиры
-        description_text.delete(1.0, tk.END)
-        description_text.insert(tk.END, formatted_output)
-
-        # Сохранение истории в базу данных
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        description = formatted_output  # Используем спарсенное описание
-        save_history(client_number, url, current_time, description)
-
-        # Найти первую картинку нужного размера
-        img_tag = soup.find('img', src=re.compile('750x470'))
-        if img_tag:
-            img_url = img_tag['src']
-            # Извлекаем base_url и суффикс из найденной ссылки
-            match = re.match(r'(.*\/)(\d+)(-750x470\.\w+)', img_url)
-            if match:
-                base_url = match.group(1)
-                image_suffix = match.group(3)
-
-                # Логирование готовности папки
-                logging.info(f'Папка для изображений готова: {save_path}')
-
-                downloaded = 0
-                attempted = 0
-
-                for count in range(1, max_images + 1):
-                    image_url = f"{base_url}{count}{image_suffix}"
-                    attempted += 1
-                    try:
-                        img_response = requests.get(image_url, timeout=10)
-                        if img_response.status_code == 200:
-                            # Определение расширения файла из URL
-                            ext = os.path.splitext(image_url)[1]  # включает точку
-                            if not ext:
-                                ext = '.jpg'  # стандартное расширение, если отсутствует
-                            # Генерация уникального имени файла
-                            file_path = os.path.join(save_path, f'image_{count}{ext}')
-                            with open(file_path, 'wb') as f:
-                                f.write(img_response.content)
-                            log_message = f'Скачано изображение: {image_url}\n'
-                            update_queue.put({'type': 'log', 'message': log_message})
-                            logging.info(f'Скачано изображение: {image_url}')
-                            downloaded += 1
-                        else:
-                            log_message = f"Не удалось скачать изображение: {image_url} (Статус: {img_response.status_code})\n"
-                            update_queue.put({'type': 'log', 'message': log_message})
-                            logging.warning(f"Не удалось скачать изображение: {image_url} Статус: {img_response.status_code}")
-                    except Exception as e:
-                        log_message = f"Ошибка при скачивании {image_url}: {e}\n"
-                        update_queue.put({'type': 'log', 'message': log_message})
-                        logging.error(f"Ошибка при скачивании {image_url}: {e}")
-
-                    # Обновление прогресса
-                    update_queue.put({'type': 'update_progress', 'attempted': attempted, 'downloaded': downloaded, 'max_images': max_images})
-
-                # После завершения скачивания
-                completion_message = f'Попытки загрузки завершены. Скачано {downloaded} изображений.\n'
-                update_queue.put({'type': 'log', 'message': completion_message})
-                logging.info(f'Попытки загрузки завершены. Скачано {downloaded} изображений.')
-                update_queue.put({'type': 'complete', 'downloaded': downloaded, 'max_images': max_images})
-            else:
-                log_message = "Не удалось извлечь base_url из ссылки на изображение.\n"
-                update_queue.put({'type': 'log', 'message': log_message})
-                logging.warning("Не удалось извлечь base_url из ссылки на изображение.")
-        else:
-            log_message = "Не удалось найти изображение нужного размера на странице.\n"
-            update_queue.put({'type': 'log', 'message': log_message})
-            logging.warning("Не удалось найти изображение нужного размера на странице.")
-
-# Функция для обработки сообщений из очереди
+# Настройки обработки очереди сообщений: интервал опроса подстраивается под нагрузку,
+# за один проход обрабатывается ограниченное число сообщений, лог хранит ограниченное число строк
+QUEUE_POLL_MIN = 50  # мс, пока идут сообщения
+QUEUE_POLL_MAX = 500  # мс, при простое
+QUEUE_BATCH_LIMIT = 5000
+LOG_MAX_LINES = 5000
+
+queue_poll_interval = QUEUE_POLL_MIN
+
+# Функция для применения последнего снимка прогресса задания
+def apply_progress(job_id, message):
+    attempted = message.get('attempted', 0)
+    downloaded = message.get('downloaded', 0)
+    max_images = message.get('max_images', MAX_IMAGES)
+    if jobs_tree.exists(str(job_id)):
+        jobs_tree.set(str(job_id), 'progress', f"{downloaded} / {max_images}")
+    if job_id is None or job_id == main_job_id:
+        progress_bar['value'] = attempted
+        progress_label.config(text=f"Скачано {downloaded} из {max_images} изображений.")
+
+# Функция для добавления строк в лог одной вставкой с обрезкой старых строк
+def append_log(lines):
+    log_text.insert(tk.END, ''.join(lines))
+    line_count = int(log_text.index('end-1c').split('.')[0])
+    if line_count > LOG_MAX_LINES:
+        log_text.delete(1.0, f"{line_count - LOG_MAX_LINES + 1}.0")
+    log_text.see(tk.END)
+
+# Функция для обработки сообщений из очереди.
+# Прогресс схлопывается (из всех сообщений задания применяется последнее), строки лога
+# собираются и вставляются за один раз.
 def process_queue():
+    global queue_poll_interval
+    pending_progress = {}
+    log_lines = []
+    processed = 0
     try:
-        while True:
+        while processed < QUEUE_BATCH_LIMIT:
             message = update_queue.get_nowait()
+            processed += 1
             msg_type = message.get('type')
+            job_id = message.get('job_id')
+            # Прогресс на вкладке "Основная" показывается только для задания, запущенного с неё
+            is_main_job = job_id is None or job_id == main_job_id
 
             if msg_type == 'init_progress':
-                max_images = message.get('max_images', 200)
-                progress_bar.config(maximum=max_images)
-                progress_bar['value'] = 0
-                progress_label.config(text="Поиск фото...")
+                pending_progress.pop(job_id, None)
+                max_images = message.get('max_images', MAX_IMAGES)
+                if jobs_tree.exists(str(job_id)):
+                    jobs_tree.set(str(job_id), 'progress', f"0 / {max_images}")
+                if is_main_job:
+                    progress_bar.config(maximum=max(max_images, 1))
+                    progress_bar['value'] = 0
+                    progress_label.config(text="Поиск фото...")
 
             elif msg_type == 'update_progress':
-                attempted = message.get('attempted', 0)
-                downloaded = message.get('downloaded', 0)
-                max_images = message.get('max_images', 200)
-                progress_bar['value'] = attempted
-                progress_label.config(text=f"Скачано {downloaded} из {max_images} изображений.")
+                pending_progress[job_id] = message
 
             elif msg_type == 'log':
-                log_message = message.get('message', '')
-                log_text.insert(tk.END, log_message)
-                log_text.see(tk.END)
+                log_lines.append(message.get('message', ''))
+
+            elif msg_type == 'description':
+                description_text.delete(1.0, tk.END)
+                description_text.insert(tk.END, message.get('description', ''))
+
+            elif msg_type == 'job_status':
+                item = str(job_id)
+                status = message.get('status', '')
+                if jobs_tree.exists(item):
+                    jobs_tree.set(item, 'status', status)
+                else:
+                    jobs_tree.insert('', tk.END, iid=item, text=item,
+                                     values=(message.get('client_number', ''), message.get('url', ''), status, ''))
 
             elif msg_type == 'complete':
+                last_progress = pending_progress.pop(job_id, None)
+                if last_progress:
+                    apply_progress(job_id, last_progress)
                 downloaded = message.get('downloaded', 0)
-                max_images = message.get('max_images', 200)
-                progress_label.config(text=f"Загрузка завершена. Скачано {downloaded} изображений.")
-                progress_bar['value'] = max_images
+                max_images = message.get('max_images', MAX_IMAGES)
+                if is_main_job:
+                    progress_label.config(text=f"Загрузка завершена. Скачано {downloaded} изображений.")
+                    progress_bar['value'] = max_images
                 update_reports()
 
+            elif msg_type == 'crawl_status':
+                crawl_status_label.config(
+                    text=f"Страниц: {message.get('pages', 0)}, объявлений: {message.get('found', 0)}, "
+                         f"пропущено спарсенных: {message.get('skipped', 0)}, в очереди: {message.get('queued', 0)}"
+                         + (" (завершён)" if message.get('finished') else ""))
+                if message.get('message'):
+                    log_lines.append(f"Обход: {message['message']}\n")
+
+            elif msg_type == 'watch_status':
+                watch_status_label.config(
+                    text=f"Проходов: {message.get('passes', 0)}, проверено: {message.get('checked', 0)}, "
+                         f"без изменений (304): {message.get('not_modified', 0)}, изменились: {message.get('changed', 0)}, "
+                         f"сняты: {message.get('removed', 0)}, ошибок: {message.get('errors', 0)}"
+                         + (" (остановлено)" if message.get('finished') else ""))
+                if message.get('message'):
+                    log_lines.append(f"Наблюдение: {message['message']}\n")
+
+            elif msg_type == 'listing_changed':
+                clients = ', '.join(message.get('clients', []))
+                for change in message.get('changes', []):
+                    add_change_row(message.get('changed_at', ''), clients, message.get('url', ''), describe_change(*change))
+
+            elif msg_type == 'export_complete':
+                messagebox.showinfo("Успех", f"Выгружено строк: {message.get('rows', 0)}\n{message.get('path', '')}")
+
             elif msg_type == 'error':
                 error_message = message.get('message', '')
-                messagebox.showerror("Ошибка", error_message)
+                # Ошибки пакетных заданий видны в таблице заданий и в логе, без всплывающих окон
+                if is_main_job:
+                    messagebox.showerror("Ошибка", error_message)
+                else:
+                    log_lines.append(f"Задание {job_id}: {error_message}\n")
 
     except queue.Empty:
         pass
     finally:
-        root.after(100, process_queue)  # Проверять очередь каждые 100 мс
+        for job_id, message in pending_progress.items():
+            apply_progress(job_id, message)
+        if log_lines:
+            append_log(log_lines)
+        # Под нагрузкой очередь опрашивается чаще, при простое интервал растёт
+        if processed:
+            queue_poll_interval = QUEUE_POLL_MIN
+        else:
+            queue_poll_interval = min(queue_poll_interval * 2, QUEUE_POLL_MAX)
+        root.after(queue_poll_interval, process_queue)
 
 # Функция для закрытия соединения с базой данных при выходе
 def on_closing():
+    # Начатые проверки наблюдения дописываются в базу до её закрытия
+    if current_watch is not None:
+        current_watch.cancel()
+        current_watch.wait(10)
+    # Прогрев фото упреждающей загрузки прекращается до закрытия хранилища
+    if current_prefetch is not None:
+        cancel_prefetch(current_prefetch)
+        current_prefetch.wait_images(5)
+    scheduler.shutdown()
     try:
-        conn.close()
-        logging.info("Соединение с базой данных закрыто.")
+        close_connection()
     except Exception as e:
         logging.error(f"Ошибка при закрытии базы данных: {e}")
     root.destroy()
@@ -574,7 +972,9 @@ def on_closing():
 root.protocol("WM_DELETE_WINDOW", on_closing)
 
 # Запуск обработки очереди
-root.after(100, process_queue)
+root.after(QUEUE_POLL_MIN, process_queue)
+root.after(HOST_LIMITS_INTERVAL, update_host_limits)
+update_changes()
 
 # Запуск главного цикла
 root.mainloop()
@@ -0,0 +1,175 @@
+"""Обработка скачанных фото: миниатюры, пережатие и перцептивные хеши.
+
+Тяжёлая по процессору работа выполняется в пуле процессов, отдельно от
+потоков загрузки, и использует все ядра. Pillow необязателен: без него
+миниатюры и перцептивные хеши не строятся, а дубликаты ищутся только по
+точному совпадению содержимого (SHA-256 из манифеста папки).
+"""
+import importlib.util
+import logging
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Sequence, Tuple
+
+# Pillow подключается, только если установлен
+PIL_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+# Размеры миниатюр (вписываются с сохранением пропорций), качество JPEG вариантов и папки вариантов
+THUMB_SIZES = ((320, 200),)
+VARIANT_QUALITY = 85
+THUMBS_DIR = 'thumbs'
+COMPRESSED_DIR = 'compressed'
+
+# Перцептивный хеш (dHash) 64 бита; фото с расстоянием Хэмминга не больше порога считаются одинаковыми
+PHASH_SIZE = 8
+PHASH_MAX_DISTANCE = 3
+
+# Количество процессов обработки (по умолчанию по числу ядер)
+POSTPROCESS_WORKERS = os.cpu_count() or 1
+
+
+# Настройки обработки (передаются в процессы пула, поэтому только простые поля)
+class PostprocessOptions:
+    def __init__(self, thumb_sizes: Sequence[Tuple[int, int]] = THUMB_SIZES,
+                 recompress_quality: Optional[int] = None, phash: bool = True,
+                 workers: int = POSTPROCESS_WORKERS):
+        self.thumb_sizes = tuple(tuple(size) for size in thumb_sizes)
+        self.recompress_quality = recompress_quality
+        self.phash = phash
+        self.workers = workers
+
+
+# Функция для вычисления dHash: знаки разностей яркости соседних точек уменьшенного серого изображения
+def dhash(image, size: int = PHASH_SIZE) -> int:
+    from PIL import Image
+    small = image.convert('L').resize((size + 1, size), Image.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+# Функция для расстояния Хэмминга между двумя хешами
+def hamming_distance(first: int, second: int) -> int:
+    return bin(first ^ second).count('1')
+
+
+# Функция для сохранения JPEG-варианта фото
+def _save_variant(image, path: str, quality: int) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(path + '.part', 'JPEG', quality=quality, optimize=True)
+    os.replace(path + '.part', path)
+
+
+# Функция обработки одного фото (выполняется в процессе пула): варианты и перцептивный хеш.
+# Ошибка не прерывает обработку папки, а возвращается в поле error.
+def process_image(file_path: str, options: PostprocessOptions) -> dict:
+    folder, file_name = os.path.split(file_path)
+    stem = os.path.splitext(file_name)[0]
+    result = {'file_name': file_name, 'phash': None, 'width': None, 'height': None, 'variants': [], 'error': None}
+    try:
+        from PIL import Image
+        with Image.open(file_path) as image:
+            result['width'], result['height'] = image.size
+            # Без пережатия полный размер не нужен: JPEG декодируется сразу в уменьшенном масштабе
+            if not options.recompress_quality and options.thumb_sizes:
+                image.draft('RGB', max(options.thumb_sizes))
+            image.load()
+            if options.recompress_quality:
+                path = os.path.join(folder, COMPRESSED_DIR, f'{stem}.jpg')
+                _save_variant(image, path, options.recompress_quality)
+                result['variants'].append(path)
+            for width, height in options.thumb_sizes:
+                thumb = image.copy()
+                thumb.thumbnail((width, height), Image.LANCZOS)
+                path = os.path.join(folder, THUMBS_DIR, f'{stem}_{width}x{height}.jpg')
+                _save_variant(thumb, path, VARIANT_QUALITY)
+                result['variants'].append(path)
+            if options.phash:
+                result['phash'] = dhash(image)
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+# Пул обработки создаётся при первой обработке и переиспользуется всеми заданиями
+_pool: Optional[Executor] = None
+_pool_lock = threading.Lock()
+_use_processes = True
+
+
+# Функция для выбора пула потоков вместо процессов. Нужна, когда дочерний процесс не может
+# безопасно импортировать главный модуль (интерфейс, запущенный из исходников под Windows).
+# Pillow отпускает GIL при декодировании, масштабировании и сжатии, поэтому потоки тоже загружают ядра.
+def set_use_processes(enabled: bool) -> None:
+    global _use_processes
+    _use_processes = enabled
+
+
+def get_pool(workers: int = POSTPROCESS_WORKERS) -> Executor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if _use_processes:
+                _pool = ProcessPoolExecutor(max_workers=max(1, workers))
+            else:
+                _pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+# Функция для параллельной обработки списка фото; при установленном cancel_event
+# ещё не начатые фото снимаются. Результаты возвращаются в порядке готовности.
+def process_images(paths: Sequence[str], options: PostprocessOptions,
+                   cancel_event: Optional[threading.Event] = None) -> List[dict]:
+    if not paths or not PIL_AVAILABLE:
+        return []
+    pool = get_pool(options.workers)
+    futures = [pool.submit(process_image, path, options) for path in paths]
+    results = []
+    for future in as_completed(futures):
+        if cancel_event is not None and cancel_event.is_set():
+            for pending in futures:
+                pending.cancel()
+            break
+        try:
+            results.append(future.result())
+        except BrokenProcessPool as e:
+            # Процесс пула аварийно завершился (например, нехватка памяти): пул пересоздаётся при следующей обработке
+            logging.error(f'Сбой пула обработки фото: {e}')
+            shutdown_pool()
+            break
+    return results
+
+
+# Функция для поиска дубликатов внутри папки: точные (одинаковый SHA-256) и похожие (близкий dHash).
+# images — словари с ключами file_name, sha256 и phash в порядке галереи;
+# возвращает (фото, его более ранний дубликат, расстояние).
+def find_folder_duplicates(images: Sequence[dict],
+                           max_distance: int = PHASH_MAX_DISTANCE) -> List[Tuple[str, str, int]]:
+    duplicates = []
+    for index, image in enumerate(images):
+        for earlier in images[:index]:
+            if image.get('sha256') and image['sha256'] == earlier.get('sha256'):
+                duplicates.append((image['file_name'], earlier['file_name'], 0))
+                break
+            if image.get('phash') is not None and earlier.get('phash') is not None:
+                distance = hamming_distance(image['phash'], earlier['phash'])
+                if distance <= max_distance:
+                    duplicates.append((image['file_name'], earlier['file_name'], distance))
+                    break
+    return duplicates
@@ -0,0 +1,119 @@
+"""Неблокирующее логирование парсера.
+
+Потоки парсера только кладут записи в очередь (QueueHandler), а в файл их пишет
+фоновый поток QueueListener, поэтому загрузка не ждёт диска. Файл лога
+ротируется по размеру или по времени, старые части сжимаются gzip. Записи
+логгеров krisha.* (ход загрузки и строки по каждому фото) из того же события
+попадают и в файл, и в лог интерфейса.
+"""
+import atexit
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+from typing import Optional
+
+# Логгеры строк для интерфейса: ход загрузки и строки по каждому фото
+PROGRESS_LOGGER = 'krisha.progress'
+IMAGE_LOGGER = 'krisha.images'
+UI_LOGGER_PREFIX = 'krisha.'
+
+# Ротация: размер файла лога и число сохраняемых сжатых частей
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# Порог строк по каждому фото: WARNING оставляет только ошибки загрузки
+IMAGE_LOG_LEVEL = logging.INFO
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+
+
+# Функция для имени сжатой части лога
+def _gzip_namer(name: str) -> str:
+    return name + '.gz'
+
+
+# Функция для сжатия части лога при ротации (выполняется в фоновом потоке записи)
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+# Обработчик, передающий строки логгеров krisha.* в очередь сообщений интерфейса
+class UpdateQueueHandler(logging.Handler):
+    def __init__(self, update_queue: queue.Queue, level: int = logging.NOTSET):
+        super().__init__(level)
+        self.update_queue = update_queue
+        self.addFilter(lambda record: record.name.startswith(UI_LOGGER_PREFIX))
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.update_queue.put({'type': 'log', 'message': record.getMessage() + '\n'})
+        except Exception:
+            self.handleError(record)
+
+
+# Функция для настройки логирования: очередь записей, фоновая запись в файл с ротацией и сжатием,
+# строки для интерфейса в update_queue. when ('midnight', 'H' и т. п.) включает ротацию по времени
+# вместо ротации по размеру. Повторный вызов заменяет прежнюю настройку.
+def setup_logging(log_file: str, level: int = logging.DEBUG, update_queue: Optional[queue.Queue] = None,
+                  max_bytes: int = LOG_MAX_BYTES, backup_count: int = LOG_BACKUP_COUNT,
+                  when: Optional[str] = None,
+                  image_level: int = IMAGE_LOG_LEVEL) -> logging.handlers.QueueListener:
+    global _listener, _queue_handler
+    stop_logging()
+
+    if when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(log_file, when=when, backupCount=backup_count,
+                                                                 encoding='utf-8')
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                                            backupCount=backup_count, encoding='utf-8')
+    file_handler.namer = _gzip_namer
+    file_handler.rotator = _gzip_rotator
+    file_handler.setLevel(level)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handlers = [file_handler]
+    if update_queue is not None:
+        handlers.append(UpdateQueueHandler(update_queue))
+
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    logger.addHandler(_queue_handler)
+    logging.getLogger(IMAGE_LOGGER).setLevel(image_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+# Функция для ожидания записи всех накопленных записей (например, перед выходом из командной строки).
+# Поток записи останавливается, дописывая очередь, и запускается снова.
+def flush_logging() -> None:
+    if _listener is not None:
+        _listener.stop()
+        _listener.start()
+
+
+# Функция для остановки фоновой записи: накопленные записи дописываются, файл закрывается
+def stop_logging() -> None:
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,277 @@
+"""Адаптивное ограничение частоты и параллельности запросов к каждому хосту.
+
+Запросы к хосту проходят через ведро токенов (частота) и ограничение числа
+одновременных запросов. Ограничения подстраиваются по принципу AIMD: каждый
+успешный быстрый ответ понемногу поднимает их, а ответы 429/503, сетевые
+ошибки и медленные ответы уменьшают вдвое. Retry-After приостанавливает все
+запросы к хосту. Пока хост ни разу не ограничил нас, частота не ограничена.
+"""
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+
+# Начальное, наименьшее и наибольшее число одновременных запросов к одному хосту
+HOST_CONCURRENCY_START = 16
+HOST_CONCURRENCY_MIN = 1
+HOST_CONCURRENCY_MAX = 32
+
+# Наименьшая частота, запр/с; выше наибольшей ограничение частоты снимается
+HOST_RATE_MIN = 0.5
+HOST_RATE_MAX = 50.0
+
+# Во сколько раз уменьшаются ограничения и не чаще какого интервала, сек: ответы на запросы,
+# отправленные до уменьшения, не должны уменьшать ограничения повторно
+AIMD_DECREASE = 0.5
+DECREASE_INTERVAL = 1.0
+
+# Ответ медленнее этого (до заголовков), сек, считается признаком перегрузки хоста
+SLOW_RESPONSE = 5.0
+
+# Статусы, которыми хост просит снизить нагрузку, и наибольшая пауза по Retry-After, сек
+THROTTLE_STATUSES = (429, 503)
+MAX_PAUSE = 60.0
+
+
+# Функция для ключа хоста по ссылке
+def host_key(url: str) -> str:
+    return (urlsplit(url).hostname or '').lower()
+
+
+# Состояние ограничений одного хоста
+class HostLimit:
+    def __init__(self, host: str, concurrency: float = HOST_CONCURRENCY_START):
+        self.host = host
+        self.concurrency = float(concurrency)
+        self.rate: Optional[float] = None
+        self.tokens = 0.0
+        self.refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.decreased_at = 0.0
+        # Время отправки последних запросов: по нему оценивается частота при первом ограничении
+        self.recent = deque(maxlen=int(HOST_RATE_MAX) * 2)
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.slow = 0
+
+    # Пополнение ведра токенов; запас не больше одной секунды запросов
+    def refill(self, now: float) -> None:
+        if self.rate is not None:
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    # Частота отправки запросов за последнюю секунду
+    def observed_rate(self, now: float) -> float:
+        return float(sum(1 for started in self.recent if now - started <= 1.0))
+
+
+class RateLimiter:
+    def __init__(self, concurrency: float = HOST_CONCURRENCY_START):
+        self.concurrency = concurrency
+        self._hosts: Dict[str, HostLimit] = {}
+        self._changed = threading.Condition()
+
+    def _host(self, host: str) -> HostLimit:
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostLimit(host, self.concurrency)
+        return state
+
+    # Ожидание разрешения на запрос к хосту: пауза по Retry-After, свободное место и токен
+    def acquire(self, host: str) -> None:
+        with self._changed:
+            state = self._host(host)
+            while True:
+                now = time.monotonic()
+                state.refill(now)
+                if state.paused_until > now:
+                    wait = state.paused_until - now
+                elif state.in_flight >= int(state.concurrency):
+                    wait = None
+                elif state.rate is not None and state.tokens < 1.0:
+                    wait = (1.0 - state.tokens) / state.rate
+                else:
+                    if state.rate is not None:
+                        state.tokens -= 1.0
+                    state.in_flight += 1
+                    state.recent.append(now)
+                    return
+                # Ожидание ограничено, чтобы изменения ограничений подхватывались без уведомлений
+                self._changed.wait(min(wait, 0.5) if wait is not None else 0.5)
+
+    # Завершение запроса: место освобождается, ограничения подстраиваются по ответу.
+    # status None означает сетевую ошибку; latency — время до получения заголовков, сек.
+    # hold оставляет место занятым до вызова free (пока передаётся тело потокового ответа).
+    def release(self, host: str, status: Optional[int] = None, latency: Optional[float] = None,
+                retry_after: Optional[float] = None, hold: bool = False) -> None:
+        with self._changed:
+            state = self._host(host)
+            if not hold:
+                state.in_flight = max(0, state.in_flight - 1)
+            state.requests += 1
+            if status is None:
+                state.errors += 1
+                self._decrease(state, 'сетевая ошибка')
+            elif status in THROTTLE_STATUSES:
+                state.throttled += 1
+                self._decrease(state, f'ответ {status}', retry_after)
+            elif latency is not None and latency > SLOW_RESPONSE:
+                state.slow += 1
+                self._decrease(state, f'ответ за {latency:.1f} с')
+            elif status < 500:
+                self._increase(state)
+            self._changed.notify_all()
+
+    # Освобождение места запроса, оставленного занятым в release(hold=True)
+    def free(self, host: str) -> None:
+        with self._changed:
+            state = self._host(host)
+            state.in_flight = max(0, state.in_flight - 1)
+            self._changed.notify_all()
+
+    # Сигнал перегрузки от повтора запроса внутри сессии (место запроса при этом остаётся занятым)
+    def backoff(self, host: str, status: Optional[int] = None, retry_after: Optional[float] = None) -> None:
+        with self._changed:
+            state = self._host(host)
+            if status is None:
+                state.errors += 1
+                self._decrease(state, 'сетевая ошибка')
+            else:
+                state.throttled += 1
+                self._decrease(state, f'ответ {status}', retry_after)
+            self._changed.notify_all()
+
+    # Мультипликативное уменьшение; при первом ограничении частота отсчитывается от фактической
+    def _decrease(self, state: HostLimit, reason: str, retry_after: Optional[float] = None) -> None:
+        now = time.monotonic()
+        if retry_after:
+            pause = min(retry_after, MAX_PAUSE)
+            if now + pause > state.paused_until:
+                state.paused_until = now + pause
+                logging.warning(f'Хост {state.host} попросил паузу {pause:.0f} с (Retry-After)')
+        if now - state.decreased_at < DECREASE_INTERVAL:
+            return
+        state.decreased_at = now
+        rate = state.rate if state.rate is not None else max(state.observed_rate(now), HOST_RATE_MIN)
+        state.rate = max(HOST_RATE_MIN, rate * AIMD_DECREASE)
+        state.tokens = min(state.tokens, 1.0)
+        state.concurrency = max(HOST_CONCURRENCY_MIN, state.concurrency * AIMD_DECREASE)
+        logging.warning(f'Хост {state.host} ограничивает запросы ({reason}): не больше '
+                        f'{state.rate:.1f} запр/с и {int(state.concurrency)} одновременно')
+
+    # Аддитивное увеличение: примерно +1 одновременный запрос за каждое «окно» успешных ответов
+    # и +1 запр/с за секунду успешной работы (на малых частотах медленнее, не больше +0.25 за ответ)
+    @staticmethod
+    def _increase(state: HostLimit) -> None:
+        state.concurrency = min(HOST_CONCURRENCY_MAX, state.concurrency + 1.0 / state.concurrency)
+        if state.rate is not None:
+            state.rate += 1.0 / max(state.rate, 4.0)
+            if state.rate > HOST_RATE_MAX:
+                state.rate = None
+                logging.info(f'Ограничение частоты запросов к хосту {state.host} снято')
+
+    # Текущие ограничения всех хостов (для интерфейса и замеров)
+    def snapshot(self) -> List[dict]:
+        with self._changed:
+            now = time.monotonic()
+            return [{
+                'host': state.host,
+                'rate': state.rate,
+                'concurrency': int(state.concurrency),
+                'in_flight': state.in_flight,
+                'requests': state.requests,
+                'throttled': state.throttled,
+                'errors': state.errors,
+                'slow': state.slow,
+                'paused': max(0.0, state.paused_until - now),
+            } for state in self._hosts.values()]
+
+    # Сброс накопленных ограничений (например, между прогонами бенчмарка)
+    def reset(self) -> None:
+        with self._changed:
+            self._hosts.clear()
+            self._changed.notify_all()
+
+    # Общее число ответов с просьбой снизить нагрузку по всем хостам
+    def throttled_total(self) -> int:
+        with self._changed:
+            return sum(state.throttled for state in self._hosts.values())
+
+
+# Функция для текстового описания ограничений хоста
+def describe_limit(limit: dict) -> str:
+    rate = 'без ограничения' if limit['rate'] is None else f"{limit['rate']:.1f} запр/с"
+    text = (f"{limit['host']}: {rate}, одновременно до {limit['concurrency']} (сейчас {limit['in_flight']}), "
+            f"запросов {limit['requests']}, ограничений {limit['throttled']}, ошибок {limit['errors']}")
+    if limit['paused']:
+        text += f", пауза {limit['paused']:.0f} с"
+    return text
+
+
+# Функция для разбора Retry-After в секундах (число секунд или дата HTTP)
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    from email.utils import parsedate_to_datetime
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment is None:
+        return None
+    return max(0.0, moment.timestamp() - time.time())
+
+
+# HTTP-адаптер, пропускающий каждый запрос через ограничитель хоста. Ограничения подстраиваются
+# по заголовкам ответа, а место потокового запроса (stream=True) занято, пока передаётся тело:
+# оно освобождается, когда тело прочитано целиком или ответ закрыт.
+class ThrottledAdapter(HTTPAdapter):
+    def __init__(self, limiter: RateLimiter, *args, **kwargs):
+        self.limiter = limiter
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        host = host_key(request.url)
+        self.limiter.acquire(host)
+        started = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            self.limiter.release(host)
+            raise
+        hold = bool(kwargs.get('stream')) and not response.raw.closed
+        self.limiter.release(host, response.status_code, time.monotonic() - started,
+                             parse_retry_after(response.headers.get('Retry-After')), hold=hold)
+        if hold:
+            self._free_on_release(response, host)
+        return response
+
+    # Место освобождается один раз: urllib3 отпускает соединение и по концу тела, и при закрытии ответа,
+    # а ответ, который так и не закрыли, освобождает место при сборке мусора
+    def _free_on_release(self, response, host: str) -> None:
+        raw = response.raw
+        release_conn = raw.release_conn
+        once = threading.Lock()
+
+        def free():
+            if once.acquire(blocking=False):
+                self.limiter.free(host)
+
+        def release_and_free():
+            try:
+                release_conn()
+            finally:
+                free()
+
+        raw.release_conn = release_and_free
+        weakref.finalize(response, free)
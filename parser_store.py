@@ -0,0 +1,245 @@
+"""Общее хранилище фото, адресуемое по содержимому.
+
+Каждое фото хранится один раз под именем своего SHA-256, индекс SQLite связывает
+ссылку на фото с хешем содержимого и валидаторами ETag/Last-Modified. Папки
+клиентов заполняются ссылками на файлы хранилища: reflink (копия при записи,
+btrfs/XFS/APFS), жёсткая ссылка или, если ни то ни другое не поддерживается,
+обычная копия. Записи моложе TTL отдаются без обращения к сети, устаревшие
+перепроверяются условным запросом. При превышении общего размера вытесняются
+давно не использованные фото (LRU); жёсткие ссылки в папках клиентов при этом
+остаются рабочими.
+"""
+import errno
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional, Sequence, Tuple
+
+# Время, в течение которого фото из хранилища используется без перепроверки, сек, и предельный размер, байт
+PHOTO_STORE_TTL = 7 * 24 * 60 * 60
+PHOTO_STORE_MAX_BYTES = 5 * 1024 * 1024 * 1024
+
+# Способы заполнения папки клиента в порядке предпочтения
+LINK_MODES = ('reflink', 'hardlink', 'copy')
+
+# Запрос ioctl FICLONE (Linux): клонирование содержимого файла без копирования данных
+FICLONE = 0x40049409
+
+# Ошибки, означающие, что способ не поддерживается для этой пары устройств (другие ошибки —
+# например, занятое имя или предел числа жёстких ссылок на файл — относятся только к одному файлу)
+UNSUPPORTED_ERRNOS = frozenset((errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTTY, errno.EINVAL,
+                                errno.EPERM))
+
+# Число блокировок, по которым распределяются хеши добавляемых фото
+OBJECT_LOCKS = 64
+
+
+# Функция для клонирования файла (reflink); без поддержки файловой системой поднимает OSError
+def reflink(source: str, dest: str) -> None:
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, 'reflink не поддерживается в этой системе')
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(dest)
+            raise
+
+
+class PhotoStore:
+    def __init__(self, root: str, ttl: float = PHOTO_STORE_TTL, max_bytes: int = PHOTO_STORE_MAX_BYTES,
+                 link_modes: Sequence[str] = LINK_MODES):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.link_modes = tuple(link_modes)
+        self.enabled = True
+        self._conn = None
+        self._lock = threading.Lock()
+        # Способы, не сработавшие для пары устройств (st_dev источника и папки): повторно не пробуются
+        self._unsupported = set()
+        # Добавление одного содержимого из разных потоков (одинаковые фото в галерее, одно объявление
+        # для двух клиентов) идёт по очереди: проверка наличия и размещение файла не разделяются
+        self._object_locks = [threading.Lock() for _ in range(OBJECT_LOCKS)]
+
+    # Соединение открывается при первом обращении к хранилищу
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.join(self.root, 'objects'), exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.root, 'index.db'), check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS objects (
+                    sha256 TEXT PRIMARY KEY,
+                    ext TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS sources (
+                    url TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    checked_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_objects_accessed_at ON objects (accessed_at)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_sources_sha256 ON sources (sha256)')
+            self._conn.commit()
+        return self._conn
+
+    # Путь файла хранилища: objects/<первые два символа хеша>/<хеш><расширение>
+    def object_path(self, sha256: str, ext: str) -> str:
+        return os.path.join(self.root, 'objects', sha256[:2], sha256 + ext)
+
+    # Запись хранилища по ссылке на фото; None, если ссылки нет или файл хранилища пропал.
+    # fresh — запись моложе TTL и используется без обращения к сети.
+    def lookup(self, url: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection().execute('''
+                SELECT sources.sha256, objects.ext, objects.size, sources.etag, sources.last_modified,
+                       sources.checked_at
+                FROM sources JOIN objects ON objects.sha256 = sources.sha256
+                WHERE sources.url = ?
+            ''', (url,)).fetchone()
+        if row is None:
+            return None
+        sha256, ext, size, etag, last_modified, checked_at = row
+        path = self.object_path(sha256, ext)
+        try:
+            if os.path.getsize(path) != size:
+                return None
+        except OSError:
+            return None
+        return {'url': url, 'sha256': sha256, 'path': path, 'size': size, 'etag': etag,
+                'last_modified': last_modified, 'fresh': time.time() - checked_at < self.ttl}
+
+    # Отметка об использовании; checked — фото подтверждено сервером (304) и снова считается свежим
+    def touch(self, entry: dict, checked: bool = False) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute('UPDATE objects SET accessed_at = ? WHERE sha256 = ?', (now, entry['sha256']))
+            if checked:
+                conn.execute('UPDATE sources SET checked_at = ? WHERE url = ?', (now, entry['url']))
+            conn.commit()
+
+    # Заполнение файла папки клиента файлом хранилища (существующий файл заменяется атомарно).
+    # Возвращает использованный способ.
+    def link(self, source: str, dest: str) -> str:
+        # Уникальное временное имя: одновременные размещения в один файл не мешают друг другу
+        temp_path = f'{dest}.{uuid.uuid4().hex}.link'
+        device = (os.stat(source).st_dev, os.stat(os.path.dirname(os.path.abspath(dest))).st_dev)
+        for mode in self.link_modes:
+            if (mode, device) in self._unsupported:
+                continue
+            try:
+                if os.path.lexists(temp_path):
+                    os.remove(temp_path)
+                if mode == 'reflink':
+                    reflink(source, temp_path)
+                elif mode == 'hardlink':
+                    os.link(source, temp_path)
+                else:
+                    shutil.copyfile(source, temp_path)
+                os.replace(temp_path, dest)
+                return mode
+            except OSError as e:
+                if os.path.lexists(temp_path):
+                    os.remove(temp_path)
+                if mode == 'copy':
+                    raise
+                if e.errno in UNSUPPORTED_ERRNOS:
+                    self._unsupported.add((mode, device))
+                logging.info(f'Фото хранилища не удалось разместить способом {mode} ({e}), пробуется следующий.')
+        raise OSError(errno.EOPNOTSUPP, 'не задан ни один способ размещения фото')
+
+    # Добавление скачанного файла в хранилище. Новое содержимое переносится в хранилище ссылкой
+    # на тот же файл (данные не копируются, если хранилище на том же устройстве); уже известное
+    # содержимое заменяет файл папки ссылкой на файл хранилища. Возвращает запись хранилища.
+    def add(self, url: str, file_path: str, sha256: str, etag: Optional[str] = None,
+            last_modified: Optional[str] = None) -> dict:
+        ext = os.path.splitext(file_path)[1]
+        size = os.path.getsize(file_path)
+        with self._object_locks[int(sha256[:8], 16) % OBJECT_LOCKS]:
+            with self._lock:
+                row = self._connection().execute('SELECT ext FROM objects WHERE sha256 = ?', (sha256,)).fetchone()
+            if row is not None:
+                ext = row[0]
+            path = self.object_path(sha256, ext)
+            if row is not None and os.path.isfile(path) and os.path.getsize(path) == size:
+                self.link(path, file_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.link(file_path, path)
+            now = time.time()
+            with self._lock:
+                conn = self._connection()
+                conn.execute('''
+                    INSERT INTO objects (sha256, ext, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (sha256) DO UPDATE SET accessed_at = excluded.accessed_at
+                ''', (sha256, ext, size, now, now))
+                conn.execute('''
+                    INSERT OR REPLACE INTO sources (url, sha256, etag, last_modified, checked_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (url, sha256, etag, last_modified, now))
+                conn.commit()
+                self._evict(conn)
+        return {'url': url, 'sha256': sha256, 'path': path, 'size': size, 'etag': etag,
+                'last_modified': last_modified, 'fresh': True}
+
+    # Вытеснение давно не использованных фото при превышении размера
+    def _evict(self, conn: sqlite3.Connection, max_bytes: Optional[int] = None) -> Tuple[int, int]:
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+        if total <= max_bytes:
+            return 0, 0
+        removed = 0
+        freed = 0
+        for sha256, ext, size in conn.execute('SELECT sha256, ext, size FROM objects ORDER BY accessed_at').fetchall():
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(self.object_path(sha256, ext))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f'Не удалось удалить фото хранилища {sha256}: {e}')
+                continue
+            conn.execute('DELETE FROM sources WHERE sha256 = ?', (sha256,))
+            conn.execute('DELETE FROM objects WHERE sha256 = ?', (sha256,))
+            total -= size
+            freed += size
+            removed += 1
+        conn.commit()
+        logging.info(f'Из хранилища фото вытеснено: {removed} фото, {freed / 1048576:.1f} МБ')
+        return removed, freed
+
+    # Сборка мусора: хранилище сокращается до max_bytes (по умолчанию до предельного размера).
+    # Возвращает число удалённых фото и освобождённые байты.
+    def collect_garbage(self, max_bytes: Optional[int] = None) -> Tuple[int, int]:
+        with self._lock:
+            return self._evict(self._connection(), max_bytes)
+
+    # Размер хранилища: число фото, байты и число ссылок на фото
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connection()
+            objects, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects').fetchone()
+            sources = conn.execute('SELECT COUNT(*) FROM sources').fetchone()[0]
+        return {'objects': objects, 'bytes': size, 'sources': sources}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
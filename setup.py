@@ -15,7 +15,7 @@ include_files = [
 
 # Определение опций для cx_Freeze
 build_exe_options = {
-    "packages": ["os", "sys", "sqlite3", "requests", "bs4", "pyperclip", "logging", "re", "shutil", "threading", "queue", "datetime", "tkinter", "urllib", "webbrowser"],
+    "packages": ["os", "sys", "sqlite3", "requests", "bs4", "pyperclip", "logging", "re", "shutil", "threading", "concurrent", "queue", "datetime", "tkinter", "urllib", "webbrowser", "argparse", "multiprocessing", "parser_engine", "parser_cache", "parser_db", "parser_images", "parser_ratelimit", "parser_export", "parser_logging", "parser_store"],
     "include_files": include_files,
     "excludes": []
 }
@@ -30,5 +30,8 @@ setup(
     version = "1.0",
     description = "Программа для парсинга Krisha",
     options = {"build_exe": build_exe_options},
-    executables = [Executable("parser_gui.py", base=base, icon="parser.ico")]
+    executables = [
+        Executable("parser_gui.py", base=base, icon="parser.ico"),
+        Executable("parser_cli.py", base=None, icon="parser.ico"),  # Консольная версия без интерфейса
+    ]
 )
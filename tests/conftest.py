@@ -0,0 +1,107 @@
+"""Общие фикстуры тестов: локальный сервер фото и движок, пишущий во временную папку."""
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser_engine  # noqa: E402
+from parser_store import PhotoStore  # noqa: E402
+
+RANGE_HEADER = re.compile(r'^bytes=(\d+)-$')
+
+
+# Фото сервера: содержимое, ETag и статус, которым сервер отвечает вместо фото (None — отдаёт фото)
+class Photo:
+    def __init__(self, body: bytes, etag: str = None, status: int = None):
+        self.body = body
+        self.etag = etag
+        self.status = status
+
+
+class PhotoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        photo = self.server.photos.get(self.path)
+        self.send_response(photo.status or 200 if photo else 404)
+        self.send_header('Content-Length', str(len(photo.body)) if photo and not photo.status else '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        photo = self.server.photos.get(self.path)
+        if photo is None or photo.status:
+            self.send_response(photo.status if photo else 404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if photo.etag and self.headers.get('If-None-Match') == photo.etag:
+            self.send_response(304)
+            self.send_header('ETag', photo.etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = photo.body
+        status = 200
+        match = RANGE_HEADER.match(self.headers.get('Range', ''))
+        if match and photo.etag and self.headers.get('If-Range') == photo.etag:
+            offset = int(match.group(1))
+            status = 206
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {offset}-{len(body) - 1}/{len(body)}')
+            body = body[offset:]
+        else:
+            self.send_response(status)
+        if photo.etag and self.server.send_etag:
+            self.send_header('ETag', photo.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class PhotoServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), PhotoHandler)
+        self.photos = {}
+        self.requests = []
+        # Отдавать ли ETag в ответах 200/206 (ответ 206 без валидаторов бывает у некоторых CDN)
+        self.send_etag = True
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/photos/'
+
+
+@pytest.fixture
+def photo_server():
+    server = PhotoServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# Движок без повторов запросов и с хранилищем фото во временной папке (по умолчанию выключено)
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    store = PhotoStore(str(tmp_path / 'photo_store'))
+    store.enabled = False
+    monkeypatch.setattr(parser_engine, 'photo_store', store)
+    monkeypatch.setattr(parser_engine, 'session', parser_engine.create_session(retries=0))
+    parser_engine.rate_limiter.reset()
+    yield parser_engine
+    store.close()
+    while not parser_engine.update_queue.empty():
+        parser_engine.update_queue.get_nowait()
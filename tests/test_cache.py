@@ -0,0 +1,79 @@
+"""Кэш страниц: нормализация ссылок, декодирование страниц и условная перепроверка."""
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from parser_cache import PageCache, decode_page, normalize_url
+
+PAGE = '<html><head><meta charset="utf-8"></head><body><div class="offer__price">25 000 000 〒</div></body></html>'
+
+
+def make_response(content: bytes, status: int = 200, headers: dict = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = content
+    response.headers = CaseInsensitiveDict(headers or {'Content-Type': 'text/html'})
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.url = 'https://krisha.kz/a/show/1'
+    return response
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, timeout=None, headers=None):
+        self.requests.append(headers or {})
+        return self.responses.pop(0)
+
+
+def test_normalize_url():
+    assert normalize_url('HTTPS://Krisha.kz:443/a/show/1/?utm_source=x&b=2&a=1#photo') == \
+        'https://krisha.kz/a/show/1?a=1&b=2'
+    assert normalize_url('http://krisha.kz:8080') == 'http://krisha.kz:8080/'
+
+
+def test_decode_page_without_header_charset():
+    response = make_response('<p>Адрес</p>'.encode('utf-8'))
+    assert response.text != '<p>Адрес</p>'
+    assert decode_page(response) == '<p>Адрес</p>'
+
+
+def test_decode_page_uses_meta_charset():
+    content = '<meta http-equiv="Content-Type" content="text/html; charset=windows-1251"><p>Адрес</p>'
+    assert decode_page(make_response(content.encode('cp1251'))).endswith('<p>Адрес</p>')
+
+
+def test_decode_page_prefers_header_charset():
+    response = make_response('Адрес'.encode('cp1251'), headers={'Content-Type': 'text/html; charset=windows-1251'})
+    assert decode_page(response) == 'Адрес'
+
+
+def test_fetch_caches_decoded_page(tmp_path):
+    cache = PageCache(str(tmp_path / 'cache.db'), ttl=0)
+    session = FakeSession(make_response(PAGE.encode('utf-8'), headers={'Content-Type': 'text/html', 'ETag': '"v1"'}),
+                          make_response(b'', 304, {'etag': '"v1"'}))
+
+    first = cache.fetch(session, 'https://krisha.kz/a/show/1')
+    second = cache.fetch(session, 'https://krisha.kz/a/show/1')
+
+    assert first.text == PAGE and not first.from_cache
+    assert session.requests[1] == {'If-None-Match': '"v1"'}
+    assert second.text == PAGE and second.from_cache
+    cache.close()
+
+
+def test_cached_response_headers_are_case_insensitive(tmp_path):
+    cache = PageCache(str(tmp_path / 'cache.db'), ttl=0)
+    headers = {'content-type': 'text/html', 'etag': '"v1"', 'last-modified': 'Sun, 18 Oct 2026 10:00:00 GMT'}
+    session = FakeSession(make_response(PAGE.encode('utf-8'), headers=headers),
+                          make_response(b'', 304, {'etag': '"v1"'}))
+
+    first = cache.fetch(session, 'https://krisha.kz/a/show/1')
+    second = cache.fetch(session, 'https://krisha.kz/a/show/1')
+
+    assert first.headers.get('ETag') == '"v1"'
+    assert first.headers.get('Last-Modified') == 'Sun, 18 Oct 2026 10:00:00 GMT'
+    assert second.headers.get('ETag') == '"v1"'
+    cache.close()
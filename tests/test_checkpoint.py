@@ -0,0 +1,100 @@
+"""Контрольная точка прогона: пропуск готовых фото, докачка запросом Range и запись в историю."""
+import os
+
+from conftest import Photo
+
+SUFFIX = '-750x470.jpg'
+BODY = bytes(range(256)) * 8
+
+
+def prepare(engine, photo_server, tmp_path, indices=(1,)):
+    folder = str(tmp_path / 'folder')
+    os.makedirs(folder)
+    checkpoint = engine.Checkpoint.create(folder, 'https://krisha.kz/a/show/1', photo_server.base_url, SUFFIX,
+                                          list(indices), 'client', '2026-10-18')
+    return folder, checkpoint
+
+
+def start_partial(engine, photo_server, folder, checkpoint, etag='"p1"', size=700):
+    with open(os.path.join(folder, 'image_1.jpg.part'), 'wb') as f:
+        f.write(BODY[:size])
+    checkpoint.mark_partial('image_1.jpg', {'url': photo_server.base_url + '1' + SUFFIX, 'etag': etag,
+                                            'last_modified': None})
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_resume_without_validators_in_206_keeps_if_range_validators(engine, photo_server, tmp_path):
+    photo_server.photos['/photos/1' + SUFFIX] = Photo(BODY, '"p1"')
+    photo_server.send_etag = False
+    folder, checkpoint = prepare(engine, photo_server, tmp_path)
+    start_partial(engine, photo_server, folder, checkpoint)
+
+    downloaded, _ = engine.download_images(photo_server.base_url, SUFFIX, folder, [1], checkpoint=checkpoint)
+
+    assert downloaded == 1
+    headers = photo_server.requests[0][1]
+    assert headers['Range'] == 'bytes=700-' and headers['If-Range'] == '"p1"'
+    assert read(os.path.join(folder, 'image_1.jpg')) == BODY
+    assert engine.load_manifest(folder)['image_1.jpg']['etag'] == '"p1"'
+    assert not os.path.exists(checkpoint.path)
+
+
+def test_changed_photo_is_downloaded_again(engine, photo_server, tmp_path):
+    new_body = b'new photo' * 100
+    photo_server.photos['/photos/1' + SUFFIX] = Photo(new_body, '"p2"')
+    folder, checkpoint = prepare(engine, photo_server, tmp_path)
+    start_partial(engine, photo_server, folder, checkpoint)
+
+    engine.download_images(photo_server.base_url, SUFFIX, folder, [1], checkpoint=checkpoint)
+
+    assert read(os.path.join(folder, 'image_1.jpg')) == new_body
+    assert engine.load_manifest(folder)['image_1.jpg']['etag'] == '"p2"'
+
+
+def test_completed_photos_are_not_requested(engine, photo_server, tmp_path):
+    photo_server.photos['/photos/2' + SUFFIX] = Photo(b'two', '"2"')
+    folder, checkpoint = prepare(engine, photo_server, tmp_path, (1, 2))
+    with open(os.path.join(folder, 'image_1.jpg'), 'wb') as f:
+        f.write(b'one')
+    checkpoint.mark_done('image_1.jpg', {'url': photo_server.base_url + '1' + SUFFIX, 'size': 3})
+
+    downloaded, attempted = engine.download_images(photo_server.base_url, SUFFIX, folder, [1, 2],
+                                                   checkpoint=checkpoint)
+
+    assert (downloaded, attempted) == (2, 2)
+    assert [path for path, _ in photo_server.requests] == ['/photos/2' + SUFFIX]
+
+
+def test_failed_photo_keeps_checkpoint(engine, photo_server, tmp_path):
+    photo_server.photos['/photos/1' + SUFFIX] = Photo(b'', status=500)
+    photo_server.photos['/photos/2' + SUFFIX] = Photo(b'', status=404)
+    folder, checkpoint = prepare(engine, photo_server, tmp_path, (1, 2))
+
+    engine.download_images(photo_server.base_url, SUFFIX, folder, [1, 2], checkpoint=checkpoint)
+
+    resumed = engine.Checkpoint.load(folder)
+    assert resumed is not None
+    assert resumed.missing == [2] and 'image_1.jpg' not in resumed.completed
+
+
+def test_checkpoint_remembers_recorded_client_and_day(engine, tmp_path):
+    folder = str(tmp_path)
+    engine.Checkpoint.create(folder, 'https://krisha.kz/a/show/1', 'https://x/', SUFFIX, [1], 'a', '2026-10-18')
+
+    checkpoint = engine.Checkpoint.load(folder)
+    assert checkpoint.recorded('a', '2026-10-18')
+    assert not checkpoint.recorded('b', '2026-10-18')
+    assert not checkpoint.recorded('a', '2026-10-19')
+
+    checkpoint.mark_recorded('b', '2026-10-19')
+    assert engine.Checkpoint.load(folder).recorded('b', '2026-10-19')
+
+
+def test_old_checkpoint_without_client_is_not_recorded(engine, tmp_path):
+    checkpoint = engine.Checkpoint(str(tmp_path), {'url': 'u', 'base_url': 'b', 'image_suffix': SUFFIX,
+                                                   'indices': [1]})
+    assert not checkpoint.recorded('a', '2026-10-18')
@@ -0,0 +1,26 @@
+"""Обход выдачи поиска: ссылки на объявления и пагинация."""
+from parser_engine import find_listing_links, find_next_page, search_page_url
+
+PAGE_URL = 'https://krisha.kz/prodazha/kvartiry/almaty/?das[rooms]=2&page=2'
+
+
+def test_listing_links_are_absolute_and_unique():
+    html = ('<a href="/a/show/101">1</a><a class="photo" href="/a/show/101">1</a>'
+            '<a href="https://krisha.kz/a/show/102?from=search">2</a><a href="/a/show/abc">x</a>')
+    assert find_listing_links(html, PAGE_URL) == [
+        ('101', 'https://krisha.kz/a/show/101'),
+        ('102', 'https://krisha.kz/a/show/102'),
+    ]
+
+
+def test_next_page_from_rel_next_or_paginator():
+    assert find_next_page('<link rel="next" href="/prodazha/?a=1&amp;page=3">', PAGE_URL) == \
+        'https://krisha.kz/prodazha/?a=1&page=3'
+    assert find_next_page('<a class="btn paginator__btn paginator__btn--next" href="?page=3">Дальше</a>',
+                          PAGE_URL) == 'https://krisha.kz/prodazha/kvartiry/almaty/?page=3'
+    assert find_next_page('<a class="paginator__btn" href="?page=1">1</a>', PAGE_URL) is None
+
+
+def test_search_page_url_replaces_page_parameter():
+    assert search_page_url(PAGE_URL, 3) == 'https://krisha.kz/prodazha/kvartiry/almaty/?das%5Brooms%5D=2&page=3'
+    assert search_page_url(PAGE_URL, 1) == 'https://krisha.kz/prodazha/kvartiry/almaty/?das%5Brooms%5D=2'
@@ -0,0 +1,117 @@
+"""База истории: миграции схемы, поток записи и поиск."""
+import sqlite3
+
+import pytest
+
+import parser_db
+from parser_db import MIGRATIONS, HistoryStore, fts_query, init_db, migrate, search_history
+
+
+def tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")}
+
+
+def test_new_database_gets_all_migrations(tmp_path):
+    conn = init_db(str(tmp_path / 'history.db'))
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+    assert {'history', 'runs', 'run_images', 'image_hashes', 'listings', 'listing_changes',
+            'idx_history_time', 'idx_history_url'} <= tables(conn)
+    conn.close()
+
+
+def test_old_database_is_upgraded_without_losing_rows(tmp_path):
+    path = str(tmp_path / 'history.db')
+    old = sqlite3.connect(path)
+    old.execute('CREATE TABLE history (id INTEGER PRIMARY KEY AUTOINCREMENT, time TEXT NOT NULL, '
+                'client_number TEXT NOT NULL, url TEXT NOT NULL)')
+    old.execute("INSERT INTO history (time, client_number, url) VALUES ('2024-01-01 10:00:00', '7', 'u')")
+    old.commit()
+    old.close()
+
+    conn = init_db(path)
+
+    assert conn.execute('SELECT time, client_number, url, description FROM history').fetchall() == [
+        ('2024-01-01 10:00:00', '7', 'u', None)]
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+    conn.close()
+
+
+def test_migrate_is_idempotent(tmp_path):
+    conn = init_db(str(tmp_path / 'history.db'))
+    before = tables(conn)
+    migrate(conn)
+    assert tables(conn) == before
+    conn.close()
+
+
+def test_history_store_batches_writes_and_isolates_failures(tmp_path):
+    store = HistoryStore(str(tmp_path / 'history.db'))
+    insert = 'INSERT INTO history (time, client_number, url, description) VALUES (?, ?, ?, ?)'
+    good = [store.write(insert, ('2024-01-01 10:00:00', '1', f'u{i}', 'd')) for i in range(3)]
+    bad = store.write('INSERT INTO missing_table VALUES (1)')
+    count = store.run(lambda conn: conn.execute('SELECT COUNT(*) FROM history').fetchone()[0])
+    store.flush(5)
+
+    assert [future.result() for future in good] == [1, 2, 3]
+    with pytest.raises(sqlite3.OperationalError):
+        bad.result()
+    assert count.result() == 3
+    assert store.reader().execute('SELECT COUNT(*) FROM history').fetchone()[0] == 3
+    store.close()
+
+
+def history_with_rows(tmp_path, fts=True):
+    conn = init_db(str(tmp_path / 'history.db'))
+    if not fts:
+        for trigger in ('history_fts_insert', 'history_fts_delete', 'history_fts_update'):
+            conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        conn.execute('DROP TABLE IF EXISTS history_fts')
+    conn.executemany('INSERT INTO history (time, client_number, url, description) VALUES (?, ?, ?, ?)', [
+        ('2024-01-01 10:00:00', '1', 'https://krisha.kz/a/show/11', '2-комнатная, Алматы, Абая 10, 30 млн'),
+        ('2024-01-02 11:00:00', '2', 'https://krisha.kz/a/show/12', '3-комнатная, Астана, Кенесары 5, 45 млн'),
+        ('2024-01-03 12:00:00', '1', 'https://krisha.kz/a/show/13', '1-комнатная, АЛМАТЫ, Сатпаева 1, 20 млн'),
+    ])
+    conn.commit()
+    return conn
+
+
+def urls(rows):
+    return [row[4][-2:] for row in rows]
+
+
+def test_fts_query_quotes_words_as_prefixes():
+    assert fts_query('Абая "10" OR*') == '"Абая"* "10"* "OR"*'
+    assert fts_query('  ') == ''
+
+
+@pytest.mark.parametrize('fts', [True, False])
+def test_search_history(tmp_path, fts):
+    conn = history_with_rows(tmp_path, fts)
+
+    assert urls(search_history(conn, 'алматы')) == ['13', '11']
+    assert urls(search_history(conn, 'алм абая')) == ['11']
+    assert urls(search_history(conn, 'show/12')) == ['12']
+    assert urls(search_history(conn, 'алматы', client_number='1', date_from='2024-01-02')) == ['13']
+    assert urls(search_history(conn, date_to='2024-01-02')) == ['12', '11']
+    conn.close()
+
+
+def test_old_sqlite_without_remove_diacritics_falls_back_to_plain_tokenizer(tmp_path, monkeypatch):
+    # Первый токенизатор отвергается, как remove_diacritics 2 на SQLite до 3.27
+    monkeypatch.setattr(parser_db, 'FTS5_TOKENIZERS', ('unicode61 no_such_option 1', 'unicode61'))
+    conn = history_with_rows(tmp_path)
+
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'history_fts'").fetchone()[0]
+    assert "tokenize='unicode61'" in sql
+    assert urls(search_history(conn, 'алматы')) == ['13', '11']
+    conn.close()
+
+
+def test_rejected_tokenizers_fall_back_to_like_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(parser_db, 'FTS5_TOKENIZERS', ('unicode61 no_such_option 1',))
+    conn = history_with_rows(tmp_path)
+
+    assert 'history_fts' not in tables(conn)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+    assert urls(search_history(conn, 'алматы')) == ['13', '11']
+    conn.close()
@@ -0,0 +1,36 @@
+"""Поиск номеров фото галереи на странице и пробными запросами."""
+import parser_engine
+from conftest import Photo
+
+SUFFIX = '-750x470.jpg'
+BASE_URL = 'https://alakt-photos-kr.kcdn.kz/webp/1a/1a2b/'
+
+
+def test_indices_from_img_tags_of_any_size():
+    html = (f'<img src="{BASE_URL}3-750x470.jpg"><img src="{BASE_URL}1-120x90.jpg">'
+            f'<img src="{BASE_URL}2-750x470.webp"><img src="https://other.kz/webp/9-750x470.jpg">')
+    assert parser_engine.find_gallery_indices(html, BASE_URL) == [1, 2, 3]
+
+
+def test_indices_from_escaped_json():
+    html = ('{"photos":[{"src":"\\/\\/alakt-photos-kr.kcdn.kz\\/webp\\/1a\\/1a2b\\/4-750x470.jpg"},'
+            '{"src":"//alakt-photos-kr.kcdn.kz/webp/1a/1a2b/5-280x175.jpg"}]}')
+    assert parser_engine.find_gallery_indices(html, BASE_URL) == [4, 5]
+
+
+def test_discover_gallery_uses_page_when_several_photos_found(engine):
+    html = ''.join(f'<img src="{BASE_URL}{count}-750x470.jpg">' for count in (1, 2, 5))
+    assert engine.discover_gallery(html, BASE_URL, SUFFIX) == [1, 2, 5]
+
+
+def test_discover_gallery_probes_when_only_cover_found(engine, photo_server):
+    for count in range(1, 12):
+        photo_server.photos[f'/photos/{count}{SUFFIX}'] = Photo(b'photo')
+    html = f'<img src="{photo_server.base_url}1{SUFFIX}">'
+
+    assert engine.discover_gallery(html, photo_server.base_url, SUFFIX, max_images=50) == list(range(1, 12))
+    assert len(photo_server.requests) < 11
+
+
+def test_probe_empty_gallery(engine, photo_server):
+    assert engine.probe_gallery_size(photo_server.base_url, SUFFIX) == 0
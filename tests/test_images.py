@@ -0,0 +1,41 @@
+"""Обработка фото после загрузки: перцептивный хеш и поиск дубликатов в папке."""
+import pytest
+
+from parser_images import PHASH_MAX_DISTANCE, dhash, find_folder_duplicates, hamming_distance
+
+
+def test_hamming_distance():
+    assert hamming_distance(0b1011, 0b0001) == 2
+    assert hamming_distance(1 << 63, 0) == 1
+
+
+def test_exact_and_near_duplicates_point_to_earliest_photo():
+    images = [
+        {'file_name': 'image_1.jpg', 'sha256': 'a', 'phash': 0},
+        {'file_name': 'image_2.jpg', 'sha256': 'b', 'phash': 0xFFFF0000},
+        {'file_name': 'image_3.jpg', 'sha256': 'a', 'phash': 0},
+        {'file_name': 'image_4.jpg', 'sha256': 'c', 'phash': 0b111},
+        {'file_name': 'image_5.jpg', 'sha256': 'd', 'phash': 0b1111},
+    ]
+    assert find_folder_duplicates(images) == [
+        ('image_3.jpg', 'image_1.jpg', 0),
+        ('image_4.jpg', 'image_1.jpg', 3),
+        ('image_5.jpg', 'image_4.jpg', 1),
+    ]
+    assert PHASH_MAX_DISTANCE == 3
+
+
+def test_photos_without_hashes_are_not_duplicates():
+    images = [{'file_name': 'image_1.jpg', 'sha256': None, 'phash': None},
+              {'file_name': 'image_2.jpg', 'sha256': None, 'phash': None}]
+    assert find_folder_duplicates(images) == []
+
+
+def test_dhash_survives_resize_and_recompression():
+    Image = pytest.importorskip('PIL.Image')
+    image = Image.linear_gradient('L').rotate(30).convert('RGB')
+    smaller = image.resize((120, 90))
+    other = image.transpose(Image.FLIP_LEFT_RIGHT)
+
+    assert hamming_distance(dhash(image), dhash(smaller)) <= PHASH_MAX_DISTANCE
+    assert hamming_distance(dhash(image), dhash(other)) > PHASH_MAX_DISTANCE
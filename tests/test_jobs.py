@@ -0,0 +1,52 @@
+"""Список заданий пакета и планировщик заданий."""
+import threading
+
+import parser_engine
+from parser_engine import JOB_CANCELLED, JOB_DONE, JobScheduler, parse_job_lines
+
+
+def test_parse_job_lines():
+    text = '''
+        # комментарий
+        https://krisha.kz/a/show/1;101;C:\\Клиенты\\101
+        https://krisha.kz/a/show/2\t102
+        https://krisha.kz/a/show/3 ; 103 ;
+        не ссылка;104;C:\\Клиенты
+        https://krisha.kz/a/show/5;;C:\\Клиенты
+    '''
+    assert parse_job_lines(text, 'D:\\Фото') == [
+        ('https://krisha.kz/a/show/1', '101', 'C:\\Клиенты\\101'),
+        ('https://krisha.kz/a/show/2', '102', 'D:\\Фото'),
+        ('https://krisha.kz/a/show/3', '103', 'D:\\Фото'),
+    ]
+
+
+def test_lines_without_folder_are_skipped_without_default():
+    assert parse_job_lines('https://krisha.kz/a/show/1;101') == []
+
+
+def test_scheduler_runs_and_cancels_jobs(monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+
+    def fake_parse(job):
+        started.set()
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(parser_engine, 'parse_listing', fake_parse)
+    scheduler = JobScheduler(max_jobs=1, host_interval=0)
+    try:
+        first = scheduler.submit('https://krisha.kz/a/show/1', '101', 'folder_1')
+        second = scheduler.submit('https://krisha.kz/a/show/2', '101', 'folder_2')
+        assert started.wait(5)
+        scheduler.cancel(second.id)
+        release.set()
+
+        assert first.wait(5) and second.wait(5)
+        assert first.status == JOB_DONE
+        assert second.status == JOB_CANCELLED
+    finally:
+        scheduler.shutdown()
+        while not parser_engine.update_queue.empty():
+            parser_engine.update_queue.get_nowait()
@@ -0,0 +1,49 @@
+"""Упреждающая загрузка ссылки из поля ввода."""
+from conftest import Photo
+
+SUFFIX = '-750x470.jpg'
+
+
+def serve_listing(photo_server, photos=6):
+    gallery = ''.join(f'<img src="{photo_server.base_url}{count}{SUFFIX}">' for count in range(1, photos + 1))
+    page = (f'<h1 class="offer__title">Квартира</h1><div class="offer__advert-title">54 м²</div>'
+            f'<div class="offer__location">Алматы</div><div>Адрес Абая 10</div>'
+            f'<div class="offer__price">30 млн</div>{gallery}')
+    photo_server.photos['/a/show/1'] = Photo(page.encode('utf-8'), '"page"')
+    for count in range(1, photos + 1):
+        photo_server.photos[f'/photos/{count}{SUFFIX}'] = Photo(b'photo %d' % count, f'"{count}"')
+    return photo_server.base_url.replace('/photos/', '/a/show/1')
+
+
+def test_prefetch_parses_page_and_warms_first_photos(engine, photo_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, 'page_cache', engine.PageCache(str(tmp_path / 'cache.db'), ttl=0))
+    engine.photo_store.enabled = True
+    url = serve_listing(photo_server)
+
+    prefetch = engine.start_prefetch(url)
+    assert engine.start_prefetch(url + '#photo') is prefetch
+    assert prefetch.wait_images(10)
+
+    data = prefetch.result()
+    assert data['listing']['price'] == '30 млн'
+    assert data['indices'] == [1, 2, 3, 4, 5, 6]
+    assert prefetch.warmed == engine.PREFETCH_IMAGES
+    assert engine.photo_store.lookup(f'{photo_server.base_url}1{SUFFIX}')['fresh']
+    assert engine.photo_store.lookup(f'{photo_server.base_url}6{SUFFIX}') is None
+
+    assert engine.take_prefetch(url) is prefetch
+    assert engine.take_prefetch(url) is None
+    engine.page_cache.close()
+
+
+def test_cancelled_prefetch_is_not_taken(engine, photo_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, 'page_cache', engine.PageCache(str(tmp_path / 'cache.db'), ttl=0))
+    url = serve_listing(photo_server)
+
+    prefetch = engine.start_prefetch(url)
+    engine.cancel_prefetch(prefetch)
+
+    assert engine.take_prefetch(url) is None
+    assert prefetch.wait_images(10)
+    assert prefetch.result() is None
+    engine.page_cache.close()
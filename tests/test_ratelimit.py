@@ -0,0 +1,87 @@
+"""Ограничитель нагрузки на хосты: Retry-After, AIMD и занятость мест потоковыми ответами."""
+import time
+from email.utils import formatdate
+
+import pytest
+
+from conftest import Photo
+from parser_ratelimit import (
+    AIMD_DECREASE, HOST_CONCURRENCY_START, HOST_RATE_MIN, SLOW_RESPONSE, RateLimiter, host_key, parse_retry_after,
+)
+
+
+def in_flight(limiter, host='127.0.0.1'):
+    return {limit['host']: limit['in_flight'] for limit in limiter.snapshot()}.get(host, 0)
+
+
+def test_host_key():
+    assert host_key('https://Krisha.KZ/a/show/1') == 'krisha.kz'
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('120') == 120.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(formatdate(time.time() + 30, usegmt=True)) == pytest.approx(30, abs=2)
+    assert parse_retry_after(formatdate(time.time() - 30, usegmt=True)) == 0.0
+
+
+def test_throttle_halves_limits():
+    limiter = RateLimiter()
+    limiter.acquire('host')
+    limiter.release('host', 429)
+    limit = limiter.snapshot()[0]
+    assert limit['concurrency'] == int(HOST_CONCURRENCY_START * AIMD_DECREASE)
+    assert limit['rate'] == HOST_RATE_MIN and limit['throttled'] == 1
+
+
+def test_fast_successes_raise_concurrency():
+    limiter = RateLimiter()
+    for _ in range(2 * HOST_CONCURRENCY_START):
+        limiter.acquire('host')
+        limiter.release('host', 200, 0.01)
+    assert limiter.snapshot()[0]['concurrency'] > HOST_CONCURRENCY_START
+
+
+def test_slow_response_lowers_limits():
+    limiter = RateLimiter()
+    limiter.acquire('host')
+    limiter.release('host', 200, SLOW_RESPONSE + 1)
+    assert limiter.snapshot()[0]['slow'] == 1
+    assert limiter.snapshot()[0]['concurrency'] < HOST_CONCURRENCY_START
+
+
+def test_retry_after_pauses_host():
+    limiter = RateLimiter()
+    limiter.acquire('host')
+    limiter.release('host', 503, retry_after=5)
+    assert limiter.snapshot()[0]['paused'] == pytest.approx(5, abs=0.5)
+
+
+def test_held_slot_is_freed_once():
+    limiter = RateLimiter()
+    limiter.acquire('host')
+    limiter.release('host', 200, 0.01, hold=True)
+    assert in_flight(limiter, 'host') == 1
+    limiter.free('host')
+    assert in_flight(limiter, 'host') == 0
+
+
+def test_streamed_body_holds_host_slot(engine, photo_server):
+    photo_server.photos['/photos/1.jpg'] = Photo(b'x' * 300000, '"1"')
+    url = photo_server.base_url + '1.jpg'
+
+    with engine.session.get(url, stream=True) as response:
+        assert in_flight(engine.rate_limiter) == 1
+        for _ in response.iter_content(65536):
+            pass
+    assert in_flight(engine.rate_limiter) == 0
+
+    engine.session.get(url)
+    engine.session.head(url)
+    assert in_flight(engine.rate_limiter) == 0
+
+    response = engine.session.get(url, stream=True)
+    assert in_flight(engine.rate_limiter) == 1
+    del response
+    assert in_flight(engine.rate_limiter) == 0
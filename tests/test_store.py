@@ -0,0 +1,172 @@
+"""Общее хранилище фото: размещение ссылками, выбор способа, одновременное добавление и вытеснение."""
+import errno
+import hashlib
+import os
+import threading
+
+import pytest
+
+import parser_store
+from conftest import Photo
+from parser_store import PhotoStore
+
+
+def write_photo(path, body):
+    with open(path, 'wb') as f:
+        f.write(body)
+    return hashlib.sha256(body).hexdigest()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PhotoStore(str(tmp_path / 'store'), link_modes=('hardlink', 'copy'))
+    yield store
+    store.close()
+
+
+def test_add_and_lookup(store, tmp_path):
+    path = str(tmp_path / 'image_1.jpg')
+    sha256 = write_photo(path, b'photo')
+
+    store.add('http://x/1.jpg', path, sha256, '"e"')
+    stored = store.lookup('http://x/1.jpg')
+
+    assert stored['fresh'] and stored['etag'] == '"e"'
+    assert os.path.samefile(stored['path'], path)
+    assert store.lookup('http://x/2.jpg') is None
+
+
+def test_known_content_is_linked_into_folder(store, tmp_path):
+    first = str(tmp_path / 'a.jpg')
+    second = str(tmp_path / 'b.jpg')
+    sha256 = write_photo(first, b'same')
+    write_photo(second, b'same')
+
+    store.add('http://x/1.jpg', first, sha256)
+    store.add('http://x/2.jpg', second, sha256)
+
+    assert os.path.samefile(first, second)
+    assert store.stats() == {'objects': 1, 'bytes': 4, 'sources': 2}
+
+
+def test_stale_entry_is_not_fresh(tmp_path):
+    store = PhotoStore(str(tmp_path / 'store'), ttl=0)
+    path = str(tmp_path / 'a.jpg')
+    store.add('http://x/1.jpg', path, write_photo(path, b'photo'))
+
+    assert store.lookup('http://x/1.jpg')['fresh'] is False
+    store.close()
+
+
+def test_per_file_link_error_does_not_disable_mode(store, tmp_path, monkeypatch):
+    source = str(tmp_path / 'a.jpg')
+    write_photo(source, b'photo')
+    real_link = os.link
+    calls = []
+
+    def failing_link(src, dst):
+        calls.append(dst)
+        if len(calls) == 1:
+            raise OSError(errno.EMLINK, 'Too many links')
+        real_link(src, dst)
+
+    monkeypatch.setattr(parser_store.os, 'link', failing_link)
+
+    assert store.link(source, str(tmp_path / 'b.jpg')) == 'copy'
+    assert store.link(source, str(tmp_path / 'c.jpg')) == 'hardlink'
+    assert not store._unsupported
+
+
+def test_unsupported_mode_is_remembered(store, tmp_path, monkeypatch):
+    source = str(tmp_path / 'a.jpg')
+    write_photo(source, b'photo')
+    calls = []
+
+    def cross_device_link(src, dst):
+        calls.append(dst)
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+    monkeypatch.setattr(parser_store.os, 'link', cross_device_link)
+
+    assert store.link(source, str(tmp_path / 'b.jpg')) == 'copy'
+    assert store.link(source, str(tmp_path / 'c.jpg')) == 'copy'
+    assert len(calls) == 1
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.link')]
+
+
+def test_concurrent_add_of_same_content(store, tmp_path):
+    paths = [str(tmp_path / f'image_{i}.jpg') for i in range(16)]
+    sha256 = [write_photo(path, b'duplicate photo') for path in paths][0]
+    barrier = threading.Barrier(len(paths))
+    errors = []
+
+    def add(index):
+        barrier.wait()
+        try:
+            store.add(f'http://x/{index}.jpg', paths[index], sha256)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add, args=(index,)) for index in range(len(paths))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert not store._unsupported
+    stored = store.lookup('http://x/0.jpg')['path']
+    assert all(os.path.samefile(stored, path) for path in paths)
+    assert store.stats()['objects'] == 1
+
+
+def test_collect_garbage_evicts_least_recently_used(store, tmp_path):
+    old = str(tmp_path / 'old.jpg')
+    new = str(tmp_path / 'new.jpg')
+    store.add('http://x/old.jpg', old, write_photo(old, b'a' * 10))
+    store.add('http://x/new.jpg', new, write_photo(new, b'b' * 10))
+    store.touch(store.lookup('http://x/new.jpg'))
+
+    removed, freed = store.collect_garbage(max_bytes=10)
+
+    assert (removed, freed) == (1, 10)
+    assert store.lookup('http://x/old.jpg') is None
+    assert store.lookup('http://x/new.jpg') is not None
+    assert (tmp_path / 'old.jpg').read_bytes() == b'a' * 10
+
+
+def test_second_folder_is_filled_from_store(engine, photo_server, tmp_path):
+    suffix = '-750x470.jpg'
+    engine.photo_store.enabled = True
+    engine.photo_store.link_modes = ('hardlink', 'copy')
+    for count in (1, 2):
+        photo_server.photos[f'/photos/{count}{suffix}'] = Photo(b'photo %d' % count, f'"{count}"')
+    first, second = str(tmp_path / 'client_1'), str(tmp_path / 'client_2')
+    os.makedirs(first)
+    os.makedirs(second)
+
+    engine.download_images(photo_server.base_url, suffix, first, [1, 2])
+    photo_server.requests.clear()
+    downloaded, _ = engine.download_images(photo_server.base_url, suffix, second, [1, 2])
+
+    assert downloaded == 2 and photo_server.requests == []
+    assert os.path.samefile(os.path.join(first, 'image_1.jpg'), os.path.join(second, 'image_1.jpg'))
+    assert engine.load_manifest(second)['image_2.jpg']['etag'] == '"2"'
+
+
+def test_stale_store_entry_is_revalidated(engine, photo_server, tmp_path):
+    suffix = '-750x470.jpg'
+    engine.photo_store.enabled = True
+    engine.photo_store.ttl = 0
+    photo_server.photos['/photos/1' + suffix] = Photo(b'photo', '"1"')
+    first, second = str(tmp_path / 'client_1'), str(tmp_path / 'client_2')
+    os.makedirs(first)
+    os.makedirs(second)
+
+    engine.download_images(photo_server.base_url, suffix, first, [1])
+    photo_server.requests.clear()
+    downloaded, _ = engine.download_images(photo_server.base_url, suffix, second, [1])
+
+    assert downloaded == 1
+    assert photo_server.requests[0][1].get('If-None-Match') == '"1"'
+    assert (tmp_path / 'client_2' / 'image_1.jpg').read_bytes() == b'photo'
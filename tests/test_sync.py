@@ -0,0 +1,70 @@
+"""Синхронизация папки по манифесту: условные запросы и удаление устаревших фото."""
+import os
+
+from conftest import Photo
+
+SUFFIX = '-750x470.jpg'
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_first_run_writes_manifest(engine, photo_server, tmp_path):
+    photo_server.photos['/photos/1' + SUFFIX] = Photo(b'one', '"1"')
+    photo_server.photos['/photos/2' + SUFFIX] = Photo(b'two', '"2"')
+    folder = str(tmp_path / 'folder')
+    os.makedirs(folder)
+
+    downloaded, attempted = engine.download_images(photo_server.base_url, SUFFIX, folder, [1, 2], sync=True)
+
+    assert (downloaded, attempted) == (2, 2)
+    manifest = engine.load_manifest(folder)
+    assert manifest['image_1.jpg']['etag'] == '"1"'
+    assert read(os.path.join(folder, 'image_2.jpg')) == b'two'
+
+
+def test_unchanged_photos_are_revalidated(engine, photo_server, tmp_path):
+    photo_server.photos['/photos/1' + SUFFIX] = Photo(b'one', '"1"')
+    folder = str(tmp_path / 'folder')
+    os.makedirs(folder)
+    engine.download_images(photo_server.base_url, SUFFIX, folder, [1], sync=True)
+    photo_server.requests.clear()
+
+    downloaded, _ = engine.download_images(photo_server.base_url, SUFFIX, folder, [1], sync=True)
+
+    assert downloaded == 1
+    assert photo_server.requests[0][1].get('If-None-Match') == '"1"'
+    assert read(os.path.join(folder, 'image_1.jpg')) == b'one'
+
+
+def test_photo_removed_from_gallery_is_deleted(engine, photo_server, tmp_path):
+    photo_server.photos['/photos/1' + SUFFIX] = Photo(b'one', '"1"')
+    photo_server.photos['/photos/2' + SUFFIX] = Photo(b'two', '"2"')
+    folder = str(tmp_path / 'folder')
+    os.makedirs(folder)
+    engine.download_images(photo_server.base_url, SUFFIX, folder, [1, 2], sync=True)
+    photo_server.photos['/photos/2' + SUFFIX] = Photo(b'', status=404)
+
+    engine.download_images(photo_server.base_url, SUFFIX, folder, [1, 2], sync=True)
+
+    assert os.path.exists(os.path.join(folder, 'image_1.jpg'))
+    assert not os.path.exists(os.path.join(folder, 'image_2.jpg'))
+    assert 'image_2.jpg' not in engine.load_manifest(folder)
+
+
+def test_temporary_server_error_keeps_photo(engine, photo_server, tmp_path):
+    photo_server.photos['/photos/1' + SUFFIX] = Photo(b'one', '"1"')
+    folder = str(tmp_path / 'folder')
+    os.makedirs(folder)
+    engine.download_images(photo_server.base_url, SUFFIX, folder, [1], sync=True)
+
+    for status in (500, 429, 503):
+        photo_server.photos['/photos/1' + SUFFIX] = Photo(b'', status=status)
+        engine.rate_limiter.reset()
+        downloaded, _ = engine.download_images(photo_server.base_url, SUFFIX, folder, [1], sync=True)
+
+        assert downloaded == 0
+        assert read(os.path.join(folder, 'image_1.jpg')) == b'one'
+        assert engine.load_manifest(folder)['image_1.jpg']['etag'] == '"1"'
@@ -0,0 +1,115 @@
+"""Наблюдение за объявлениями: запись изменений полей и проверка объявления условным запросом."""
+import pytest
+
+from conftest import Photo
+from parser_db import (
+    LISTING_REMOVED, HistoryStore, fetch_listing_changes, fetch_watch_candidates, init_db, record_listing,
+    sync_listings,
+)
+
+PAGE = '''<html><body>
+<h1 class="offer__title">2-комнатная квартира, 54 м², Абая 10</h1>
+<div class="offer__advert-title">54 м² Оставить заметку</div>
+<div class="offer__location">Алматы, Бостандыкский р-н</div>
+<div>Адрес Абая 10</div>
+<div class="offer__price">{price}</div>
+<img src="https://photos.kz/webp/1/1-750x470.jpg">
+</body></html>'''
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = init_db(str(tmp_path / 'history.db'))
+    yield conn
+    conn.close()
+
+
+def test_first_fill_is_not_a_change(conn):
+    assert record_listing(conn, 'u', '2024-01-01 10:00:00') == []
+    assert record_listing(conn, 'u', '2024-01-01 11:00:00', {'price': '30 млн', 'title': 'Квартира'}) == []
+
+
+def test_field_changes_are_recorded(conn):
+    record_listing(conn, 'u', '2024-01-01 10:00:00', {'price': '30\xa0млн', 'title': 'Квартира'})
+
+    assert record_listing(conn, 'u', '2024-01-02 10:00:00', {'price': '30 млн', 'title': ''}) == []
+    changes = record_listing(conn, 'u', '2024-01-03 10:00:00', {'price': '28 млн'}, LISTING_REMOVED)
+
+    assert changes == [('price', '30 млн', '28 млн'), ('status', 'active', 'removed')]
+    assert [row[4:] for row in fetch_listing_changes(conn)] == [('status', 'active', 'removed'),
+                                                                ('price', '30 млн', '28 млн')]
+
+
+def test_watch_candidates(conn):
+    conn.executemany('INSERT INTO history (time, client_number, url, description) VALUES (?, ?, ?, ?)', [
+        ('2024-01-01 10:00:00', '1', 'a', ''), ('2024-01-01 11:00:00', '2', 'a', ''),
+        ('2024-01-01 12:00:00', '1', 'b', ''), ('2024-01-01 13:00:00', '1', 'c', ''),
+    ])
+    assert sync_listings(conn) == 3
+    assert sync_listings(conn) == 0
+    record_listing(conn, 'a', '2024-01-05 00:00:00', etag='"e"')
+    record_listing(conn, 'b', '2024-01-02 00:00:00')
+    record_listing(conn, 'c', '2024-01-01 00:00:00', status=LISTING_REMOVED)
+
+    assert fetch_watch_candidates(conn, '2024-01-03 00:00:00') == [('b', None, None, None)]
+    assert [row[0] for row in fetch_watch_candidates(conn, '2024-01-06 00:00:00')] == ['b', 'a']
+
+
+def test_check_listing_outcomes(engine, photo_server):
+    url = photo_server.base_url.replace('/photos/', '/a/show/1')
+    photo_server.photos['/a/show/1'] = Photo(PAGE.format(price='30 млн 〒').encode('utf-8'), '"v1"')
+
+    fetched = engine.check_listing(url)
+    assert fetched['outcome'] == engine.CHECK_FETCHED
+    assert fetched['fields']['price'] == '30 млн 〒'
+    assert fetched['etag'] == '"v1"'
+
+    assert engine.check_listing(url, etag='"v1"')['outcome'] == engine.CHECK_NOT_MODIFIED
+    assert engine.check_listing(url, content_hash=fetched['content_hash'])['outcome'] == engine.CHECK_UNCHANGED
+
+    photo_server.photos['/a/show/1'] = Photo(PAGE.format(price='28 млн 〒').encode('utf-8'), '"v2"')
+    changed = engine.check_listing(url, etag='"v1"', content_hash=fetched['content_hash'])
+    assert changed['outcome'] == engine.CHECK_FETCHED and changed['fields']['price'] == '28 млн 〒'
+
+    photo_server.photos['/a/show/1'] = Photo(b'', status=404)
+    assert engine.check_listing(url)['outcome'] == engine.CHECK_REMOVED
+
+
+def failing_extract(extract):
+    def extract_listing(html):
+        if 'broken' in html:
+            raise ValueError('не удалось разобрать страницу')
+        return extract(html)
+    return extract_listing
+
+
+def test_check_listing_reports_parse_error(engine, photo_server, monkeypatch):
+    monkeypatch.setattr(engine, 'extract_listing', failing_extract(engine.extract_listing))
+    url = photo_server.base_url.replace('/photos/', '/a/show/1')
+    photo_server.photos['/a/show/1'] = Photo(PAGE.format(price='broken').encode('utf-8'), '"v1"')
+
+    result = engine.check_listing(url, content_hash='old')
+
+    assert result['outcome'] == engine.CHECK_ERROR
+    assert 'не удалось разобрать' in result['error']
+    assert result['content_hash'] is None
+
+
+def test_watch_pass_continues_after_bad_page(engine, photo_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, 'history', HistoryStore(str(tmp_path / 'history.db')))
+    monkeypatch.setattr(engine, 'extract_listing', failing_extract(engine.extract_listing))
+    urls = []
+    for listing_id, price in ((1, 'broken'), (2, '30 млн')):
+        photo_server.photos[f'/a/show/{listing_id}'] = Photo(PAGE.format(price=price).encode('utf-8'))
+        urls.append(photo_server.base_url.replace('/photos/', f'/a/show/{listing_id}'))
+        engine.save_history('1', urls[-1], '2024-01-01 10:00:00', '')
+
+    watch = engine.start_watch(workers=2, once=True, force=True)
+    assert watch.wait(10)
+    engine.history.flush()
+
+    assert watch.checked == 2
+    assert watch.counts[engine.CHECK_ERROR] == 1 and watch.counts[engine.CHECK_FETCHED] == 1
+    price = engine.history.reader().execute('SELECT price FROM listings WHERE url = ?', (urls[1],)).fetchone()
+    assert price == ('30 млн',)
+    engine.history.close()